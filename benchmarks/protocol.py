@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+
+from benchmarks.receive_buffer import RingProtocol
+from pypactl.command import Command
+from pypactl.cvolume import Cvolume
+from pypactl.fake_server import FakeServer, LoadProfile, encode_structure
+from pypactl.format_info import FormatInfo
+from pypactl.native_protocol import NativeProtocol
+from pypactl import native_protocol_sink_info
+from pypactl.packet import Packet
+from pypactl.protocol import Protocol
+from pypactl.subscription_event_type import SubscriptionEventType
+from pypactl.wire_capture import NullTransport
+
+# Run from the top of the repository, so pypactl and benchmarks are both
+# importable:
+#
+#     python -m benchmarks.protocol
+#     python -m benchmarks.protocol --output before.json
+#     python -m benchmarks.protocol --baseline before.json
+#
+# Each benchmark returns (function, operations per call). Results are the
+# best time per operation over --repeat calls.
+BENCHMARKS = {}
+# The loop protocols are made with, though nothing is run on it. main()
+# creates it and closes it at the end.
+loop = None
+
+def benchmark(name):
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def build_packet(add, count):
+    packet = Packet()
+    for i in range(count):
+        add(packet, i)
+    return bytes(packet.frame()[20:])
+
+
+def build_stream(bodies):
+    stream = bytearray()
+    for body in bodies:
+        packet = Packet()
+        packet.reserve(len(body))
+        packet.data[20:20 + len(body)] = body
+        stream += packet.frame()
+    return bytes(stream)
+
+
+def create_protocol(protocol_class=NativeProtocol):
+    protocol = protocol_class(loop=loop)
+    protocol.version = Protocol.VERSION
+    protocol.compile_info_decoders()
+    return protocol
+
+
+def decode_all(data, count, method):
+    def run():
+        packet = Packet(data)
+        get = getattr(packet, method)
+        for i in range(count):
+            get()
+    return run, count
+
+
+def feed(protocol, stream, chunk_size):
+    view = memoryview(stream)
+    for offset in range(0, len(stream), chunk_size):
+        chunk = view[offset:offset + chunk_size]
+        while chunk:
+            buffer = protocol.get_buffer()
+            length = min(len(buffer), len(chunk))
+            buffer[:length] = chunk[:length]
+            protocol.msg_received_into(length, [], 0, None)
+            chunk = chunk[length:]
+
+
+def sink_info_list(count):
+    server = FakeServer(LoadProfile(sinks=count, sources=0, sink_inputs=0, proplist_size=20, property_size=32))
+    packet = Packet()
+    for index in sorted(server.objects[SubscriptionEventType.SINK]):
+        encode_structure(packet, native_protocol_sink_info, server.objects[SubscriptionEventType.SINK][index], Protocol.VERSION)
+    data = bytes(packet.frame()[20:])
+    protocol = create_protocol()
+    def run():
+        protocol.handle_get_sink_info_list_reply(Packet(data))
+    return run, count
+
+
+@benchmark('packet.get_string')
+def get_string():
+    data = build_packet(lambda packet, i: packet.add_string(f'alsa_output.pci-0000_00_1f.3.analog-stereo.{i}'), 1000)
+    return decode_all(data, 1000, 'get_string')
+
+
+@benchmark('packet.get_proplist')
+def get_proplist():
+    proplist = {f'device.property.{i}': f'value {i}'.ljust(32, 'x') for i in range(20)}
+    data = build_packet(lambda packet, i: packet.add_proplist(proplist), 100)
+    return decode_all(data, 100, 'get_proplist')
+
+
+@benchmark('packet.get_cvolume')
+def get_cvolume():
+    cvolume = Cvolume()
+    cvolume.channels = [0x10000, 0x10000]
+    data = build_packet(lambda packet, i: packet.add_cvolume(cvolume), 1000)
+    return decode_all(data, 1000, 'get_cvolume')
+
+
+@benchmark('packet.get_format_info')
+def get_format_info():
+    format_info = FormatInfo()
+    format_info.encoding = 1
+    format_info.proplist = {'format.rate': '44100', 'format.channels': '2'}
+    data = build_packet(lambda packet, i: packet.add_format_info(format_info), 1000)
+    return decode_all(data, 1000, 'get_format_info')
+
+
+@benchmark('sink_info_list.10')
+def sink_info_list_10():
+    return sink_info_list(10)
+
+
+@benchmark('sink_info_list.100')
+def sink_info_list_100():
+    return sink_info_list(100)
+
+
+@benchmark('sink_info_list.1000')
+def sink_info_list_1000():
+    return sink_info_list(1000)
+
+
+@benchmark('handle_data.framing')
+def handle_data_framing():
+    stream = build_stream([bytes(64)] * 10000)
+    protocol = create_protocol(RingProtocol)
+    return (lambda: feed(protocol, stream, 4096)), 10000
+
+
+@benchmark('subscribe_event.dispatch')
+def subscribe_event_dispatch():
+    bodies = []
+    for i in range(10000):
+        packet = Packet()
+        packet.add_command(Command.SUBSCRIBE_EVENT)
+        packet.add_id(0xffffffff)
+        packet.add_u32(SubscriptionEventType.SINK | SubscriptionEventType.CHANGE)
+        packet.add_u32(i % 16)
+        bodies.append(bytes(packet.frame()[20:]))
+    stream = build_stream(bodies)
+    protocol = create_protocol()
+    received = []
+    protocol.transport = NullTransport()
+    protocol.subscribe(received.append, [SubscriptionEventType.SINK])
+    def run():
+        feed(protocol, stream, 64 * 1024)
+        received.clear()
+    return run, len(bodies)
+
+
+@benchmark('packet.build')
+def packet_build():
+    proplist = {f'application.property.{i}': f'value {i}' for i in range(10)}
+    cvolume = Cvolume()
+    cvolume.channels = [0x10000, 0x10000]
+    def run():
+        for i in range(1000):
+            packet = Packet()
+            packet.add_command(Command.SET_SINK_VOLUME)
+            packet.add_id(i)
+            packet.add_u32(0xffffffff)
+            packet.add_string('alsa_output.pci-0000_00_1f.3.analog-stereo')
+            packet.add_cvolume(cvolume)
+            packet.add_proplist(proplist)
+            packet.frame()
+    return run, 1000
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print(f"{'benchmark':<28} {'baseline ns/op':>15} {'current ns/op':>15} {'change':>8}")
+    for name, result in results['benchmarks'].items():
+        before = baseline['benchmarks'].get(name)
+        if before is None:
+            print(f"{name:<28} {'-':>15} {result['ns_per_op']:>15.1f} {'new':>8}")
+            continue
+        change = result['ns_per_op'] / before['ns_per_op'] - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = ' REGRESSION'
+        print(f"{name:<28} {before['ns_per_op']:>15.1f} {result['ns_per_op']:>15.1f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def measure(function, operations, repeat):
+    function()
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / operations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark packet encoding, decoding and dispatch.")
+    parser.add_argument('--repeat', type=int, default=7, help="Timed runs per benchmark; the fastest is kept.")
+    parser.add_argument('--only', action='append', help="Run only this benchmark. Can be repeated.")
+    parser.add_argument('--output', help="Write the results as JSON to this file.")
+    parser.add_argument('--baseline', help="Compare against results saved with --output.")
+    parser.add_argument('--threshold', type=float, default=0.1, help="Slowdown that counts as a regression, 0.1 being 10%%.")
+    args = parser.parse_args()
+    global loop
+    loop = asyncio.new_event_loop()
+    try:
+        run_benchmarks(args)
+    finally:
+        loop.close()
+
+
+def run_benchmarks(args):
+    results = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'repeat': args.repeat,
+        'benchmarks': {},
+    }
+    for name, setup in BENCHMARKS.items():
+        if args.only and name not in args.only:
+            continue
+        function, operations = setup()
+        seconds = measure(function, operations, args.repeat)
+        results['benchmarks'][name] = {
+            'operations': operations,
+            'ns_per_op': seconds * 1e9,
+            'ops_per_second': 1 / seconds,
+        }
+        if args.baseline is None:
+            print(f"{name:<28} {seconds * 1e9:>12.1f} ns/op {1 / seconds:>14.0f} ops/s")
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import struct
+import time
+
+from pypactl.native_protocol import NativeProtocol
+
+
+class ConcatProtocol(NativeProtocol):
+    # The receive path as it was before ReceiveBuffer: every read copies all
+    # of the unconsumed bytes plus the new data into a fresh bytes object.
+    def __init__(self, loop):
+        super().__init__(loop=loop)
+        self.buffer = memoryview(b'')
+        self.bytes_copied = 0
+
+
+    def consume(self, length):
+        result = self.buffer[:length]
+        self.buffer = self.buffer[length:]
+        return result
+
+
+    def handle_data(self):
+        self.logger.debug(f"handle_data {self.expected_length} {len(self.buffer)} {self.buffer}")
+        while len(self.buffer) >= self.expected_length:
+            data = self.consume(self.expected_length)
+            if self.expecting_frame:
+                self.handle_frame(data)
+            else:
+                self.handle_packet(data)
+            self.logger.debug(f"handle_data {self.expected_length} {len(self.buffer)} {self.buffer}")
+
+
+    def handle_packet(self, data, start=0, end=None):
+        self.expecting_frame = True
+        self.expected_length = struct.calcsize(self.FRAME_STRUCT)
+
+
+    def msg_received(self, data, ancillary_data, msg_flags, address):
+        self.bytes_copied += 2 * len(self.buffer) + len(data)
+        self.buffer = memoryview(self.buffer.tobytes() + data)
+        self.handle_data()
+
+
+class RingProtocol(NativeProtocol):
+    def handle_packet(self, data, start=0, end=None):
+        self.expecting_frame = True
+        self.expected_length = struct.calcsize(self.FRAME_STRUCT)
+
+
+    @property
+    def bytes_copied(self):
+        return self.buffer.bytes_copied
+
+
+def build_stream(packet_size, total_size):
+    frame = struct.pack(NativeProtocol.FRAME_STRUCT, packet_size, 0xffffffff, 0, 0, 0)
+    packet = frame + b'\x00' * packet_size
+    count = max(1, total_size // len(packet))
+    return packet * count
+
+
+def feed_concat(stream, chunk_size, loop):
+    protocol = ConcatProtocol(loop)
+    view = memoryview(stream)
+    for offset in range(0, len(stream), chunk_size):
+        protocol.msg_received(view[offset:offset + chunk_size].tobytes(), [], 0, None)
+    return protocol.bytes_copied
+
+
+def feed_ring(stream, chunk_size, loop):
+    protocol = RingProtocol(loop=loop)
+    view = memoryview(stream)
+    for offset in range(0, len(stream), chunk_size):
+        chunk = view[offset:offset + chunk_size]
+        buffer = protocol.get_buffer()
+        length = min(len(buffer), len(chunk))
+        buffer[:length] = chunk[:length]
+        protocol.msg_received_into(length, [], 0, None)
+        if length < len(chunk):
+            rest = chunk[length:]
+            buffer = protocol.get_buffer()
+            buffer[:len(rest)] = rest
+            protocol.msg_received_into(len(rest), [], 0, None)
+    return protocol.bytes_copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare bytes copied by the receive path per MB received.")
+    parser.add_argument('--total-size', type=int, default=4 * 1024 * 1024)
+    parser.add_argument('--chunk-size', type=int, default=16 * 1024)
+    args = parser.parse_args()
+    scenarios = [
+        ("subscribe events", 20),
+        ("small replies", 512),
+        ("sink info list", 256 * 1024),
+        ("huge reply", 2 * 1024 * 1024),
+    ]
+    # The protocols need a loop to be made with, but nothing is run on it.
+    loop = asyncio.new_event_loop()
+    try:
+        print(f"{'scenario':<20} {'packet':>10} {'before B/MB':>14} {'after B/MB':>12} {'before s':>10} {'after s':>10}")
+        for name, packet_size in scenarios:
+            stream = build_stream(packet_size, args.total_size)
+            megabytes = len(stream) / (1024 * 1024)
+            start = time.perf_counter()
+            before = feed_concat(stream, args.chunk_size, loop)
+            before_time = time.perf_counter() - start
+            start = time.perf_counter()
+            after = feed_ring(stream, args.chunk_size, loop)
+            after_time = time.perf_counter() - start
+            print(f"{name:<20} {packet_size:>10} {before / megabytes:>14.0f} {after / megabytes:>12.0f} {before_time:>10.4f} {after_time:>10.4f}")
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Measures what a one-shot `pypactl <command>` costs: the import time of the
+# CLI module as reported by -X importtime, and the wall clock time of whole
+# runs against a fake server.
+
+# Modules none of the timed commands use, which importing the CLI shouldn't
+# load.
+UNWANTED_MODULES = {
+    'mmap',
+    'pypactl.batch',
+    'pypactl.event_stream',
+    'pypactl.flight_recorder',
+    'pypactl.mempool',
+    'pypactl.metrics',
+    'pypactl.object_store',
+    'pypactl.playback_stream',
+    'pypactl.record_file',
+    'pypactl.record_stream',
+    'pypactl.sample_file',
+    'pypactl.state_cache',
+}
+
+
+def import_times(module):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_time), int(cumulative)))
+    return modules
+
+
+def time_runs(command, runs, environment):
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'pypactl.pypactl'] + command, env=environment, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def wait_for_socket(path, process, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if process.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError("The fake server didn't start.")
+        time.sleep(0.01)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark one-shot pypactl start up.")
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--top', type=int, default=10, help="Slowest imports to show.")
+    parser.add_argument('--output', help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+    modules = import_times('pypactl.pypactl')
+    total = next(cumulative for name, self_time, cumulative in modules if name == 'pypactl.pypactl')
+    print(f"import pypactl.pypactl: {total / 1000:.1f} ms")
+    for name, self_time, cumulative in sorted(modules, key=lambda module: module[1], reverse=True)[:args.top]:
+        print(f"  {name:<40} {self_time / 1000:>8.2f} ms self {cumulative / 1000:>8.2f} ms cumulative")
+    unwanted = [name for name, self_time, cumulative in modules if name.split('.')[0] == 'aioconsole' or name in UNWANTED_MODULES]
+    if unwanted:
+        print(f"One-shot mode imports {', '.join(unwanted)}.")
+    results = {
+        'import_us': total,
+        'imports': {name: cumulative for name, self_time, cumulative in modules},
+        'runs': {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'native')
+        server = subprocess.Popen([sys.executable, '-m', 'pypactl.fake_server', path])
+        try:
+            wait_for_socket(path, server)
+            environment = dict(os.environ, PULSE_SERVER=path)
+            for command in [['info'], ['list', 'sinks'], ['set-default-sink', 'alsa_output.fake-1']]:
+                times = sorted(time_runs(command, args.runs, environment))
+                name = ' '.join(command)
+                results['runs'][name] = {'min': times[0], 'median': times[len(times) // 2], 'max': times[-1]}
+                print(f"pypactl {name:<40} min {times[0] * 1000:>7.1f} ms median {times[len(times) // 2] * 1000:>7.1f} ms max {times[-1] * 1000:>7.1f} ms")
+        finally:
+            server.terminate()
+            server.wait()
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
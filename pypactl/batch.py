@@ -0,0 +1,102 @@
+import asyncio
+import functools
+
+class Batch:
+    # Collects requests while the block runs and sends them in a single write
+    # when it exits, then waits for all of the replies. Each method returns a
+    # future; don't await them inside the block, the requests haven't been
+    # sent yet. Nothing is held up on the connection meanwhile, and the
+    # requests' timeouts start when they're sent. If the block raises, none
+    # of them are sent and their futures are cancelled.
+    #
+    #     async with controller.batch() as batch:
+    #         server_info = batch.server_info()
+    #         sinks = batch.sinks()
+    #     print(server_info.result(), sinks.result())
+    def __init__(self, controller):
+        self.controller = controller
+        # (future, send method, args, kwargs)
+        self.requests = []
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        requests = self.requests
+        self.requests = []
+        if exc_type is not None:
+            for future, func, args, kwargs in requests:
+                future.cancel()
+            return
+        if not requests:
+            return
+        # The protocol is only corked while the requests are encoded, with no
+        # await in between, so no other task's frames are caught up in it.
+        protocol = self.controller.protocol
+        protocol.cork()
+        try:
+            for future, func, args, kwargs in requests:
+                try:
+                    reply = func(*args, **kwargs)
+                except Exception as exception:
+                    future.set_exception(exception)
+                else:
+                    reply.add_done_callback(functools.partial(copy_result, future))
+        finally:
+            protocol.uncork()
+        await asyncio.gather(*(future for future, func, args, kwargs in requests))
+
+
+    def add(self, func, *args, **kwargs):
+        future = self.controller.loop.create_future()
+        self.requests.append((future, func, args, kwargs))
+        return future
+
+
+    def cards(self, fields=None, lazy_proplist=False):
+        return self.add(self.controller.protocol.send_get_card_info_list, fields=fields, lazy_proplist=lazy_proplist)
+
+
+    def clients(self, fields=None, lazy_proplist=False):
+        return self.add(self.controller.protocol.send_get_client_info_list, fields=fields, lazy_proplist=lazy_proplist)
+
+
+    def modules(self, fields=None, lazy_proplist=False):
+        return self.add(self.controller.protocol.send_get_module_info_list, fields=fields, lazy_proplist=lazy_proplist)
+
+
+    def server_info(self):
+        return self.add(self.controller.protocol.send_get_server_info)
+
+
+    def set_default_sink(self, sink_name):
+        return self.add(self.controller.protocol.send_set_default_sink, sink_name)
+
+
+    def sinks(self, fields=None, lazy_proplist=False):
+        return self.add(self.controller.protocol.send_get_sink_info_list, fields=fields, lazy_proplist=lazy_proplist)
+
+
+    def sink_inputs(self, fields=None, lazy_proplist=False):
+        return self.add(self.controller.protocol.send_get_sink_input_info_list, fields=fields, lazy_proplist=lazy_proplist)
+
+
+    def sources(self, fields=None, lazy_proplist=False):
+        return self.add(self.controller.protocol.send_get_source_info_list, fields=fields, lazy_proplist=lazy_proplist)
+
+
+    def source_outputs(self, fields=None, lazy_proplist=False):
+        return self.add(self.controller.protocol.send_get_source_output_info_list, fields=fields, lazy_proplist=lazy_proplist)
+
+
+def copy_result(destination, source):
+    if destination.done():
+        return
+    if source.cancelled():
+        destination.cancel()
+    elif source.exception() is not None:
+        destination.set_exception(source.exception())
+    else:
+        destination.set_result(source.result())
@@ -0,0 +1,13 @@
+class BufferAttr:
+    # Server side buffer sizes in bytes. INVALID_INDEX (0xffffffff) leaves
+    # the choice to the server.
+    def __init__(self, maxlength=0xffffffff, tlength=0xffffffff, prebuf=0xffffffff, minreq=0xffffffff, fragsize=0xffffffff):
+        self.maxlength = maxlength
+        self.tlength = tlength
+        self.prebuf = prebuf
+        self.minreq = minreq
+        self.fragsize = fragsize
+
+
+    def __repr__(self):
+        return f"<BufferAttr maxlength={self.maxlength} tlength={self.tlength} prebuf={self.prebuf} minreq={self.minreq} fragsize={self.fragsize}>"
@@ -0,0 +1,17 @@
+class CardInfo:
+    def __init__(self):
+        self.index = None
+        self.name = None
+        self.owner_module = None
+        self.driver = None
+        self.n_profiles = None
+        self.profiles = None
+        self.active_profile_name = None
+        self.active_profile = None
+        self.proplist = {}
+        self.n_ports = None
+        self.ports = None
+
+
+    def __repr__(self):
+        return f"<CardInfo index={self.index} name={self.name} owner_module={self.owner_module} driver={self.driver} n_profiles={self.n_profiles} profiles={self.profiles} active_profile_name={self.active_profile_name} active_profile={self.active_profile} proplist={self.proplist} n_ports={self.n_ports} ports={self.ports}>"
@@ -0,0 +1,15 @@
+class CardPortInfo:
+    def __init__(self):
+        self.name = None
+        self.description = None
+        self.priority = None
+        self.available = None
+        self.direction = None
+        self.proplist = {}
+        self.n_profiles = None
+        self.profiles = None
+        self.latency_offset = None
+
+
+    def __repr__(self):
+        return f"<CardPortInfo name={self.name} description={self.description} priority={self.priority} available={self.available} direction={self.direction} proplist={self.proplist} n_profiles={self.n_profiles} profiles={self.profiles} latency_offset={self.latency_offset}>"
@@ -0,0 +1,12 @@
+class CardProfileInfo:
+    def __init__(self):
+        self.name = None
+        self.description = None
+        self.n_sinks = None
+        self.n_sources = None
+        self.priority = None
+        self.available = None
+
+
+    def __repr__(self):
+        return f"<CardProfileInfo name={self.name} description={self.description} n_sinks={self.n_sinks} n_sources={self.n_sources} priority={self.priority} available={self.available}>"
@@ -5,3 +5,21 @@ class ChannelMap:
 
     def __repr__(self):
         return f"<ChannelMap channels={self.channels}>"
+
+
+POSITION_MONO = 0
+POSITION_FRONT_LEFT = 1
+POSITION_FRONT_RIGHT = 2
+POSITION_AUX0 = 12
+
+
+def default_channel_map(channels):
+    # Mono, stereo, or one aux channel per channel for anything else.
+    channel_map = ChannelMap()
+    if channels == 1:
+        channel_map.channels = [POSITION_MONO]
+    elif channels == 2:
+        channel_map.channels = [POSITION_FRONT_LEFT, POSITION_FRONT_RIGHT]
+    else:
+        channel_map.channels = [POSITION_AUX0 + i for i in range(channels)]
+    return channel_map
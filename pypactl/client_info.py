@@ -0,0 +1,11 @@
+class ClientInfo:
+    def __init__(self):
+        self.index = None
+        self.name = None
+        self.owner_module = None
+        self.driver = None
+        self.proplist = {}
+
+
+    def __repr__(self):
+        return f"<ClientInfo index={self.index} name={self.name} owner_module={self.owner_module} driver={self.driver} proplist={self.proplist}>"
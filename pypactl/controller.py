@@ -1,39 +1,416 @@
 import asyncio
+import collections
 import logging
 
-from pypactl.async_callback import async_callback
 from pypactl.loop import create_connection
+from pypactl.sample_format import SAMPLE_SIZES
+from pypactl.subscription_event_type import SubscriptionEventType
+from pypactl.subscription_mask import SubscriptionMask
 
 class Controller:
-    def __init__(self, loop, logger=logging.getLogger('pypactl')):
+    LIST_METHODS = {
+        SubscriptionEventType.CARD: 'cards',
+        SubscriptionEventType.CLIENT: 'clients',
+        SubscriptionEventType.MODULE: 'modules',
+        SubscriptionEventType.SINK: 'sinks',
+        SubscriptionEventType.SINK_INPUT: 'sink_inputs',
+        SubscriptionEventType.SOURCE: 'sources',
+        SubscriptionEventType.SOURCE_OUTPUT: 'source_outputs',
+    }
+
+    def __init__(self, loop, logger=logging.getLogger('pypactl'), timeout=None, metrics=False):
         self.logger = logger
         self.loop = loop
+        self.timeout = timeout
+        self.collect_metrics = metrics
+        self.metrics_exporter = None
         self.protocol = None
         self.transport = None
+        self.state_cache = None
+        self.event_streams = set()
+        self.blocked_streams = set()
+
+
+    def abandon_upload_stream(self, created):
+        if created.cancelled() or created.exception() is not None or self.protocol.transport.is_closing():
+            return
+        self.protocol.send_delete_upload_stream(created.result()[0])
+
+
+    def batch(self):
+        # Like the other helpers that only some callers use, Batch is
+        # imported when it's first asked for, which keeps one-shot commands
+        # from loading it.
+        from pypactl.batch import Batch
+        return Batch(self)
+
+
+    async def cards(self, fields=None, lazy_proplist=False):
+        if self.is_cached(SubscriptionEventType.CARD):
+            return self.get_cached(SubscriptionEventType.CARD, fields)
+        return await self.protocol.send_get_card_info_list(fields=fields, lazy_proplist=lazy_proplist)
+
+
+    async def clients(self, fields=None, lazy_proplist=False):
+        if self.is_cached(SubscriptionEventType.CLIENT):
+            return self.get_cached(SubscriptionEventType.CLIENT, fields)
+        return await self.protocol.send_get_client_info_list(fields=fields, lazy_proplist=lazy_proplist)
 
 
     def close(self):
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.cancel()
+            self.metrics_exporter = None
+        for stream in list(self.event_streams):
+            stream.close()
         if self.transport is None:
             return
         self.transport.close()
 
 
+    def close_events(self, stream):
+        self.event_streams.discard(stream)
+        self.protocol.unsubscribe(stream.put)
+
+
+    async def create_playback_stream(self, sample_spec, sink_name=None, name='pypactl', proplist=None, channel_map=None, volume=None, muted=None, buffer_attr=None, corked=False):
+        # Returns a PlaybackStream playing to sink_name, or the default sink.
+        proplist = dict(proplist or {})
+        proplist.setdefault('media.name', name)
+        return await self.protocol.send_create_playback_stream(sample_spec, channel_map, volume, sink_name=sink_name, buffer_attr=buffer_attr, corked=corked, muted=muted, proplist=proplist)
+
+
+    async def create_record_stream(self, sample_spec, source_name=None, name='pypactl', proplist=None, channel_map=None, buffer_attr=None, corked=False, peak_detect=False, buffer=None, path=None, seconds=None, size=None, file_format='wav'):
+        # Returns a RecordStream capturing from source_name, or the default
+        # source, into buffer or a RecordFile at path of size bytes or
+        # seconds of audio. With neither it only calls the stream's on_data.
+        proplist = dict(proplist or {})
+        proplist.setdefault('media.name', name)
+        record_file = None
+        if path is not None:
+            if size is None and seconds is None:
+                raise ValueError("Recording to a path needs seconds or size to say how long it is.")
+            if size is None:
+                size = int(seconds * sample_spec.rate) * SAMPLE_SIZES[sample_spec.format] * sample_spec.channels
+            from pypactl.record_file import RecordFile
+            record_file = RecordFile(path, sample_spec, size, file_format)
+            buffer = record_file.buffer
+        try:
+            return await self.protocol.send_create_record_stream(sample_spec, channel_map, source_name=source_name, buffer_attr=buffer_attr, corked=corked, peak_detect=peak_detect, proplist=proplist, target=buffer, record_file=record_file)
+        except BaseException:
+            if record_file is not None:
+                record_file.close(0)
+            raise
+
+
+    async def enable_state_cache(self, facilities=None):
+        from pypactl.state_cache import StateCache
+        self.state_cache = StateCache(self.loop, self.protocol, facilities, logger=self.logger)
+        await self.state_cache.load()
+
+
+    def events(self, maxsize=1024, policy='drop_oldest', facilities=None, types=None):
+        from pypactl.event_stream import EventStream
+        stream = EventStream(self, maxsize, policy)
+        self.event_streams.add(stream)
+        self.protocol.subscribe(stream.put, facilities, types)
+        return stream
+
+
+    def event_stats(self):
+        return [stream.stats() for stream in self.event_streams]
+
+
+    async def export_metrics(self, path, interval):
+        from pypactl.metrics import write_prometheus
+        while True:
+            write_prometheus(self.metrics(), path)
+            await asyncio.sleep(interval)
+
+
+    async def find(self, facility, proplist=None, **attributes):
+        if self.is_cached(facility):
+            return self.state_cache.find(facility, proplist, **attributes)
+        from pypactl.object_store import ObjectStore
+        store = ObjectStore()
+        for info in await getattr(self, self.LIST_METHODS[facility])():
+            store.put(info)
+        return store.find(proplist, **attributes)
+
+
+    async def find_cards(self, proplist=None, **attributes):
+        return await self.find(SubscriptionEventType.CARD, proplist, **attributes)
+
+
+    async def find_clients(self, proplist=None, **attributes):
+        return await self.find(SubscriptionEventType.CLIENT, proplist, **attributes)
+
+
+    async def find_modules(self, proplist=None, **attributes):
+        return await self.find(SubscriptionEventType.MODULE, proplist, **attributes)
+
+
+    async def find_sinks(self, proplist=None, **attributes):
+        return await self.find(SubscriptionEventType.SINK, proplist, **attributes)
+
+
+    async def find_sink_inputs(self, proplist=None, **attributes):
+        return await self.find(SubscriptionEventType.SINK_INPUT, proplist, **attributes)
+
+
+    async def find_sources(self, proplist=None, **attributes):
+        return await self.find(SubscriptionEventType.SOURCE, proplist, **attributes)
+
+
+    async def find_source_outputs(self, proplist=None, **attributes):
+        return await self.find(SubscriptionEventType.SOURCE_OUTPUT, proplist, **attributes)
+
+
+    def get_cached(self, facility, fields=None):
+        # Cached objects are kept whole, so with fields they're copied with
+        # just those fields, the same as a reply decoded with them would be.
+        # lazy_proplist makes no difference, cached proplists are already
+        # decoded.
+        infos = self.state_cache.get_all(facility)
+        if fields is None:
+            return infos
+        protocol = self.protocol
+        structure_module = protocol.INFO_STRUCTURES[protocol.INFO_LISTS[facility][1]]
+        fields = frozenset(fields)
+        unknown = fields - {field[0] for field in structure_module.structure}
+        if unknown:
+            raise ValueError(f"Unknown fields for {structure_module.__name__}: {', '.join(sorted(unknown))}.")
+        # List counts are always decoded, to walk the lists.
+        fields |= {field[1][1] for field in structure_module.structure if isinstance(field[1], tuple)}
+        finish = getattr(structure_module, 'finish', None)
+        projected = []
+        for info in infos:
+            copy = structure_module.info_class()
+            for name in fields:
+                setattr(copy, name, getattr(info, name))
+            if finish is not None:
+                finish(copy)
+            projected.append(copy)
+        return projected
+
+
+    def is_cached(self, facility):
+        return self.state_cache is not None and facility in self.state_cache.objects
+
+
+    async def iter_info(self, facility, fields=None, lazy_proplist=False):
+        # Yields records as they're decoded from the reply, so the caller can
+        # start on the first one without the whole list having been built.
+        #
+        #     async for sink in controller.iter_sinks(fields=['index', 'name']):
+        #         ...
+        if self.is_cached(facility):
+            for info in list(self.get_cached(facility, fields)):
+                yield info
+            return
+        for info in await self.protocol.send_iter_info_list(facility, fields=fields, lazy_proplist=lazy_proplist):
+            yield info
+
+
+    def iter_cards(self, fields=None, lazy_proplist=False):
+        return self.iter_info(SubscriptionEventType.CARD, fields, lazy_proplist)
+
+
+    def iter_clients(self, fields=None, lazy_proplist=False):
+        return self.iter_info(SubscriptionEventType.CLIENT, fields, lazy_proplist)
+
+
+    def iter_modules(self, fields=None, lazy_proplist=False):
+        return self.iter_info(SubscriptionEventType.MODULE, fields, lazy_proplist)
+
+
+    def iter_sinks(self, fields=None, lazy_proplist=False):
+        return self.iter_info(SubscriptionEventType.SINK, fields, lazy_proplist)
+
+
+    def iter_sink_inputs(self, fields=None, lazy_proplist=False):
+        return self.iter_info(SubscriptionEventType.SINK_INPUT, fields, lazy_proplist)
+
+
+    def iter_sources(self, fields=None, lazy_proplist=False):
+        return self.iter_info(SubscriptionEventType.SOURCE, fields, lazy_proplist)
+
+
+    def iter_source_outputs(self, fields=None, lazy_proplist=False):
+        return self.iter_info(SubscriptionEventType.SOURCE_OUTPUT, fields, lazy_proplist)
+
+
+    async def level_meter(self, sinks=None, interval=0.1, rate=8000):
+        # Returns a LevelMeter over sinks, SinkInfos, or all of them. NumPy is
+        # only needed, and imported, once a meter is asked for.
+        from pypactl.level_meter import LevelMeter
+        meter = LevelMeter(self, interval, rate, logger=self.logger)
+        if sinks is None:
+            sinks = await self.sinks()
+        try:
+            await asyncio.gather(*(meter.add_sink(sink) for sink in sinks))
+        except BaseException:
+            await meter.close()
+            raise
+        return meter
+
+
+    def metrics(self):
+        # A snapshot of the protocol's counters and histograms, or None when
+        # the controller was created without metrics.
+        if self.protocol is None or self.protocol.metrics is None:
+            return None
+        return self.protocol.metrics.snapshot(len(self.protocol.reply_map))
+
+
+    async def modules(self, fields=None, lazy_proplist=False):
+        if self.is_cached(SubscriptionEventType.MODULE):
+            return self.get_cached(SubscriptionEventType.MODULE, fields)
+        return await self.protocol.send_get_module_info_list(fields=fields, lazy_proplist=lazy_proplist)
+
+
+    def pause_events(self, stream):
+        self.blocked_streams.add(stream)
+        self.protocol.block_events(True)
+
+
+    async def play_sample(self, name, sink_name=None, volume=None):
+        # Plays a sample from the server's sample cache on sink_name, or the
+        # default sink, and returns the index of the sink input playing it
+        # (None before protocol version 13). Only one small packet is sent,
+        # built once per name, sink and volume.
+        return await self.protocol.send_play_sample(name, sink_name, volume)
+
+
+    async def remove_sample(self, name):
+        await self.protocol.send_remove_sample(name)
+
+
+    def resume_events(self, stream):
+        self.blocked_streams.discard(stream)
+        if not self.blocked_streams:
+            self.protocol.block_events(False)
+
+
     async def server_info(self):
-        return await async_callback(self.loop, self.protocol.send_get_server_info)
+        if self.state_cache is not None:
+            return self.state_cache.server_info
+        return await self.protocol.send_get_server_info()
 
 
     async def set_default_sink(self, sink_name):
-        return await async_callback(self.loop, self.protocol.send_set_default_sink, sink_name)
+        return await self.protocol.send_set_default_sink(sink_name)
+
+
+    async def sinks(self, fields=None, lazy_proplist=False):
+        if self.is_cached(SubscriptionEventType.SINK):
+            return self.get_cached(SubscriptionEventType.SINK, fields)
+        return await self.protocol.send_get_sink_info_list(fields=fields, lazy_proplist=lazy_proplist)
+
+
+    async def sink_inputs(self, fields=None, lazy_proplist=False):
+        if self.is_cached(SubscriptionEventType.SINK_INPUT):
+            return self.get_cached(SubscriptionEventType.SINK_INPUT, fields)
+        return await self.protocol.send_get_sink_input_info_list(fields=fields, lazy_proplist=lazy_proplist)
+
+
+    async def sources(self, fields=None, lazy_proplist=False):
+        if self.is_cached(SubscriptionEventType.SOURCE):
+            return self.get_cached(SubscriptionEventType.SOURCE, fields)
+        return await self.protocol.send_get_source_info_list(fields=fields, lazy_proplist=lazy_proplist)
+
+
+    async def source_outputs(self, fields=None, lazy_proplist=False):
+        if self.is_cached(SubscriptionEventType.SOURCE_OUTPUT):
+            return self.get_cached(SubscriptionEventType.SOURCE_OUTPUT, fields)
+        return await self.protocol.send_get_source_output_info_list(fields=fields, lazy_proplist=lazy_proplist)
+
+
+    async def start(self, fast_connect=False, subscribe=False, capture_path=None, shm=True):
+        # With fast_connect the handshake (and with subscribe the initial
+        # SUBSCRIBE) goes out in a single write instead of one round trip per
+        # step. With shm, stream audio is passed through shared memory when
+        # the server agrees to it.
+        subscription_mask = SubscriptionMask.ALL if subscribe else None
+        self.protocol, self.transport = await create_connection(self.loop, logger=self.logger, fast_connect=fast_connect, subscription_mask=subscription_mask, capture_path=capture_path, metrics=self.collect_metrics, shm=shm)
+        self.protocol.default_timeout = self.timeout
+        await self.protocol.ready
+
+
+    def start_metrics_exporter(self, path, interval=15.0):
+        # Rewrites path in the Prometheus text format every interval seconds,
+        # for node_exporter's textfile collector and the like.
+        if self.protocol.metrics is None:
+            raise ValueError("Metrics aren't enabled; create the Controller with metrics=True.")
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.cancel()
+        self.metrics_exporter = self.loop.create_task(self.export_metrics(path, interval))
+
+
+    def subscribe(self, callback, facilities=None, types=None):
+        self.protocol.subscribe(callback, facilities, types)
 
 
-    async def sinks(self):
-        return await async_callback(self.loop, self.protocol.send_get_sink_info_list)
+    def unsubscribe(self, callback):
+        self.protocol.unsubscribe(callback)
 
 
-    async def start(self):
-        self.protocol, self.transport = await create_connection(self.loop, logger=self.logger)
-        await async_callback(self.loop, self.protocol.add_ready_listener)
+    async def upload_sample(self, path, name=None):
+        # Uploads a WAV file to the sample cache as name, by default the
+        # file's name without its extension, and returns the number of bytes
+        # uploaded. The audio is sent straight from the file's mapping in
+        # frames of up to MAX_FRAME_SIZE, waiting whenever the transport's
+        # buffer is full so concurrent uploads and other requests take turns.
+        from pypactl.playback_stream import MAX_FRAME_SIZE
+        from pypactl.sample_file import MAX_SAMPLE_SIZE, SampleFile
+        sample_file = SampleFile(path)
+        try:
+            data = sample_file.data
+            if not data:
+                raise ValueError(f"{path} has no audio.")
+            if len(data) > MAX_SAMPLE_SIZE:
+                raise ValueError(f"{path} has {len(data)} bytes of audio, more than the sample cache's limit of {MAX_SAMPLE_SIZE}.")
+            protocol = self.protocol
+            created = protocol.send_create_upload_stream(name or sample_file.name, sample_file.sample_spec, len(data))
+            try:
+                channel, length = await asyncio.shield(created)
+            except asyncio.CancelledError:
+                # The server makes the stream anyway, so it's deleted once
+                # the reply says which channel it's on.
+                created.add_done_callback(self.abandon_upload_stream)
+                raise
+            try:
+                frame_size = SAMPLE_SIZES[sample_file.sample_spec.format] * sample_file.sample_spec.channels
+                max_frame_size = MAX_FRAME_SIZE - MAX_FRAME_SIZE % frame_size
+                length = min(length, len(data))
+                for start in range(0, length, max_frame_size):
+                    await protocol.wait_writable()
+                    protocol.send_stream_data(channel, data[start:min(start + max_frame_size, length)], max_frame_size=max_frame_size)
+                await protocol.send_finish_upload_stream(channel)
+            except BaseException:
+                if not protocol.transport.is_closing():
+                    protocol.send_delete_upload_stream(channel)
+                raise
+            return length
+        finally:
+            sample_file.close()
 
 
-    def subscribe(self, callback):
-        self.protocol.subscribe(callback)
+    async def upload_samples(self, paths, concurrency=16):
+        # Uploads WAV files to the sample cache, named after the files, up to
+        # concurrency at a time over this one connection. Returns a dict of
+        # sample name to bytes uploaded or, where an upload failed, its
+        # exception. Files that would have the same name, from different
+        # directories, are a ValueError before anything is uploaded.
+        from pypactl.sample_file import sample_name
+        paths = list(paths)
+        names = collections.Counter(sample_name(path) for path in paths)
+        duplicates = sorted(name for name, count in names.items() if count > 1)
+        if duplicates:
+            raise ValueError(f"Several files would be uploaded as the same sample: {', '.join(duplicates)}.")
+        semaphore = asyncio.Semaphore(concurrency)
+        async def upload(path):
+            async with semaphore:
+                return await self.upload_sample(path)
+        results = await asyncio.gather(*(upload(path) for path in paths), return_exceptions=True)
+        return {sample_name(path): result for path, result in zip(paths, results)}
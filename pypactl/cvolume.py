@@ -1,3 +1,5 @@
+VOLUME_NORM = 0x10000
+
 class Cvolume:
     def __init__(self):
         self.channels = []
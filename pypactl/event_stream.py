@@ -0,0 +1,123 @@
+import collections
+
+from pypactl.subscription_event_type import SubscriptionEventType
+
+class EventStream:
+    # Subscription events for one consumer, read with async for. Events are
+    # queued by the protocol's read path and the consumer takes them at its
+    # own pace, so with the drop_oldest and coalesce policies a slow consumer
+    # only holds up itself. What happens when more than maxsize events are
+    # waiting depends on policy:
+    #
+    #   drop_oldest: the oldest event is dropped.
+    #   coalesce: the oldest event is dropped. Besides that, a CHANGE for a
+    #       (facility, index) that already has a CHANGE waiting is always
+    #       merged into it, however full the queue is, so there is at most
+    #       one CHANGE per object waiting.
+    #   block: the connection stops reading until the queue is drained to
+    #       half of maxsize, which holds up every other consumer and the
+    #       StateCache too. Reading carries on while requests are waiting
+    #       for replies, so the consumer can still make them; events read
+    #       meanwhile are queued beyond maxsize.
+    #
+    #     async for event in controller.events(policy='coalesce'):
+    #         ...
+    POLICIES = ('drop_oldest', 'coalesce', 'block')
+
+    def __init__(self, controller, maxsize=1024, policy='drop_oldest'):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown event stream policy {policy}, expected one of {', '.join(self.POLICIES)}.")
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be at least 1, got {maxsize}.")
+        self.controller = controller
+        self.maxsize = maxsize
+        self.policy = policy
+        self.queue = collections.deque()
+        self.pending_changes = set()
+        self.waiter = None
+        self.closed = False
+        self.blocking = False
+        self.received = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.blocked = 0
+
+
+    def __aiter__(self):
+        return self
+
+
+    async def __anext__(self):
+        while not self.queue:
+            if self.closed:
+                raise StopAsyncIteration
+            self.waiter = self.controller.loop.create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+        event = self.queue.popleft()
+        if event.type == SubscriptionEventType.CHANGE:
+            self.pending_changes.discard((event.facility, event.index))
+        if self.blocking and len(self.queue) <= self.maxsize // 2:
+            self.blocking = False
+            self.controller.resume_events(self)
+        return event
+
+
+    def __repr__(self):
+        return f"<EventStream policy={self.policy} maxsize={self.maxsize} queued={len(self.queue)} received={self.received} dropped={self.dropped} coalesced={self.coalesced} blocked={self.blocked} closed={self.closed}>"
+
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.controller.close_events(self)
+        if self.blocking:
+            self.blocking = False
+            self.controller.resume_events(self)
+        self.wake()
+
+
+    def drop_oldest(self):
+        event = self.queue.popleft()
+        if event.type == SubscriptionEventType.CHANGE:
+            self.pending_changes.discard((event.facility, event.index))
+        self.dropped += 1
+
+
+    def put(self, event):
+        self.received += 1
+        queue = self.queue
+        if event.type == SubscriptionEventType.CHANGE:
+            key = (event.facility, event.index)
+            if self.policy == 'coalesce' and key in self.pending_changes:
+                self.coalesced += 1
+                return
+            self.pending_changes.add(key)
+        queue.append(event)
+        if len(queue) > self.maxsize:
+            if self.policy == 'block':
+                if not self.blocking:
+                    self.blocking = True
+                    self.blocked += 1
+                    self.controller.pause_events(self)
+            else:
+                self.drop_oldest()
+        self.wake()
+
+
+    def stats(self):
+        return {
+            'queued': len(self.queue),
+            'received': self.received,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'blocked': self.blocked,
+        }
+
+
+    def wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
@@ -0,0 +1,1302 @@
+import argparse
+import array
+import asyncio
+import collections
+import logging
+import math
+import mmap
+import os
+import random
+import socket
+import stat
+import struct
+
+from pypactl import native_protocol_card_info
+from pypactl import native_protocol_client_info
+from pypactl import native_protocol_module_info
+from pypactl import native_protocol_sink_info
+from pypactl import native_protocol_sink_input_info
+from pypactl import native_protocol_source_info
+from pypactl import native_protocol_source_output_info
+from pypactl.buffer_attr import BufferAttr
+from pypactl.card_info import CardInfo
+from pypactl.card_port_info import CardPortInfo
+from pypactl.card_profile_info import CardProfileInfo
+from pypactl.channel_map import ChannelMap
+from pypactl.client_info import ClientInfo
+from pypactl.command import Command
+from pypactl.command_error import CommandError
+from pypactl.cvolume import Cvolume
+from pypactl.error_code import ErrorCode
+from pypactl.format_info import FormatInfo
+from pypactl.frame_flag import FrameFlag
+from pypactl.invalid_packet import InvalidPacket
+from pypactl.mempool import MemPool
+from pypactl.module_info import ModuleInfo
+from pypactl.native_transport import NativeTransport, received_fds
+from pypactl.packet import FRAME_HEADER_STRUCT, SHM_INFO_STRUCT, Packet
+from pypactl.protocol import Protocol
+from pypactl.receive_buffer import ReceiveBuffer
+from pypactl.sample_file import MAX_SAMPLE_SIZE
+from pypactl.sample_format import SAMPLE_SIZES, SampleFormat
+from pypactl.sample_spec import SampleSpec
+from pypactl.server_info import ServerInfo
+from pypactl.sink_info import SinkInfo
+from pypactl.sink_input_info import SinkInputInfo
+from pypactl.sink_port_info import SinkPortInfo
+from pypactl.source_info import SourceInfo
+from pypactl.source_output_info import SourceOutputInfo
+from pypactl.source_port_info import SourcePortInfo
+from pypactl.subscription_event_type import SubscriptionEventType
+
+INVALID_INDEX = 0xffffffff
+VOLUME_NORM = 0x10000
+SAMPLE_FORMAT_S16LE = 3
+ENCODING_PCM = 1
+# Front left and front right.
+CHANNEL_POSITIONS = [1, 2]
+# Frames in one period of the tone record streams capture.
+TONE_PERIOD = 100
+# struct format and full scale of the sample formats the tone is made in;
+# others record silence.
+TONE_FORMATS = {
+    SampleFormat.U8: ('B', 127),
+    SampleFormat.S16LE: ('<h', 32767),
+    SampleFormat.FLOAT32LE: ('<f', 1.0),
+    SampleFormat.S32LE: ('<i', 2147483647),
+}
+
+STRUCTURES = {
+    SubscriptionEventType.SINK: native_protocol_sink_info,
+    SubscriptionEventType.SOURCE: native_protocol_source_info,
+    SubscriptionEventType.SINK_INPUT: native_protocol_sink_input_info,
+    SubscriptionEventType.SOURCE_OUTPUT: native_protocol_source_output_info,
+    SubscriptionEventType.MODULE: native_protocol_module_info,
+    SubscriptionEventType.CLIENT: native_protocol_client_info,
+    SubscriptionEventType.CARD: native_protocol_card_info,
+}
+
+# command: (facility, whether the request carries a name after the index)
+INFO_COMMANDS = {
+    Command.GET_CARD_INFO: (SubscriptionEventType.CARD, True),
+    Command.GET_CLIENT_INFO: (SubscriptionEventType.CLIENT, False),
+    Command.GET_MODULE_INFO: (SubscriptionEventType.MODULE, False),
+    Command.GET_SINK_INFO: (SubscriptionEventType.SINK, True),
+    Command.GET_SINK_INPUT_INFO: (SubscriptionEventType.SINK_INPUT, False),
+    Command.GET_SOURCE_INFO: (SubscriptionEventType.SOURCE, True),
+    Command.GET_SOURCE_OUTPUT_INFO: (SubscriptionEventType.SOURCE_OUTPUT, False),
+}
+
+LIST_COMMANDS = {
+    Command.GET_CARD_INFO_LIST: SubscriptionEventType.CARD,
+    Command.GET_CLIENT_INFO_LIST: SubscriptionEventType.CLIENT,
+    Command.GET_MODULE_INFO_LIST: SubscriptionEventType.MODULE,
+    Command.GET_SINK_INFO_LIST: SubscriptionEventType.SINK,
+    Command.GET_SINK_INPUT_INFO_LIST: SubscriptionEventType.SINK_INPUT,
+    Command.GET_SOURCE_INFO_LIST: SubscriptionEventType.SOURCE,
+    Command.GET_SOURCE_OUTPUT_INFO_LIST: SubscriptionEventType.SOURCE_OUTPUT,
+}
+
+
+def make_tone(sample_spec):
+    # One period of a half scale sine, the same on every channel.
+    frame_size = SAMPLE_SIZES[sample_spec.format] * sample_spec.channels
+    if sample_spec.format not in TONE_FORMATS:
+        return bytes(TONE_PERIOD * frame_size)
+    format, scale = TONE_FORMATS[sample_spec.format]
+    tone = bytearray()
+    for i in range(TONE_PERIOD):
+        value = math.sin(2 * math.pi * i / TONE_PERIOD) * scale / 2
+        if sample_spec.format == SampleFormat.U8:
+            value += 128
+        if not isinstance(scale, float):
+            value = round(value)
+        tone += struct.pack(format, value) * sample_spec.channels
+    return bytes(tone)
+
+
+def encode_structure(packet, structure_module, info, version):
+    # The inverse of compile_structure: writes info's fields in the order and
+    # for the versions the structure table gives.
+    for field in structure_module.structure:
+        name, type = field[0], field[1]
+        min_version = field[2] if len(field) > 2 else 0
+        max_version = field[3] if len(field) > 3 else None
+        if version < min_version or (max_version is not None and version > max_version):
+            continue
+        value = getattr(info, name)
+        if isinstance(type, tuple):
+            element = type[2]
+            for item in value:
+                if isinstance(element, str):
+                    getattr(packet, f'add_{element}')(item)
+                else:
+                    encode_structure(packet, element, item, version)
+        else:
+            getattr(packet, f'add_{type}')(value)
+
+
+class LoadProfile:
+    # What the fake server has and how it behaves. Everything is derived from
+    # these settings and seed, so two runs with the same profile send the
+    # same bytes.
+    def __init__(self, sinks=2, sources=1, sink_inputs=2, source_outputs=0, clients=2, modules=4, cards=1, proplist_size=8, property_size=16, event_rate=0, event_count=None, event_facility=SubscriptionEventType.SINK, reply_delay=0, reply_jitter=0, reply_delays=None, playback_rate=1.0, capture_rate=1.0, shm=True, version=Protocol.VERSION, seed=0):
+        self.sinks = sinks
+        self.sources = sources
+        self.sink_inputs = sink_inputs
+        self.source_outputs = source_outputs
+        self.clients = clients
+        self.modules = modules
+        self.cards = cards
+        self.proplist_size = proplist_size
+        self.property_size = property_size
+        self.event_rate = event_rate
+        self.event_count = event_count
+        self.event_facility = SubscriptionEventType(event_facility)
+        self.reply_delay = reply_delay
+        self.reply_jitter = reply_jitter
+        if reply_delays is None:
+            reply_delays = {}
+        self.reply_delays = reply_delays
+        # How fast the fake sinks play: 1.0 is real time, 0 instantly.
+        self.playback_rate = playback_rate
+        # How fast the fake sources capture: 1.0 is real time, 2.0 twice as
+        # fast.
+        self.capture_rate = capture_rate
+        # Whether to agree to memfd shared memory with clients that offer
+        # it.
+        self.shm = shm
+        self.version = version
+        self.seed = seed
+
+
+    def __repr__(self):
+        return f"<LoadProfile sinks={self.sinks} sources={self.sources} sink_inputs={self.sink_inputs} source_outputs={self.source_outputs} clients={self.clients} modules={self.modules} cards={self.cards} proplist_size={self.proplist_size} property_size={self.property_size} event_rate={self.event_rate} event_count={self.event_count} event_facility={self.event_facility.name} reply_delay={self.reply_delay} reply_jitter={self.reply_jitter} reply_delays={self.reply_delays} playback_rate={self.playback_rate} capture_rate={self.capture_rate} shm={self.shm} version={self.version} seed={self.seed}>"
+
+
+class FakeServer:
+    # A stand-in for the PulseAudio daemon on a Unix socket. It speaks the
+    # native framing and answers the introspection, SET_* and SUBSCRIBE
+    # commands from synthetic objects described by a LoadProfile.
+    EVENT_TICK = 0.01
+
+    def __init__(self, profile=None, logger=logging.getLogger('pypactl')):
+        if profile is None:
+            profile = LoadProfile()
+        self.profile = profile
+        self.logger = logger
+        self.random = random.Random(profile.seed)
+        self.loop = None
+        self.path = None
+        self.listener = None
+        self.storm = None
+        self.connections = set()
+        self.events_sent = 0
+        self.objects = {facility: {} for facility in STRUCTURES}
+        self.next_indexes = {facility: 0 for facility in STRUCTURES}
+        self.server_info = None
+        # The sample cache, FakeUploadStreams by name.
+        self.samples = {}
+        self.next_sample_index = 0
+        self.samples_played = 0
+        self.populate()
+
+
+    def accept(self):
+        try:
+            connection, address = self.listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        connection.setblocking(False)
+        NativeTransport(self.loop, connection, FakeServerProtocol(self), logger=self.logger)
+
+
+    def add_object(self, facility, info):
+        info.index = self.next_indexes[facility]
+        self.next_indexes[facility] += 1
+        self.objects[facility][info.index] = info
+        return info
+
+
+    async def close(self):
+        if self.storm is not None:
+            self.storm.cancel()
+            self.storm = None
+        for connection in list(self.connections):
+            connection.transport.close()
+        if self.listener is not None:
+            self.loop.remove_reader(self.listener.fileno())
+            self.listener.close()
+            self.listener = None
+        # Let the transports call connection_lost.
+        await asyncio.sleep(0)
+
+
+    def emit_event(self, facility, type, index):
+        self.emit_events([(facility | type, index)])
+
+
+    def emit_events(self, events):
+        frames = []
+        for info, index in events:
+            packet = Packet()
+            packet.add_command(Command.SUBSCRIBE_EVENT)
+            packet.add_id(INVALID_INDEX)
+            packet.add_u32(info)
+            packet.add_u32(index)
+            frames.append((1 << (info & SubscriptionEventType.FACILITY_MASK), bytes(packet.frame())))
+        for connection in self.connections:
+            mask = connection.subscription_mask
+            data = b''.join(frame for bit, frame in frames if mask & bit)
+            if data:
+                connection.transport.write(data)
+        self.events_sent += len(events)
+
+
+    def find_object(self, facility, index, name=None):
+        objects = self.objects[facility]
+        if index != INVALID_INDEX:
+            info = objects.get(index)
+        else:
+            info = next((info for info in objects.values() if info.name == name), None)
+        if info is None:
+            raise CommandError(f"No {facility.name.lower()} with index {index} or name {name}.", ErrorCode.PA_ERR_NOENTITY)
+        return info
+
+
+    def get_reply_delay(self, command):
+        profile = self.profile
+        delay = profile.reply_delays.get(command, profile.reply_delay)
+        if profile.reply_jitter:
+            delay += self.random.uniform(0, profile.reply_jitter)
+        return delay
+
+
+    def make_card(self, name):
+        card = CardInfo()
+        card.name = f'alsa_card.{name}'
+        card.owner_module = 0
+        card.driver = 'fake_server.py'
+        card.profiles = []
+        for priority, profile_name in enumerate(['off', 'output:analog-stereo']):
+            profile = CardProfileInfo()
+            profile.name = profile_name
+            profile.description = profile_name.title()
+            profile.n_sinks = priority
+            profile.n_sources = 0
+            profile.priority = priority
+            profile.available = 1
+            card.profiles.append(profile)
+        card.n_profiles = len(card.profiles)
+        card.active_profile_name = card.profiles[-1].name
+        card.proplist = self.make_proplist(card.name, {'device.description': f'Fake Card {name}'})
+        port = CardPortInfo()
+        port.name = 'analog-output-speaker'
+        port.description = 'Speakers'
+        port.priority = 10000
+        port.available = 0
+        port.direction = 1
+        port.proplist = {'device.icon_name': 'audio-speakers'}
+        port.profiles = [card.active_profile_name]
+        port.n_profiles = len(port.profiles)
+        port.latency_offset = 0
+        card.ports = [port]
+        card.n_ports = len(card.ports)
+        return card
+
+
+    def make_client(self, name, proplist=None):
+        client = ClientInfo()
+        client.name = name
+        client.owner_module = 0
+        client.driver = 'fake_server.py'
+        client.proplist = self.make_proplist(name, proplist or {'application.name': name})
+        return client
+
+
+    def make_format_info(self):
+        format_info = FormatInfo()
+        format_info.encoding = ENCODING_PCM
+        format_info.proplist = {}
+        return format_info
+
+
+    def make_module(self, name):
+        module = ModuleInfo()
+        module.name = name
+        module.argument = None
+        module.n_used = INVALID_INDEX
+        module.auto_unload = False
+        module.proplist = self.make_proplist(name, {'module.description': name})
+        return module
+
+
+    def make_proplist(self, name, proplist):
+        # Pads the real looking properties out to proplist_size entries of
+        # property_size bytes each.
+        profile = self.profile
+        for i in range(len(proplist), profile.proplist_size):
+            proplist[f'fake.property.{i}'] = f'{name}.{i}.'.ljust(profile.property_size, 'x')
+        return proplist
+
+
+    def make_sample_spec(self):
+        sample_spec = SampleSpec()
+        sample_spec.format = SAMPLE_FORMAT_S16LE
+        sample_spec.channels = len(CHANNEL_POSITIONS)
+        sample_spec.rate = 44100
+        return sample_spec
+
+
+    def make_sink(self, name):
+        sink = SinkInfo()
+        sink.name = f'alsa_output.{name}'
+        sink.description = f'Fake Output {name}'
+        self.set_device_fields(sink, SinkPortInfo)
+        sink.proplist = self.make_proplist(sink.name, {'device.description': sink.description, 'device.class': 'sound'})
+        return sink
+
+
+    def make_source(self, name, sink=None):
+        source = SourceInfo()
+        if sink is None:
+            source.name = f'alsa_input.{name}'
+            source.description = f'Fake Input {name}'
+            source.monitor_of_sink = INVALID_INDEX
+            source.monitor_of_sink_name = None
+        else:
+            source.name = f'{sink.name}.monitor'
+            source.description = f'Monitor of {sink.description}'
+            source.monitor_of_sink = sink.index
+            source.monitor_of_sink_name = sink.name
+        self.set_device_fields(source, SourcePortInfo)
+        source.proplist = self.make_proplist(source.name, {'device.description': source.description, 'device.class': 'monitor' if sink else 'sound'})
+        return source
+
+
+    def make_stream(self, info_class, name, client, device):
+        stream = info_class()
+        stream.name = name
+        stream.owner_module = INVALID_INDEX
+        stream.client = client
+        stream.sample_spec = self.make_sample_spec()
+        stream.channel_map = ChannelMap()
+        stream.channel_map.channels = list(CHANNEL_POSITIONS)
+        stream.volume = Cvolume()
+        stream.volume.channels = [VOLUME_NORM] * len(CHANNEL_POSITIONS)
+        stream.buffer_usec = 0
+        stream.resample_method = None
+        stream.driver = 'fake_server.py'
+        stream.mute = False
+        stream.proplist = self.make_proplist(name, {'media.name': name})
+        stream.corked = False
+        stream.has_volume = True
+        stream.volume_writable = True
+        stream.format = self.make_format_info()
+        if info_class is SinkInputInfo:
+            stream.sink = device
+            stream.sink_usec = 0
+        else:
+            stream.source = device
+            stream.source_usec = 0
+        return stream
+
+
+    def populate(self):
+        profile = self.profile
+        for i in range(profile.modules):
+            self.add_object(SubscriptionEventType.MODULE, self.make_module(f'module-fake-{i}'))
+        for i in range(profile.clients):
+            self.add_object(SubscriptionEventType.CLIENT, self.make_client(f'fake-client-{i}'))
+        for i in range(profile.cards):
+            self.add_object(SubscriptionEventType.CARD, self.make_card(f'fake-{i}'))
+        for i in range(profile.sinks):
+            sink = self.add_object(SubscriptionEventType.SINK, self.make_sink(f'fake-{i}'))
+            monitor = self.add_object(SubscriptionEventType.SOURCE, self.make_source(None, sink))
+            sink.monitor_source = monitor.index
+            sink.monitor_source_name = monitor.name
+        for i in range(profile.sources):
+            self.add_object(SubscriptionEventType.SOURCE, self.make_source(f'fake-{i}'))
+        sinks = sorted(self.objects[SubscriptionEventType.SINK])
+        sources = sorted(self.objects[SubscriptionEventType.SOURCE])
+        clients = sorted(self.objects[SubscriptionEventType.CLIENT]) or [INVALID_INDEX]
+        if sinks:
+            for i in range(profile.sink_inputs):
+                stream = self.make_stream(SinkInputInfo, f'fake-playback-{i}', clients[i % len(clients)], sinks[i % len(sinks)])
+                self.add_object(SubscriptionEventType.SINK_INPUT, stream)
+        if sources:
+            for i in range(profile.source_outputs):
+                stream = self.make_stream(SourceOutputInfo, f'fake-record-{i}', clients[i % len(clients)], sources[i % len(sources)])
+                self.add_object(SubscriptionEventType.SOURCE_OUTPUT, stream)
+        server_info = ServerInfo()
+        server_info.package_name = 'pulseaudio'
+        server_info.package_version = 'fake'
+        server_info.user_name = 'fake'
+        server_info.host_name = 'fake-server'
+        server_info.default_sample_spec = self.make_sample_spec()
+        server_info.default_channel_map = ChannelMap()
+        server_info.default_channel_map.channels = list(CHANNEL_POSITIONS)
+        server_info.default_sink = self.objects[SubscriptionEventType.SINK][sinks[0]].name if sinks else None
+        server_info.default_source = self.objects[SubscriptionEventType.SOURCE][sources[0]].name if sources else None
+        server_info.cookie = self.random.getrandbits(32)
+        self.server_info = server_info
+
+
+    def remove_object(self, facility, index):
+        if self.objects[facility].pop(index, None) is not None:
+            self.emit_event(facility, SubscriptionEventType.REMOVE, index)
+
+
+    async def run_event_storm(self):
+        # Sends CHANGE events for the event_facility objects in turn at
+        # event_rate per second, a tick's worth per write.
+        profile = self.profile
+        facility = profile.event_facility
+        start = self.loop.time()
+        sent = 0
+        while profile.event_count is None or sent < profile.event_count:
+            await asyncio.sleep(self.EVENT_TICK)
+            indexes = sorted(self.objects[facility])
+            if not indexes:
+                continue
+            due = int((self.loop.time() - start) * profile.event_rate)
+            if profile.event_count is not None:
+                due = min(due, profile.event_count)
+            events = []
+            while sent < due:
+                events.append((facility | SubscriptionEventType.CHANGE, indexes[sent % len(indexes)]))
+                sent += 1
+            if events:
+                self.emit_events(events)
+
+
+    def set_device_fields(self, device, port_class):
+        device.sample_spec = self.make_sample_spec()
+        device.channel_map = ChannelMap()
+        device.channel_map.channels = list(CHANNEL_POSITIONS)
+        device.owner_module = 0
+        device.volume = Cvolume()
+        device.volume.channels = [VOLUME_NORM] * len(CHANNEL_POSITIONS)
+        device.mute = False
+        device.latency = 0
+        device.driver = 'fake_server.py'
+        device.flags = 0
+        device.configured_latency = 0
+        device.base_volume = VOLUME_NORM
+        device.state = 0
+        device.n_volume_steps = VOLUME_NORM + 1
+        device.card = INVALID_INDEX
+        device.ports = []
+        for priority, port_name in enumerate(['analog-headphones', 'analog-speaker']):
+            port = port_class()
+            port.name = port_name
+            port.description = port_name.replace('-', ' ').title()
+            port.priority = priority
+            port.available = 0
+            device.ports.append(port)
+        device.n_ports = len(device.ports)
+        device.ap = device.ports[-1].name
+        device.formats = [self.make_format_info()]
+        device.n_formats = len(device.formats)
+
+
+    async def start(self, path):
+        self.loop = asyncio.get_running_loop()
+        self.path = path
+        # Connections get the client's NativeTransport, rather than
+        # create_unix_server's, so file descriptors passed with SCM_RIGHTS
+        # come through.
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(path)
+            listener.listen()
+            listener.setblocking(False)
+        except BaseException:
+            listener.close()
+            raise
+        self.listener = listener
+        self.loop.add_reader(listener.fileno(), self.accept)
+
+
+    def start_event_storm(self):
+        # The storm starts with the first subscriber so that every event of
+        # an event_count storm reaches it.
+        if self.profile.event_rate > 0 and self.storm is None:
+            self.storm = self.loop.create_task(self.run_event_storm())
+
+
+class FakePlaybackStream:
+    # The server side of a client's playback stream. Audio is "played" at
+    # the profile's playback_rate and its credit handed back with REQUEST
+    # once it has been.
+    def __init__(self, channel, sink_input, buffer_attr):
+        self.channel = channel
+        self.sink_input = sink_input
+        self.buffer_attr = buffer_attr
+        sample_spec = sink_input.sample_spec
+        self.byte_rate = SAMPLE_SIZES[sample_spec.format] * sample_spec.channels * sample_spec.rate
+        self.received = 0
+        self.queued = 0
+        # Credit for audio that hasn't started playing yet.
+        self.pending_credit = 0
+        self.played_until = 0
+        self.started = False
+        # Bumped by a flush, so audio played from before it is ignored.
+        self.generation = 0
+
+
+class FakeRecordStream:
+    # The server side of a client's record stream. Whenever it isn't corked
+    # a fragment of tone is sent every fragment's worth of time, scaled by
+    # the profile's capture_rate.
+    def __init__(self, channel, source_output, buffer_attr):
+        self.channel = channel
+        self.source_output = source_output
+        self.buffer_attr = buffer_attr
+        sample_spec = source_output.sample_spec
+        self.byte_rate = SAMPLE_SIZES[sample_spec.format] * sample_spec.channels * sample_spec.rate
+        self.tone = make_tone(sample_spec)
+        self.sent = 0
+        self.handle = None
+
+
+    def stop(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+
+class FakeUploadStream:
+    # A sample being uploaded to the cache, and once finished the cached
+    # sample, though only its length is kept, not the audio.
+    def __init__(self, channel, name, sample_spec, length):
+        self.channel = channel
+        self.name = name
+        self.sample_spec = sample_spec
+        self.length = length
+        self.received = 0
+        self.index = None
+
+
+class FakeServerProtocol(asyncio.Protocol):
+    # One client connection to a FakeServer.
+    def __init__(self, server):
+        self.server = server
+        self.logger = server.logger
+        self.buffer = ReceiveBuffer()
+        self.transport = None
+        self.version = server.profile.version
+        self.subscription_mask = 0
+        self.client_index = None
+        self.reply_at = 0
+        self.playback_streams = {}
+        self.record_streams = {}
+        self.upload_streams = {}
+        self.next_channel = 0
+        # memfd shared memory: the pool record audio is sent from, the
+        # client's segments by shm id and the fds received for them.
+        self.memfd = False
+        self.mempool = None
+        self.shm_segments = {}
+        self.received_fds = collections.deque()
+        self.shm_blocks_in = 0
+        self.srbchannel_block = None
+
+
+    def add_info(self, reply, facility, info):
+        encode_structure(reply, STRUCTURES[facility], info, self.version)
+
+
+    def connection_lost(self, exception):
+        self.server.connections.discard(self)
+        for stream in self.playback_streams.values():
+            self.server.remove_object(SubscriptionEventType.SINK_INPUT, stream.sink_input.index)
+        self.playback_streams = {}
+        for stream in self.record_streams.values():
+            stream.stop()
+            self.server.remove_object(SubscriptionEventType.SOURCE_OUTPUT, stream.source_output.index)
+        self.record_streams = {}
+        self.upload_streams = {}
+        for fd in self.received_fds:
+            os.close(fd)
+        self.received_fds.clear()
+        for segment in self.shm_segments.values():
+            segment.close()
+        self.shm_segments = {}
+        if self.mempool is not None:
+            self.mempool.close()
+            self.mempool = None
+        if self.client_index is not None:
+            self.server.remove_object(SubscriptionEventType.CLIENT, self.client_index)
+
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.connections.add(self)
+
+
+    def create_error(self, id, error_code):
+        packet = Packet()
+        packet.add_command(Command.ERROR)
+        packet.add_id(id)
+        packet.add_u32(error_code)
+        return packet
+
+
+    def create_reply(self, id):
+        packet = Packet()
+        packet.add_command(Command.REPLY)
+        packet.add_id(id)
+        return packet
+
+
+    def create_stream_packet(self, command, channel):
+        packet = Packet()
+        packet.add_command(command)
+        packet.add_id(INVALID_INDEX)
+        packet.add_u32(channel)
+        return packet
+
+
+    def find_playback_stream(self, channel):
+        stream = self.playback_streams.get(channel)
+        if stream is None:
+            raise CommandError(f"No playback stream on channel {channel}.", ErrorCode.PA_ERR_NOENTITY)
+        return stream
+
+
+    def find_record_stream(self, channel):
+        stream = self.record_streams.get(channel)
+        if stream is None:
+            raise CommandError(f"No record stream on channel {channel}.", ErrorCode.PA_ERR_NOENTITY)
+        return stream
+
+
+    def find_upload_stream(self, channel):
+        stream = self.upload_streams.get(channel)
+        if stream is None:
+            raise CommandError(f"No upload stream on channel {channel}.", ErrorCode.PA_ERR_NOENTITY)
+        return stream
+
+
+    def get_buffer(self, sizehint=-1):
+        return self.buffer.get_write_buffer()
+
+
+    def handle_data(self):
+        buffer = self.buffer
+        header_size = FRAME_HEADER_STRUCT.size
+        while buffer.end - buffer.start >= header_size:
+            length, channel, offset_hi, offset_lo, flags = FRAME_HEADER_STRUCT.unpack_from(buffer.data, buffer.start)
+            if buffer.end - buffer.start < header_size + length:
+                break
+            buffer.consume(header_size)
+            data = buffer.consume(length)
+            if flags & FrameFlag.SHM_RELEASE:
+                if not flags & FrameFlag.SHM_DATA:
+                    self.release_block(channel)
+            elif channel == INVALID_INDEX:
+                self.handle_packet(Packet(data))
+            elif flags & FrameFlag.SHM_DATA:
+                self.handle_shm_data(channel, data)
+            else:
+                self.handle_stream_data(channel, len(data))
+
+
+    def handle_auth(self, packet, reply):
+        client_version = packet.get_u32()
+        self.version = min(client_version & Protocol.VERSION_MASK, self.server.profile.version)
+        packet.get_arbitrary()
+        # Only memfd shared memory is offered, not POSIX shm.
+        self.memfd = self.server.profile.shm and self.version >= 31 and client_version & Protocol.FLAG_SHM and client_version & Protocol.FLAG_MEMFD
+        if self.memfd:
+            reply.add_u32(self.server.profile.version | Protocol.FLAG_SHM | Protocol.FLAG_MEMFD)
+            # After the reply, like the real server.
+            self.server.loop.call_soon(self.register_mempool)
+        else:
+            reply.add_u32(self.server.profile.version)
+
+
+    def handle_cork_playback_stream(self, packet, reply):
+        stream = self.find_playback_stream(packet.get_u32())
+        self.set_attribute(SubscriptionEventType.SINK_INPUT, stream.sink_input.index, None, 'corked', packet.get_boolean())
+
+
+    def handle_cork_record_stream(self, packet, reply):
+        stream = self.find_record_stream(packet.get_u32())
+        corked = packet.get_boolean()
+        self.set_attribute(SubscriptionEventType.SOURCE_OUTPUT, stream.source_output.index, None, 'corked', corked)
+        if corked:
+            stream.stop()
+        elif stream.handle is None:
+            self.schedule_record(stream)
+
+
+    def handle_create_playback_stream(self, packet, reply):
+        server = self.server
+        version = self.version
+        name = packet.get_string() if version < 13 else None
+        sample_spec = packet.get_sample_spec()
+        channel_map = packet.get_channel_map()
+        sink_index = packet.get_u32()
+        sink_name = packet.get_string()
+        buffer_attr = BufferAttr()
+        buffer_attr.maxlength = packet.get_u32()
+        corked = packet.get_boolean()
+        buffer_attr.tlength = packet.get_u32()
+        buffer_attr.prebuf = packet.get_u32()
+        buffer_attr.minreq = packet.get_u32()
+        packet.get_u32()
+        volume = packet.get_cvolume()
+        muted = False
+        proplist = {}
+        if version >= 12:
+            for i in range(7):
+                packet.get_boolean()
+        if version >= 13:
+            muted = packet.get_boolean()
+            packet.get_boolean()
+            proplist = packet.get_proplist()
+            name = proplist.get('media.name')
+        if sink_index == INVALID_INDEX and sink_name is None:
+            sink_name = server.server_info.default_sink
+        sink = server.find_object(SubscriptionEventType.SINK, sink_index, sink_name)
+        sink_input = server.make_stream(SinkInputInfo, name or 'playback', self.client_index, sink.index)
+        sink_input.sample_spec = sample_spec
+        sink_input.channel_map = channel_map
+        sink_input.volume = volume
+        sink_input.mute = muted
+        sink_input.corked = corked
+        sink_input.proplist.update(proplist)
+        server.add_object(SubscriptionEventType.SINK_INPUT, sink_input)
+        frame_size = SAMPLE_SIZES[sample_spec.format] * sample_spec.channels
+        if buffer_attr.tlength == INVALID_INDEX:
+            # A quarter of a second.
+            buffer_attr.tlength = sample_spec.rate // 4 * frame_size
+        if buffer_attr.maxlength == INVALID_INDEX:
+            buffer_attr.maxlength = 4 * 1024 * 1024
+        if buffer_attr.prebuf == INVALID_INDEX:
+            buffer_attr.prebuf = buffer_attr.tlength
+        if buffer_attr.minreq == INVALID_INDEX:
+            buffer_attr.minreq = buffer_attr.tlength // 4
+        channel = self.next_channel
+        self.next_channel += 1
+        self.playback_streams[channel] = FakePlaybackStream(channel, sink_input, buffer_attr)
+        server.emit_event(SubscriptionEventType.SINK_INPUT, SubscriptionEventType.NEW, sink_input.index)
+        reply.add_u32(channel)
+        reply.add_u32(sink_input.index)
+        reply.add_u32(buffer_attr.tlength)
+        if version >= 9:
+            reply.add_u32(buffer_attr.maxlength)
+            reply.add_u32(buffer_attr.tlength)
+            reply.add_u32(buffer_attr.prebuf)
+            reply.add_u32(buffer_attr.minreq)
+        if version >= 12:
+            reply.add_sample_spec(sample_spec)
+            reply.add_channel_map(channel_map)
+            reply.add_u32(sink.index)
+            reply.add_string(sink.name)
+            reply.add_boolean(False)
+        if version >= 13:
+            reply.add_usec(buffer_attr.tlength * 1000000 // (frame_size * sample_spec.rate))
+        if version >= 21:
+            reply.add_format_info(sink_input.format)
+
+
+    def handle_create_record_stream(self, packet, reply):
+        server = self.server
+        version = self.version
+        name = packet.get_string() if version < 13 else None
+        sample_spec = packet.get_sample_spec()
+        channel_map = packet.get_channel_map()
+        source_index = packet.get_u32()
+        source_name = packet.get_string()
+        buffer_attr = BufferAttr()
+        buffer_attr.maxlength = packet.get_u32()
+        corked = packet.get_boolean()
+        buffer_attr.fragsize = packet.get_u32()
+        proplist = {}
+        if version >= 12:
+            for i in range(7):
+                packet.get_boolean()
+        if version >= 13:
+            packet.get_boolean()
+            packet.get_boolean()
+            proplist = packet.get_proplist()
+            packet.get_u32()
+            name = proplist.get('media.name')
+        if source_index == INVALID_INDEX and source_name is None:
+            source_name = server.server_info.default_source
+        source = server.find_object(SubscriptionEventType.SOURCE, source_index, source_name)
+        source_output = server.make_stream(SourceOutputInfo, name or 'record', self.client_index, source.index)
+        source_output.sample_spec = sample_spec
+        source_output.channel_map = channel_map
+        source_output.corked = corked
+        source_output.proplist.update(proplist)
+        server.add_object(SubscriptionEventType.SOURCE_OUTPUT, source_output)
+        frame_size = SAMPLE_SIZES[sample_spec.format] * sample_spec.channels
+        if buffer_attr.maxlength == INVALID_INDEX:
+            buffer_attr.maxlength = 4 * 1024 * 1024
+        if buffer_attr.fragsize == INVALID_INDEX:
+            # A fortieth of a second.
+            buffer_attr.fragsize = sample_spec.rate // 40 * frame_size
+        buffer_attr.fragsize = max(frame_size, buffer_attr.fragsize - buffer_attr.fragsize % frame_size)
+        channel = self.next_channel
+        self.next_channel += 1
+        stream = FakeRecordStream(channel, source_output, buffer_attr)
+        self.record_streams[channel] = stream
+        server.emit_event(SubscriptionEventType.SOURCE_OUTPUT, SubscriptionEventType.NEW, source_output.index)
+        reply.add_u32(channel)
+        reply.add_u32(source_output.index)
+        if version >= 9:
+            reply.add_u32(buffer_attr.maxlength)
+            reply.add_u32(buffer_attr.fragsize)
+        if version >= 12:
+            reply.add_sample_spec(sample_spec)
+            reply.add_channel_map(channel_map)
+            reply.add_u32(source.index)
+            reply.add_string(source.name)
+            reply.add_boolean(False)
+        if version >= 13:
+            reply.add_usec(buffer_attr.fragsize * 1000000 // stream.byte_rate)
+        if version >= 22:
+            reply.add_format_info(source_output.format)
+        if not corked:
+            self.schedule_record(stream)
+
+
+    def handle_create_upload_stream(self, packet, reply):
+        name = packet.get_string() if self.version < 13 else None
+        sample_spec = packet.get_sample_spec()
+        packet.get_channel_map()
+        length = packet.get_u32()
+        if self.version >= 13:
+            name = packet.get_proplist().get('event.id')
+        frame_size = SAMPLE_SIZES[sample_spec.format] * sample_spec.channels
+        if not name or length == 0 or length % frame_size or length > MAX_SAMPLE_SIZE:
+            raise CommandError(f"Can't upload {length} bytes as sample {name}.", ErrorCode.PA_ERR_INVALID)
+        channel = self.next_channel
+        self.next_channel += 1
+        self.upload_streams[channel] = FakeUploadStream(channel, name, sample_spec, length)
+        reply.add_u32(channel)
+        reply.add_u32(length)
+
+
+    def handle_delete_playback_stream(self, packet, reply):
+        stream = self.find_playback_stream(packet.get_u32())
+        del self.playback_streams[stream.channel]
+        self.server.remove_object(SubscriptionEventType.SINK_INPUT, stream.sink_input.index)
+
+
+    def handle_delete_record_stream(self, packet, reply):
+        stream = self.find_record_stream(packet.get_u32())
+        stream.stop()
+        del self.record_streams[stream.channel]
+        self.server.remove_object(SubscriptionEventType.SOURCE_OUTPUT, stream.source_output.index)
+
+
+    def handle_delete_upload_stream(self, packet, reply):
+        del self.upload_streams[self.find_upload_stream(packet.get_u32()).channel]
+
+
+    def handle_drain_playback_stream(self, packet, reply):
+        # The reply waits until everything sent has been played.
+        stream = self.find_playback_stream(packet.get_u32())
+        self.reply_at = max(self.reply_at, stream.played_until)
+
+
+    def handle_finish_upload_stream(self, packet, reply):
+        server = self.server
+        stream = self.find_upload_stream(packet.get_u32())
+        del self.upload_streams[stream.channel]
+        if stream.received != stream.length:
+            raise CommandError(f"Sample {stream.name} got {stream.received} of {stream.length} bytes.", ErrorCode.PA_ERR_INVALID)
+        previous = server.samples.get(stream.name)
+        if previous is None:
+            stream.index = server.next_sample_index
+            server.next_sample_index += 1
+        else:
+            stream.index = previous.index
+        server.samples[stream.name] = stream
+        server.emit_event(SubscriptionEventType.SAMPLE_CACHE, SubscriptionEventType.NEW if previous is None else SubscriptionEventType.CHANGE, stream.index)
+
+
+    def handle_flush_playback_stream(self, packet, reply):
+        stream = self.find_playback_stream(packet.get_u32())
+        stream.generation += 1
+        stream.played_until = self.server.loop.time()
+        stream.queued = 0
+        if stream.pending_credit:
+            self.send_request(stream, stream.pending_credit)
+            stream.pending_credit = 0
+
+
+    def handle_flush_record_stream(self, packet, reply):
+        # Fragments are sent as soon as they are captured, so there is
+        # nothing to drop.
+        self.find_record_stream(packet.get_u32())
+
+
+    def handle_get_server_info(self, packet, reply):
+        server_info = self.server.server_info
+        reply.add_string(server_info.package_name)
+        reply.add_string(server_info.package_version)
+        reply.add_string(server_info.user_name)
+        reply.add_string(server_info.host_name)
+        reply.add_sample_spec(server_info.default_sample_spec)
+        reply.add_string(server_info.default_sink)
+        reply.add_string(server_info.default_source)
+        reply.add_u32(server_info.cookie)
+        if self.version >= 15:
+            reply.add_channel_map(server_info.default_channel_map)
+
+
+    def handle_packet(self, packet):
+        try:
+            packet.parse_command()
+        except (InvalidPacket, ValueError) as exception:
+            self.logger.error(f"FakeServer couldn't parse {packet}: {exception}")
+            self.transport.close()
+            return
+        reply = self.create_reply(packet.id)
+        try:
+            if packet.command in INFO_COMMANDS:
+                facility, has_name = INFO_COMMANDS[packet.command]
+                index = packet.get_u32()
+                name = packet.get_string() if has_name else None
+                self.add_info(reply, facility, self.server.find_object(facility, index, name))
+            elif packet.command in LIST_COMMANDS:
+                facility = LIST_COMMANDS[packet.command]
+                objects = self.server.objects[facility]
+                for index in sorted(objects):
+                    self.add_info(reply, facility, objects[index])
+            else:
+                method = getattr(self, f"handle_{packet.command.name.lower()}", None)
+                if method is None:
+                    raise CommandError(f"FakeServer doesn't support {packet.command.name}.", ErrorCode.PA_ERR_NOTSUPPORTED)
+                method(packet, reply)
+        except CommandError as error:
+            reply = self.create_error(packet.id, error.error_code)
+        except InvalidPacket as exception:
+            self.logger.error(f"FakeServer got an invalid {packet.command.name}: {exception}")
+            reply = self.create_error(packet.id, ErrorCode.PA_ERR_PROTOCOL)
+        # Commands without a tag, like REGISTER_MEMFD_SHMID, get no reply.
+        if packet.id != INVALID_INDEX:
+            self.send_reply(packet.command, reply)
+
+
+    def handle_play_sample(self, packet, reply):
+        # The sample plays on a sink input of its own, which goes away once
+        # it has been played at the profile's playback_rate.
+        server = self.server
+        sink_index = packet.get_u32()
+        sink_name = packet.get_string()
+        packet.get_u32()
+        name = packet.get_string()
+        if self.version >= 13:
+            packet.get_proplist()
+        sample = server.samples.get(name)
+        if sample is None:
+            raise CommandError(f"No sample {name}.", ErrorCode.PA_ERR_NOENTITY)
+        if sink_index == INVALID_INDEX and sink_name is None:
+            sink_name = server.server_info.default_sink
+        sink = server.find_object(SubscriptionEventType.SINK, sink_index, sink_name)
+        sink_input = server.make_stream(SinkInputInfo, name, self.client_index, sink.index)
+        sink_input.sample_spec = sample.sample_spec
+        server.add_object(SubscriptionEventType.SINK_INPUT, sink_input)
+        server.emit_event(SubscriptionEventType.SINK_INPUT, SubscriptionEventType.NEW, sink_input.index)
+        server.samples_played += 1
+        sample_spec = sample.sample_spec
+        rate = server.profile.playback_rate
+        duration = sample.length / (SAMPLE_SIZES[sample_spec.format] * sample_spec.channels * sample_spec.rate * rate) if rate > 0 else 0
+        server.loop.call_later(duration, server.remove_object, SubscriptionEventType.SINK_INPUT, sink_input.index)
+        if self.version >= 13:
+            reply.add_u32(sink_input.index)
+
+
+    def handle_register_memfd_shmid(self, packet, reply):
+        shm_id = packet.get_u32()
+        if not self.received_fds:
+            raise CommandError(f"REGISTER_MEMFD_SHMID {shm_id} came without a file descriptor.", ErrorCode.PA_ERR_PROTOCOL)
+        fd = self.received_fds.popleft()
+        try:
+            self.shm_segments[shm_id] = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+
+
+    def handle_remove_sample(self, packet, reply):
+        server = self.server
+        sample = server.samples.pop(packet.get_string(), None)
+        if sample is None:
+            raise CommandError("No such sample.", ErrorCode.PA_ERR_NOENTITY)
+        server.emit_event(SubscriptionEventType.SAMPLE_CACHE, SubscriptionEventType.REMOVE, sample.index)
+
+
+    def handle_set_client_name(self, packet, reply):
+        server = self.server
+        proplist = packet.get_proplist() if self.version >= 13 else {'application.name': packet.get_string()}
+        client = server.add_object(SubscriptionEventType.CLIENT, server.make_client(proplist.get('application.name', 'unknown'), proplist))
+        self.client_index = client.index
+        server.emit_event(SubscriptionEventType.CLIENT, SubscriptionEventType.NEW, client.index)
+        if self.version >= 13:
+            reply.add_u32(client.index)
+
+
+    def handle_set_default_sink(self, packet, reply):
+        self.set_default(SubscriptionEventType.SINK, 'default_sink', packet.get_string())
+
+
+    def handle_set_default_source(self, packet, reply):
+        self.set_default(SubscriptionEventType.SOURCE, 'default_source', packet.get_string())
+
+
+    def handle_set_sink_input_mute(self, packet, reply):
+        self.set_attribute(SubscriptionEventType.SINK_INPUT, packet.get_u32(), None, 'mute', packet.get_boolean())
+
+
+    def handle_set_sink_input_volume(self, packet, reply):
+        self.set_attribute(SubscriptionEventType.SINK_INPUT, packet.get_u32(), None, 'volume', packet.get_cvolume())
+
+
+    def handle_set_sink_mute(self, packet, reply):
+        self.set_attribute(SubscriptionEventType.SINK, packet.get_u32(), packet.get_string(), 'mute', packet.get_boolean())
+
+
+    def handle_set_sink_volume(self, packet, reply):
+        self.set_attribute(SubscriptionEventType.SINK, packet.get_u32(), packet.get_string(), 'volume', packet.get_cvolume())
+
+
+    def handle_set_source_mute(self, packet, reply):
+        self.set_attribute(SubscriptionEventType.SOURCE, packet.get_u32(), packet.get_string(), 'mute', packet.get_boolean())
+
+
+    def handle_set_source_volume(self, packet, reply):
+        self.set_attribute(SubscriptionEventType.SOURCE, packet.get_u32(), packet.get_string(), 'volume', packet.get_cvolume())
+
+
+    def handle_shm_data(self, channel, data):
+        block_id, shm_id, offset, length = SHM_INFO_STRUCT.unpack(data)
+        segment = self.shm_segments.get(shm_id)
+        if segment is None or offset + length > len(segment):
+            self.logger.error(f"FakeServer got block {block_id} of unknown or too small segment {shm_id}.")
+            self.transport.close()
+            return
+        self.shm_blocks_in += 1
+        # The fake sink copies the audio out, so the block goes straight
+        # back.
+        self.transport.write(FRAME_HEADER_STRUCT.pack(0, block_id, 0, 0, FrameFlag.SHM_RELEASE))
+        self.handle_stream_data(channel, length)
+
+
+    def handle_stream_data(self, channel, length):
+        stream = self.playback_streams.get(channel)
+        if stream is None:
+            upload_stream = self.upload_streams.get(channel)
+            if upload_stream is not None:
+                upload_stream.received += length
+            return
+        loop = self.server.loop
+        now = loop.time()
+        stream.received += length
+        stream.queued += length
+        rate = self.server.profile.playback_rate
+        start = max(now, stream.played_until)
+        stream.played_until = start + (length / (stream.byte_rate * rate) if rate > 0 else 0)
+        if not stream.started:
+            stream.started = True
+            self.write_packet(self.create_stream_packet(Command.STARTED, channel))
+        # The credit goes back as the audio starts playing, so a client
+        # that keeps up never runs the buffer dry.
+        if start <= now:
+            self.send_request(stream, length)
+        else:
+            stream.pending_credit += length
+            loop.call_at(start, self.return_credit, stream, stream.generation, length)
+        if stream.played_until <= now:
+            self.played(stream, stream.generation, length)
+        else:
+            loop.call_at(stream.played_until, self.played, stream, stream.generation, length)
+
+
+    def handle_subscribe(self, packet, reply):
+        self.subscription_mask = packet.get_u32()
+        self.server.start_event_storm()
+
+
+    def played(self, stream, generation, length):
+        # Reports an underflow if that was the last of the audio.
+        if self.playback_streams.get(stream.channel) is not stream or generation != stream.generation:
+            return
+        stream.queued -= length
+        if stream.queued == 0:
+            underflow = self.create_stream_packet(Command.UNDERFLOW, stream.channel)
+            if self.version >= 23:
+                underflow.add_s64(stream.received)
+            self.write_packet(underflow)
+
+
+    def msg_received_into(self, nbytes, ancillary_data, msg_flags, address):
+        if ancillary_data:
+            self.received_fds.extend(received_fds(ancillary_data))
+        self.buffer.advance(nbytes)
+        self.handle_data()
+
+
+    def record(self, stream):
+        # Sends a fragment of tone, carrying on from where the last one
+        # stopped, after the reply that created the stream. With memfd it
+        # goes in a pool block when one is free.
+        stream.handle = None
+        fragsize = stream.buffer_attr.fragsize
+        tone = stream.tone
+        start = stream.sent % len(tone)
+        repeats = (start + fragsize + len(tone) - 1) // len(tone)
+        data = (tone * repeats)[start:start + fragsize]
+        stream.sent += fragsize
+        if not self.transport.is_closing():
+            self.write_stream_data(stream.channel, data)
+        self.schedule_record(stream)
+
+
+    def register_mempool(self):
+        # Gives the client the pool record audio comes from, then offers it
+        # an srbchannel, with two eventfds and the ring buffer's block, which
+        # the client is expected to release.
+        if self.transport.is_closing():
+            return
+        if self.transport.get_write_buffer_size() > 0:
+            self.logger.error("FakeServer can't pass the memfd with writes queued.")
+            return
+        self.mempool = MemPool()
+        packet = Packet()
+        packet.add_command(Command.REGISTER_MEMFD_SHMID)
+        packet.add_id(INVALID_INDEX)
+        packet.add_u32(self.mempool.shm_id)
+        self.write_packet_with_fds(packet, [self.mempool.fd])
+        if self.version < 30:
+            return
+        fds = [os.eventfd(0, os.EFD_CLOEXEC), os.eventfd(0, os.EFD_CLOEXEC)]
+        try:
+            packet = Packet()
+            packet.add_command(Command.ENABLE_SRBCHANNEL)
+            packet.add_id(INVALID_INDEX)
+            self.write_packet_with_fds(packet, fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
+        self.srbchannel_block = self.write_stream_data(0, bytes(self.mempool.slot_size))
+
+
+    def release_block(self, block_id):
+        if self.mempool is None or not self.mempool.release(block_id):
+            self.logger.error(f"FakeServer got a release of unknown block {block_id}.")
+        elif block_id == self.srbchannel_block:
+            self.srbchannel_block = None
+
+
+    def return_credit(self, stream, generation, length):
+        if self.playback_streams.get(stream.channel) is stream and generation == stream.generation:
+            stream.pending_credit -= length
+            self.send_request(stream, length)
+
+
+    def schedule_record(self, stream):
+        delay = stream.buffer_attr.fragsize / (stream.byte_rate * self.server.profile.capture_rate)
+        loop = self.server.loop
+        stream.handle = loop.call_at(max(loop.time(), self.reply_at) + delay, self.record, stream)
+
+
+    def send_reply(self, command, reply):
+        # Delayed replies still go out in request order, like the real
+        # server's.
+        delay = self.server.get_reply_delay(command)
+        loop = self.server.loop
+        if delay <= 0 and self.reply_at <= loop.time():
+            self.write_packet(reply)
+            return
+        self.reply_at = max(loop.time() + delay, self.reply_at)
+        loop.call_at(self.reply_at, self.write_packet, reply)
+
+
+    def send_request(self, stream, length):
+        request = self.create_stream_packet(Command.REQUEST, stream.channel)
+        request.add_u32(length)
+        self.write_packet(request)
+
+
+    def set_attribute(self, facility, index, name, attribute, value):
+        info = self.server.find_object(facility, index, name)
+        setattr(info, attribute, value)
+        self.server.emit_event(facility, SubscriptionEventType.CHANGE, info.index)
+
+
+    def set_default(self, facility, attribute, name):
+        info = self.server.find_object(facility, INVALID_INDEX, name)
+        setattr(self.server.server_info, attribute, info.name)
+        self.server.emit_event(SubscriptionEventType.SERVER, SubscriptionEventType.CHANGE, INVALID_INDEX)
+
+
+    def write_packet(self, packet):
+        if not self.transport.is_closing():
+            self.transport.write(packet.frame())
+
+
+    def write_packet_with_fds(self, packet, fds):
+        frame = bytes(packet.frame())
+        sent = self.transport.sendmsg([frame], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds).tobytes())])
+        if sent < len(frame):
+            self.transport.write(frame[sent:])
+
+
+    def write_stream_data(self, channel, data):
+        # Returns the pool block data went in, or None if it was sent
+        # inline.
+        block = None
+        if self.mempool is not None:
+            block = self.mempool.put(data)
+        if block is None:
+            self.transport.write(FRAME_HEADER_STRUCT.pack(len(data), channel, 0, 0, 0) + data)
+            return None
+        block_id, offset = block
+        self.transport.write(FRAME_HEADER_STRUCT.pack(SHM_INFO_STRUCT.size, channel, 0, 0, FrameFlag.SHM_DATA | FrameFlag.SHM_DATA_MEMFD_BLOCK) + SHM_INFO_STRUCT.pack(block_id, self.mempool.shm_id, offset, len(data)))
+        return block_id
+
+
+async def serve(path, profile):
+    server = FakeServer(profile)
+    await server.start(path)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake PulseAudio server for load and latency testing.")
+    parser.add_argument('path', help="Path of the Unix socket to listen on.")
+    parser.add_argument('--sinks', type=int, default=2)
+    parser.add_argument('--sources', type=int, default=1)
+    parser.add_argument('--sink-inputs', type=int, default=2)
+    parser.add_argument('--proplist-size', type=int, default=8, help="Properties per object.")
+    parser.add_argument('--property-size', type=int, default=16, help="Bytes per property value.")
+    parser.add_argument('--event-rate', type=float, default=0, help="Change events per second.")
+    parser.add_argument('--reply-delay', type=float, default=0, help="Seconds to wait before each reply.")
+    parser.add_argument('--reply-jitter', type=float, default=0, help="Extra random delay of up to this many seconds.")
+    parser.add_argument('--playback-rate', type=float, default=1.0, help="How fast playback streams play, 0 for instantly.")
+    parser.add_argument('--capture-rate', type=float, default=1.0, help="How fast record streams capture, 2 for twice real time.")
+    parser.add_argument('--no-shm', dest='shm', action='store_false', help="Don't agree to memfd shared memory.")
+    parser.add_argument('--version', type=int, default=Protocol.VERSION, help="Protocol version to report.")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    profile = LoadProfile(sinks=args.sinks, sources=args.sources, sink_inputs=args.sink_inputs, proplist_size=args.proplist_size, property_size=args.property_size, event_rate=args.event_rate, reply_delay=args.reply_delay, reply_jitter=args.reply_jitter, playback_rate=args.playback_rate, capture_rate=args.capture_rate, shm=args.shm, version=args.version, seed=args.seed)
+    try:
+        asyncio.run(serve(args.path, profile))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
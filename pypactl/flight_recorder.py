@@ -0,0 +1,73 @@
+import time
+
+from pypactl.command import Command
+
+INBOUND = 'in'
+OUTBOUND = 'out'
+
+
+class FlightRecorder:
+    # Remembers the last size frames sent and received: their headers and,
+    # for control packets, the command and id. Recording is a tuple store into
+    # a fixed list, and nothing is formatted until the recorder is dumped,
+    # which str() does, so it can be handed to a logger as a lazy argument.
+    def __init__(self, size=256):
+        self.size = size
+        self.entries = [None] * size
+        self.count = 0
+
+
+    def __str__(self):
+        return self.dump()
+
+
+    def annotate(self, number, command, id):
+        # Adds the command and id to frame number, as returned by record(),
+        # once its packet has been parsed. Frames may have been sent between
+        # the header and the body arriving, so it isn't necessarily the last
+        # one, and it may have been overwritten since.
+        if number < self.count - self.size:
+            return
+        slot = number % self.size
+        entry = self.entries[slot]
+        if entry is not None:
+            self.entries[slot] = entry[:4] + (command, id)
+
+
+    def dump(self):
+        entries = self.get_entries()
+        if not entries:
+            return "No frames recorded."
+        end = entries[-1][0]
+        lines = [f"Last {len(entries)} of {self.count} frames:"]
+        for timestamp, direction, length, channel, command, id in entries:
+            if command is not None:
+                try:
+                    command = Command(command).name
+                except ValueError:
+                    pass
+            lines.append(f"  {timestamp - end:+.6f}s {direction:<3} length={length} channel={channel:#x} command={command} id={id}")
+        return '\n'.join(lines)
+
+
+    def get_entries(self):
+        if self.count <= self.size:
+            return self.entries[:self.count]
+        start = self.count % self.size
+        return self.entries[start:] + self.entries[:start]
+
+
+    def inbound(self, length, channel):
+        return self.record(INBOUND, length, channel)
+
+
+    def outbound(self, length, channel, command=None, id=None):
+        return self.record(OUTBOUND, length, channel, command, id)
+
+
+    def record(self, direction, length, channel, command=None, id=None):
+        # Returns the frame's number, for annotate().
+        number = self.count
+        self.entries[number % self.size] = (time.monotonic(), direction, length, channel, command, id)
+        self.count = number + 1
+        return number
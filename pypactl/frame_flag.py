@@ -0,0 +1,13 @@
+import enum
+
+class FrameFlag(enum.IntEnum):
+    # The flags word of a frame header. The low byte of a data frame is its
+    # SeekMode; the high byte says whether the frame is a reference to a
+    # block of shared memory rather than the data itself.
+    SEEK_MASK = 0x000000ff
+    SHM_WRITABLE = 0x00800000
+    SHM_DATA_MEMFD_BLOCK = 0x20000000
+    SHM_RELEASE = 0x40000000
+    SHM_DATA = 0x80000000
+    SHM_REVOKE = 0xc0000000
+    SHM_MASK = 0xff000000
@@ -0,0 +1,84 @@
+import collections.abc
+import json
+
+from pypactl import native_protocol_card_info
+from pypactl import native_protocol_client_info
+from pypactl import native_protocol_module_info
+from pypactl import native_protocol_sink_info
+from pypactl import native_protocol_sink_input_info
+from pypactl import native_protocol_source_info
+from pypactl import native_protocol_source_output_info
+from pypactl.subscription_event_type import SubscriptionEventType
+
+# Serializes info objects for the CLI's json and ndjson output. Info classes
+# decoded from a structure are written as the structure's fields, leaving out
+# list counts and the names finish() resolves, so the schema doesn't depend
+# on what the decoder happened to leave on the object. Anything else, like
+# SampleSpec, is a plain attribute holder written from its __dict__.
+FORMATS = ('text', 'json', 'ndjson')
+# SubscriptionEventType.NEW has the same value as SINK, so its name can't be
+# used.
+EVENT_TYPE_NAMES = {
+    SubscriptionEventType.NEW: 'new',
+    SubscriptionEventType.CHANGE: 'change',
+    SubscriptionEventType.REMOVE: 'remove',
+}
+
+STRUCTURE_MODULES = (
+    native_protocol_card_info,
+    native_protocol_client_info,
+    native_protocol_module_info,
+    native_protocol_sink_info,
+    native_protocol_sink_input_info,
+    native_protocol_source_info,
+    native_protocol_source_output_info,
+)
+
+
+def get_fields(structure_module, fields_by_class):
+    # Adds the fields written for structure_module's info class, and those of
+    # the structures nested in it, to fields_by_class.
+    count_fields = {field[1][1] for field in structure_module.structure if isinstance(field[1], tuple)}
+    resolved_fields = getattr(structure_module, 'resolved_fields', {})
+    fields = []
+    for field in structure_module.structure:
+        name, type = field[0], field[1]
+        if name in count_fields:
+            continue
+        fields.append(resolved_fields.get(name, name))
+        if isinstance(type, tuple) and not isinstance(type[2], str):
+            get_fields(type[2], fields_by_class)
+    fields_by_class[structure_module.info_class] = tuple(fields)
+    return fields_by_class
+
+
+# info class: names of the attributes written
+FIELDS = {}
+for structure_module in STRUCTURE_MODULES:
+    get_fields(structure_module, FIELDS)
+
+
+def default(value):
+    if isinstance(value, collections.abc.Mapping):
+        # LazyProplist.
+        return dict(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    fields = FIELDS.get(type(value))
+    if fields is not None:
+        return {name: getattr(value, name) for name in fields}
+    try:
+        return vars(value)
+    except TypeError:
+        raise TypeError(f"Can't serialize {type(value).__name__} as JSON.") from None
+
+
+encoder = json.JSONEncoder(default=default, ensure_ascii=False, separators=(',', ':'))
+
+
+def dumps(value):
+    return encoder.encode(value)
+
+
+def event_record(event):
+    return {'facility': event.facility.name, 'type': EVENT_TYPE_NAMES.get(event.type), 'index': event.index}
@@ -0,0 +1,60 @@
+import collections.abc
+import struct
+
+from pypactl.tag import Tag
+
+U32_STRUCT = struct.Struct('!I')
+
+class LazyProplist(collections.abc.Mapping):
+    # Holds the raw entries of a proplist (everything after the PROPLIST tag).
+    # Keys are indexed on first access and each value is decoded only when it
+    # is looked up.
+    def __init__(self, data):
+        self.data = data
+        self.index = None
+        self.values = {}
+
+
+    def __getitem__(self, key):
+        try:
+            return self.values[key]
+        except KeyError:
+            pass
+        start, end = self.get_index()[key]
+        value = self.data[start:end].decode('UTF-8')
+        self.values[key] = value
+        return value
+
+
+    def __iter__(self):
+        return iter(self.get_index())
+
+
+    def __len__(self):
+        return len(self.get_index())
+
+
+    def __repr__(self):
+        return f"<LazyProplist {dict(self)}>"
+
+
+    def get_index(self):
+        if self.index is not None:
+            return self.index
+        data = self.data
+        index = {}
+        offset = 0
+        # Entries are: STRING key, U32 length, ARBITRARY length value.
+        while data[offset] != Tag.STRING_NULL:
+            eos_index = data.index(0, offset + 1)
+            key = data[offset + 1:eos_index].decode('UTF-8')
+            offset = eos_index + 11
+            length = U32_STRUCT.unpack_from(data, offset - 4)[0]
+            # String values carry their terminating NUL.
+            if length > 0 and data[offset + length - 1] == 0:
+                index[key] = (offset, offset + length - 1)
+            else:
+                index[key] = (offset, offset + length)
+            offset += length
+        self.index = index
+        return index
@@ -0,0 +1,19 @@
+import numpy
+
+
+class Level:
+    # Per-channel levels of one sink over one meter interval, as arrays in
+    # channel map order. peak and rms are fractions of full scale and the
+    # _dbfs versions the same in decibels, -inf for silence. frames is how
+    # many frames were measured, 0 if none arrived in the interval.
+    def __init__(self, peak, rms, frames):
+        self.peak = peak
+        self.rms = rms
+        self.frames = frames
+        with numpy.errstate(divide='ignore'):
+            self.peak_dbfs = 20 * numpy.log10(peak)
+            self.rms_dbfs = 20 * numpy.log10(rms)
+
+
+    def __repr__(self):
+        return f"<Level peak={self.peak} rms={self.rms} peak_dbfs={self.peak_dbfs} rms_dbfs={self.rms_dbfs} frames={self.frames}>"
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+
+try:
+    import numpy
+except ImportError as exception:
+    raise ImportError("The level meter needs NumPy, pip install pypactl[meter].") from exception
+
+from pypactl.buffer_attr import BufferAttr
+from pypactl.level import Level
+from pypactl.sample_format import SAMPLE_SIZES, SampleFormat
+from pypactl.sample_spec import SampleSpec
+
+# sample format: (NumPy dtype, value of silence, full scale). Silence is a
+# float for U8 so that subtracting it doesn't wrap around in uint8.
+SAMPLE_DTYPES = {
+    SampleFormat.U8: (numpy.dtype('u1'), 128.0, 128),
+    SampleFormat.S16LE: (numpy.dtype('<i2'), 0, 1 << 15),
+    SampleFormat.S16BE: (numpy.dtype('>i2'), 0, 1 << 15),
+    SampleFormat.FLOAT32LE: (numpy.dtype('<f4'), 0, 1.0),
+    SampleFormat.FLOAT32BE: (numpy.dtype('>f4'), 0, 1.0),
+    SampleFormat.S32LE: (numpy.dtype('<i4'), 0, 1 << 31),
+    SampleFormat.S32BE: (numpy.dtype('>i4'), 0, 1 << 31),
+    SampleFormat.S24_32LE: (numpy.dtype('<i4'), 0, 1 << 23),
+    SampleFormat.S24_32BE: (numpy.dtype('>i4'), 0, 1 << 23),
+}
+
+
+class BlockPool:
+    # One float64 scratch block shared by every monitor of a LevelMeter.
+    # Data is measured synchronously as it is received, so only one block
+    # is in use at a time and it only grows to fit the largest frame seen.
+    def __init__(self, size=4096):
+        self.block = numpy.empty(size)
+        self.grows = 0
+
+
+    def __repr__(self):
+        return f"<BlockPool size={len(self.block)} grows={self.grows}>"
+
+
+    def get(self, frames, channels):
+        size = frames * channels
+        if size > len(self.block):
+            self.block = numpy.empty(max(size, 2 * len(self.block)))
+            self.grows += 1
+        return self.block[:size].reshape(frames, channels)
+
+
+class MonitorMeter:
+    # Accumulates the peak and sum of squares of each channel of one sink's
+    # monitor. Received data is viewed as an array in place in the receive
+    # buffer; only a frame split across two data frames is copied.
+    def __init__(self, sink, stream, pool):
+        self.sink = sink
+        self.stream = stream
+        self.pool = pool
+        sample_spec = stream.sample_spec
+        self.channels = sample_spec.channels
+        self.frame_size = SAMPLE_SIZES[sample_spec.format] * sample_spec.channels
+        self.dtype, self.silence, self.scale = SAMPLE_DTYPES[sample_spec.format]
+        self.partial = bytearray()
+        self.peak = numpy.zeros(self.channels)
+        self.square_sum = numpy.zeros(self.channels)
+        self.frames = 0
+
+
+    def __repr__(self):
+        return f"<MonitorMeter sink={self.sink.name} stream={self.stream} frames={self.frames}>"
+
+
+    def measure(self, data):
+        samples = numpy.frombuffer(data, self.dtype).reshape(-1, self.channels)
+        block = self.pool.get(len(samples), self.channels)
+        numpy.subtract(samples, self.silence, out=block)
+        numpy.abs(block, out=block)
+        numpy.maximum(self.peak, block.max(axis=0), out=self.peak)
+        numpy.square(block, out=block)
+        self.square_sum += block.sum(axis=0)
+        self.frames += len(samples)
+
+
+    def receive(self, stream, data):
+        frame_size = self.frame_size
+        if self.partial:
+            needed = frame_size - len(self.partial)
+            self.partial += data[:needed]
+            data = data[needed:]
+            if len(self.partial) < frame_size:
+                return
+            self.measure(self.partial)
+            self.partial.clear()
+        whole = len(data) - len(data) % frame_size
+        if whole:
+            self.measure(data[:whole])
+        if whole < len(data):
+            self.partial += data[whole:]
+
+
+    def take(self):
+        # Returns the Level since the last take and starts a new interval.
+        frames = self.frames
+        peak = self.peak / self.scale
+        if frames:
+            rms = numpy.sqrt(self.square_sum / frames) / self.scale
+        else:
+            rms = numpy.zeros(self.channels)
+        self.peak[:] = 0
+        self.square_sum[:] = 0
+        self.frames = 0
+        return Level(peak, rms, frames)
+
+
+class LevelMeter:
+    # Live per-channel peak and RMS levels of sinks, measured from record
+    # streams on their monitor sources. The streams run at a low rate, rate
+    # frames a second, in the sink's own sample format when it can be read
+    # as an array and float32 otherwise, so the server does the resampling
+    # and dozens of sinks cost little. Iterating yields a dict of sink name
+    # to Level every interval seconds.
+    #
+    #     meter = await controller.level_meter()
+    #     async for levels in meter:
+    #         for name, level in levels.items():
+    #             print(name, level.peak_dbfs)
+    def __init__(self, controller, interval=0.1, rate=8000, logger=logging.getLogger('pypactl')):
+        self.controller = controller
+        self.interval = interval
+        self.rate = rate
+        self.logger = logger
+        self.pool = BlockPool()
+        # sink name: MonitorMeter
+        self.monitors = {}
+        self.closed = False
+
+
+    def __repr__(self):
+        return f"<LevelMeter interval={self.interval} rate={self.rate} sinks={list(self.monitors)} pool={self.pool} closed={self.closed}>"
+
+
+    async def __aiter__(self):
+        loop = self.controller.loop
+        deadline = loop.time()
+        while not self.closed:
+            # A fixed rate: a consumer that falls behind skips ticks rather
+            # than getting a burst of them.
+            deadline = max(deadline + self.interval, loop.time())
+            await asyncio.sleep(deadline - loop.time())
+            if self.closed:
+                return
+            levels = {}
+            for name, monitor in list(self.monitors.items()):
+                if monitor.stream.error is not None:
+                    self.logger.debug("Level meter lost %s: %s", name, monitor.stream.error)
+                    del self.monitors[name]
+                    continue
+                levels[name] = monitor.take()
+            yield levels
+
+
+    async def add_sink(self, sink):
+        # sink is a SinkInfo.
+        if sink.name in self.monitors:
+            return
+        sample_spec = SampleSpec()
+        sample_spec.format = sink.sample_spec.format
+        if sample_spec.format not in SAMPLE_DTYPES:
+            sample_spec.format = SampleFormat.FLOAT32LE
+        sample_spec.channels = sink.sample_spec.channels
+        sample_spec.rate = self.rate
+        frame_size = SAMPLE_SIZES[sample_spec.format] * sample_spec.channels
+        # Data arrives twice an interval, so each interval's level is close
+        # to current.
+        buffer_attr = BufferAttr(fragsize=max(1, int(self.rate * self.interval / 2)) * frame_size)
+        stream = await self.controller.create_record_stream(sample_spec, source_name=sink.monitor_source_name, name=f'Level meter for {sink.name}', channel_map=sink.channel_map, buffer_attr=buffer_attr)
+        monitor = MonitorMeter(sink, stream, self.pool)
+        stream.on_data = monitor.receive
+        self.monitors[sink.name] = monitor
+
+
+    async def close(self):
+        self.closed = True
+        monitors = list(self.monitors.values())
+        self.monitors = {}
+        await asyncio.gather(*(monitor.stream.close() for monitor in monitors), return_exceptions=True)
+
+
+    async def remove_sink(self, sink_name):
+        monitor = self.monitors.pop(sink_name, None)
+        if monitor is not None:
+            await monitor.stream.close()
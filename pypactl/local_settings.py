@@ -0,0 +1,81 @@
+import functools
+import getpass
+import locale
+import os
+import socket
+
+COOKIE_LENGTH = 256
+
+# These only depend on the process environment, so each is worked out once
+# per process and reused by every connection.
+
+@functools.cache
+def get_client_proplist():
+    proplist = {
+        'application.process.id': str(os.getpid()),
+        'application.process.user': getpass.getuser(),
+        'application.process.host': socket.gethostname(),
+        'application.process.binary': 'pypactl',
+        'application.name': 'pypactl',
+    }
+    lang = locale.setlocale(locale.LC_MESSAGES)
+    if lang is not None:
+        proplist['application.language'] = lang
+    display = os.environ.get('DISPLAY', None)
+    if display is not None:
+        proplist['window.x11.display'] = display
+    proplist['application.process.machine_id'] = get_machine_id()
+    session_id = os.environ.get('XDG_SESSION_ID', None)
+    if session_id is not None:
+        proplist['application.process.session_id'] = session_id
+    return proplist
+
+
+@functools.cache
+def get_cookie():
+    paths_to_try = []
+    if 'PULSE_COOKIE' in os.environ:
+        paths_to_try.append(os.environ['PULSE_COOKIE'])
+    config_home = os.environ.get('XDG_CONFIG_HOME', os.path.expanduser('~/.config'))
+    paths_to_try.append(os.path.join(config_home, 'pulse', 'cookie'))
+    paths_to_try.append(os.path.expanduser('~/.pulse-cookie'))
+    for path in paths_to_try:
+        try:
+            with open(path, 'rb') as cookie_file:
+                cookie = cookie_file.read(COOKIE_LENGTH)
+        except OSError:
+            continue
+        if len(cookie) == COOKIE_LENGTH:
+            return cookie
+    # Local connections are also authenticated by the credentials sent with
+    # AUTH, so an empty cookie still works when there's no cookie file.
+    return bytes(COOKIE_LENGTH)
+
+
+@functools.cache
+def get_machine_id():
+    paths_to_try = [
+        '/etc/machine-id',
+        '/var/lib/dbus/machine-id',
+    ]
+    for path in paths_to_try:
+        try:
+            with open(path, 'rb') as machine_id_file:
+                return machine_id_file.read().decode('ascii').strip()
+        except (OSError, UnicodeDecodeError):
+            continue
+    return socket.gethostname()
+
+
+def get_socket_path():
+    # PULSE_SERVER is a space separated list of servers; use the first local
+    # socket in it, with or without the "unix:" prefix.
+    for server in os.environ.get('PULSE_SERVER', '').split():
+        if server.startswith('unix:'):
+            return server[len('unix:'):]
+        if server.startswith('/'):
+            return server
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir is None:
+        runtime_dir = os.path.join('/run/user', str(os.getuid()))
+    return os.path.join(runtime_dir, 'pulse', 'native')
@@ -3,12 +3,13 @@ import logging
 import os
 import socket
 
+from pypactl.local_settings import get_socket_path
 from pypactl.native_protocol import NativeProtocol
 from pypactl.native_transport import NativeTransport
 
-async def create_connection(loop, path = None, protocol_factory = None, logger = logging.getLogger('pypactl')):
+async def create_connection(loop, path = None, protocol_factory = None, logger = logging.getLogger('pypactl'), fast_connect = False, subscription_mask = None, capture_path = None, metrics = False, shm = True):
     if path is None:
-        path = os.path.join('/var/run/user/', str(os.getuid()), 'pulse/native')
+        path = get_socket_path()
     path = os.fspath(path)
     sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM, 0)
     try:
@@ -19,9 +20,13 @@ async def create_connection(loop, path = None, protocol_factory = None, logger =
         raise
     waiter = loop.create_future()
     if protocol_factory is None:
-        protocol_factory = lambda logger=None: NativeProtocol(logger=logger)
+        protocol_factory = lambda logger=None: NativeProtocol(logger=logger, loop=loop, fast_connect=fast_connect, subscription_mask=subscription_mask, metrics=metrics, shm=shm)
     protocol = protocol_factory(logger=logger)
-    transport = NativeTransport(loop, sock, protocol, waiter, path=path, logger=logger)
+    capture = None
+    if capture_path is not None:
+        from pypactl.wire_capture import CaptureWriter
+        capture = CaptureWriter(capture_path)
+    transport = NativeTransport(loop, sock, protocol, waiter, path=path, logger=logger, capture=capture)
     try:
         await waiter
     except:
@@ -0,0 +1,60 @@
+import mmap
+import os
+import random
+
+
+class MemPool:
+    # A memfd shared with the other end of the connection, split into
+    # fixed size slots. Audio is copied into a slot and only a reference to
+    # it, a frame with SHM_INFO_STRUCT (block id, shm id, offset, length),
+    # goes through the socket. The slot's index is its block id, and it is
+    # free again once the other end sends SHM_RELEASE for it.
+    SLOT_SIZE = 64 * 1024
+
+    def __init__(self, slots=64, slot_size=SLOT_SIZE):
+        self.slot_size = slot_size
+        self.size = slots * slot_size
+        self.shm_id = random.getrandbits(32)
+        self.fd = os.memfd_create('pypactl', os.MFD_CLOEXEC)
+        try:
+            # Pages are only allocated as slots are first written.
+            os.ftruncate(self.fd, self.size)
+            self.mmap = mmap.mmap(self.fd, self.size)
+        except BaseException:
+            os.close(self.fd)
+            raise
+        self.view = memoryview(self.mmap)
+        self.free_slots = list(range(slots - 1, -1, -1))
+        self.exhausted = 0
+
+
+    def __repr__(self):
+        return f"<MemPool shm_id={self.shm_id} size={self.size} slot_size={self.slot_size} free={len(self.free_slots)} exhausted={self.exhausted}>"
+
+
+    def close(self):
+        if self.fd is None:
+            return
+        self.view.release()
+        self.mmap.close()
+        os.close(self.fd)
+        self.fd = None
+
+
+    def put(self, data):
+        # Copies data, at most slot_size bytes, into a free slot and returns
+        # its block id and offset, or None when every slot is in use.
+        if not self.free_slots:
+            self.exhausted += 1
+            return None
+        block_id = self.free_slots.pop()
+        offset = block_id * self.slot_size
+        self.view[offset:offset + len(data)] = data
+        return block_id, offset
+
+
+    def release(self, block_id):
+        if block_id * self.slot_size >= self.size or block_id in self.free_slots:
+            return False
+        self.free_slots.append(block_id)
+        return True
@@ -0,0 +1,145 @@
+import bisect
+import os
+import time
+
+from pypactl.command import Command
+from pypactl.subscription_event_type import SubscriptionEventType
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PARSE_TIME_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+class Histogram:
+    # Counts observations into fixed buckets, Prometheus style: bucket i
+    # holds values <= bounds[i] and the last one everything larger.
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+    def snapshot(self):
+        buckets = []
+        total = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return {'buckets': buckets, 'sum': self.sum, 'count': self.count}
+
+
+class Metrics:
+    # Counters and histograms kept by NativeProtocol while metrics are
+    # enabled. Everything is a plain int, list or dict update so recording
+    # stays cheap.
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = {}
+        self.errors = {}
+        self.latency = {}
+        self.parse_time = {}
+        self.in_flight = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.frames_in = 0
+        self.frames_out = 0
+        self.events = [0] * 16
+
+
+    def abandon(self, id):
+        self.in_flight.pop(id, None)
+
+
+    def observe_parse(self, command, seconds):
+        histogram = self.parse_time.get(command)
+        if histogram is None:
+            histogram = self.parse_time[command] = Histogram(PARSE_TIME_BUCKETS)
+        histogram.observe(seconds)
+
+
+    def reply_received(self, id, error=False):
+        entry = self.in_flight.pop(id, None)
+        if entry is None:
+            return None
+        command, sent = entry
+        histogram = self.latency.get(command)
+        if histogram is None:
+            histogram = self.latency[command] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(time.perf_counter() - sent)
+        if error:
+            self.errors[command] = self.errors.get(command, 0) + 1
+        return command
+
+
+    def request_sent(self, command, id, length):
+        self.requests[command] = self.requests.get(command, 0) + 1
+        self.in_flight[id] = (command, time.perf_counter())
+        self.bytes_out += length
+        self.frames_out += 1
+
+
+    def snapshot(self, reply_map_depth=0):
+        return {
+            'uptime': time.monotonic() - self.started,
+            'requests': {Command(command).name: count for command, count in self.requests.items()},
+            'errors': {Command(command).name: count for command, count in self.errors.items()},
+            'latency': {Command(command).name: histogram.snapshot() for command, histogram in self.latency.items()},
+            'parse_time': {Command(command).name: histogram.snapshot() for command, histogram in self.parse_time.items()},
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'frames_in': self.frames_in,
+            'frames_out': self.frames_out,
+            'events': {(SubscriptionEventType(facility).name if facility <= SubscriptionEventType.CARD else str(facility)): count for facility, count in enumerate(self.events) if count},
+            'reply_map_depth': reply_map_depth,
+        }
+
+
+def format_prometheus(snapshot, prefix='pypactl'):
+    lines = []
+
+    def metric(name, type, help):
+        lines.append(f'# HELP {prefix}_{name} {help}')
+        lines.append(f'# TYPE {prefix}_{name} {type}')
+
+    def histogram(name, label, histograms):
+        for value, data in histograms.items():
+            for bound, count in data['buckets']:
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{prefix}_{name}_bucket{{{label}="{value}",le="{le}"}} {count}')
+            lines.append(f'{prefix}_{name}_sum{{{label}="{value}"}} {data["sum"]}')
+            lines.append(f'{prefix}_{name}_count{{{label}="{value}"}} {data["count"]}')
+
+    metric('requests_total', 'counter', "Requests sent, by command.")
+    for command, count in snapshot['requests'].items():
+        lines.append(f'{prefix}_requests_total{{command="{command}"}} {count}')
+    metric('errors_total', 'counter', "Requests answered with an error, by command.")
+    for command, count in snapshot['errors'].items():
+        lines.append(f'{prefix}_errors_total{{command="{command}"}} {count}')
+    metric('request_latency_seconds', 'histogram', "Time from sending a request to its reply.")
+    histogram('request_latency_seconds', 'command', snapshot['latency'])
+    metric('reply_parse_seconds', 'histogram', "Time spent decoding replies.")
+    histogram('reply_parse_seconds', 'command', snapshot['parse_time'])
+    for name, help in [('bytes_in', "Bytes received."), ('bytes_out', "Bytes sent."), ('frames_in', "Frames received."), ('frames_out', "Frames sent.")]:
+        metric(f'{name}_total', 'counter', help)
+        lines.append(f'{prefix}_{name}_total {snapshot[name]}')
+    metric('events_total', 'counter', "Subscription events received, by facility.")
+    for facility, count in snapshot['events'].items():
+        lines.append(f'{prefix}_events_total{{facility="{facility}"}} {count}')
+    metric('reply_map_depth', 'gauge', "Requests waiting for a reply.")
+    lines.append(f'{prefix}_reply_map_depth {snapshot["reply_map_depth"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(snapshot, path, prefix='pypactl'):
+    # Written to a temporary file and renamed into place so a collector
+    # never reads half a file.
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w') as metrics_file:
+        metrics_file.write(format_prometheus(snapshot, prefix))
+    os.replace(temporary_path, path)
@@ -0,0 +1,12 @@
+class ModuleInfo:
+    def __init__(self):
+        self.index = None
+        self.name = None
+        self.argument = None
+        self.n_used = None
+        self.auto_unload = None
+        self.proplist = {}
+
+
+    def __repr__(self):
+        return f"<ModuleInfo index={self.index} name={self.name} argument={self.argument} n_used={self.n_used} auto_unload={self.auto_unload} proplist={self.proplist}>"
@@ -1,61 +1,244 @@
+import array
 import asyncio
-import getpass
-import locale
+import collections
+import functools
+import heapq
 import logging
 import os
 import socket
 import struct
+import time
 
+from pypactl import native_protocol_card_info
+from pypactl import native_protocol_client_info
+from pypactl import native_protocol_module_info
+from pypactl import native_protocol_sink_info
+from pypactl import native_protocol_sink_input_info
+from pypactl import native_protocol_source_info
+from pypactl import native_protocol_source_output_info
+from pypactl.buffer_attr import BufferAttr
+from pypactl.channel_map import default_channel_map
 from pypactl.command import Command
 from pypactl.command_error import CommandError
+from pypactl.cvolume import VOLUME_NORM, Cvolume
 from pypactl.error_code import ErrorCode
 from pypactl.event import Event
-from pypactl.packet import Packet
+from pypactl.frame_flag import FrameFlag
+from pypactl.local_settings import get_client_proplist, get_cookie, get_machine_id
+from pypactl.native_transport import received_fds
+from pypactl.packet import FRAME_HEADER_STRUCT, SHM_INFO_STRUCT, TAG_U32, TAGGED_U32_STRUCT, Packet
 from pypactl.protocol import Protocol
+from pypactl.receive_buffer import ReceiveBuffer
+from pypactl.seek_mode import SeekMode
 from pypactl.server_info import ServerInfo
-from pypactl.sink_info import SinkInfo
-from pypactl.sink_port_info import SinkPortInfo
+from pypactl.structure_compiler import compile_structure
 from pypactl.subscription_event_type import SubscriptionEventType
 from pypactl.subscription_mask import SubscriptionMask
-from pypactl.tag import Tag
+
+SUBSCRIPTION_FACILITIES = [
+    SubscriptionEventType.SINK,
+    SubscriptionEventType.SOURCE,
+    SubscriptionEventType.SINK_INPUT,
+    SubscriptionEventType.SOURCE_OUTPUT,
+    SubscriptionEventType.MODULE,
+    SubscriptionEventType.CLIENT,
+    SubscriptionEventType.SAMPLE_CACHE,
+    SubscriptionEventType.SERVER,
+    SubscriptionEventType.AUTOLOAD,
+    SubscriptionEventType.CARD,
+]
+SUBSCRIPTION_TYPES = [
+    SubscriptionEventType.NEW,
+    SubscriptionEventType.CHANGE,
+    SubscriptionEventType.REMOVE,
+]
+DEFAULT_SUBSCRIPTION_FACILITIES = [facility for facility in SUBSCRIPTION_FACILITIES if SubscriptionMask.ALL & (1 << facility)]
+
+# Indexed by the facility and type bits of an event, so dispatching an event
+# doesn't construct enums.
+EVENT_KEY_MASK = int(SubscriptionEventType.FACILITY_MASK | SubscriptionEventType.TYPE_MASK)
+EVENT_FACILITIES = [None] * 16
+for facility in SUBSCRIPTION_FACILITIES:
+    EVENT_FACILITIES[facility] = facility
+EVENT_TYPES = SUBSCRIPTION_TYPES + [None]
+SHM_DATA_FLAGS = FrameFlag.SHM_DATA | FrameFlag.SHM_DATA_MEMFD_BLOCK
+# Where a packet's tag is in its frame: after the header and the tagged
+# command.
+PACKET_ID_OFFSET = FRAME_HEADER_STRUCT.size + TAGGED_U32_STRUCT.size
+VOLUME_INVALID = 0xffffffff
 
 class NativeProtocol(asyncio.Protocol):
     FRAME_STRUCT = '!IIIII'
+    INVALID_INDEX = 0xffffffff
+    INFO_STRUCTURES = {
+        'card_info': native_protocol_card_info,
+        'client_info': native_protocol_client_info,
+        'module_info': native_protocol_module_info,
+        'sink_info': native_protocol_sink_info,
+        'sink_input_info': native_protocol_sink_input_info,
+        'source_info': native_protocol_source_info,
+        'source_output_info': native_protocol_source_output_info,
+    }
+    # facility: (list command, INFO_STRUCTURES name)
+    INFO_LISTS = {
+        SubscriptionEventType.CARD: (Command.GET_CARD_INFO_LIST, 'card_info'),
+        SubscriptionEventType.CLIENT: (Command.GET_CLIENT_INFO_LIST, 'client_info'),
+        SubscriptionEventType.MODULE: (Command.GET_MODULE_INFO_LIST, 'module_info'),
+        SubscriptionEventType.SINK: (Command.GET_SINK_INFO_LIST, 'sink_info'),
+        SubscriptionEventType.SINK_INPUT: (Command.GET_SINK_INPUT_INFO_LIST, 'sink_input_info'),
+        SubscriptionEventType.SOURCE: (Command.GET_SOURCE_INFO_LIST, 'source_info'),
+        SubscriptionEventType.SOURCE_OUTPUT: (Command.GET_SOURCE_OUTPUT_INFO_LIST, 'source_output_info'),
+    }
 
-    def __init__(self, on_connection_lost=None, logger = logging.getLogger('pypactl')):
-        self.buffer = memoryview(b'')
+    def __init__(self, on_connection_lost=None, logger = logging.getLogger('pypactl'), loop=None, fast_connect=False, subscription_mask=None, metrics=False, flight_recorder_size=256, shm=True):
+        # Without loop, the protocol has to be made in the loop it will
+        # run in.
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        self.loop = loop
+        self.fast_connect = fast_connect
+        self.initial_subscription_mask = subscription_mask
+        self.subscription_mask = None
+        self.ready = loop.create_future()
+        self.buffer = ReceiveBuffer()
         self.expecting_frame = True
-        self.expected_length = struct.calcsize(self.FRAME_STRUCT)
+        self.expected_length = FRAME_HEADER_STRUCT.size
         self.command_id = 0
         self.on_connection_lost = on_connection_lost
         self.logger = logger
         self.version = Protocol.VERSION
         self.reply_map = {}
-        self.subscribers = []
+        # Set while an EventStream with the block policy is full; reading
+        # is paused then unless requests are waiting for replies.
+        self.events_blocked = False
+        self.reading_paused = False
+        self.default_timeout = None
+        self.deadlines = []
+        self.deadline_timer = None
+        # facility | type: callbacks, and callback: facility | type keys.
+        self.subscribers = {}
+        self.subscriptions = {}
         self.ready_listeners = []
+        self.cork_depth = 0
+        self.corked_frames = []
+        # channel: PlaybackStream or RecordStream
+        self.playback_streams = {}
+        self.record_streams = {}
+        # The channel and flags of the frame being read, INVALID_INDEX for
+        # packets.
+        self.frame_channel = self.INVALID_INDEX
+        self.frame_flags = 0
+        # The flight recorder's number for the frame being received.
+        self.frame_record = None
+        # Shared memory: whether to offer it, what the server agreed to, the
+        # memfd pool playback audio is sent from and the server's segments
+        # by shm id.
+        self.offer_shm = shm
+        self.shm = False
+        self.memfd = False
+        self.mempool = None
+        self.shm_segments = {}
+        self.received_fds = collections.deque()
+        self.srbchannel_pending = False
+        # (name, sink_name, volume): encoded PLAY_SAMPLE frame
+        self.play_sample_frames = {}
+        # Set while the transport's write buffer is over its high water
+        # mark, with the futures of writers waiting for it to drain.
+        self.write_paused = False
+        self.write_waiters = []
+        # Metrics, like the stream and shared memory modules below, are
+        # imported when first used, so one-shot commands don't load them.
+        self.metrics = None
+        if metrics:
+            self.enable_metrics()
+        from pypactl.flight_recorder import FlightRecorder
+        self.flight_recorder = FlightRecorder(flight_recorder_size)
+        self.compile_info_decoders()
+
+
+    def add_deadline(self, id, timeout):
+        deadline = self.loop.time() + timeout
+        heapq.heappush(self.deadlines, (deadline, id))
+        if self.deadline_timer is None or deadline < self.deadline_timer.when():
+            if self.deadline_timer is not None:
+                self.deadline_timer.cancel()
+            self.deadline_timer = self.loop.call_at(deadline, self.expire_deadlines)
 
 
     def add_ready_listener(self, callback):
         self.ready_listeners.append(callback)
 
 
+    def block_events(self, blocked):
+        self.events_blocked = blocked
+        self.update_reading()
+
+
+    def close_shared_memory(self):
+        for fd in self.received_fds:
+            os.close(fd)
+        self.received_fds.clear()
+        for segment in self.shm_segments.values():
+            segment.close()
+        self.shm_segments = {}
+        if self.mempool is not None:
+            self.mempool.close()
+            self.mempool = None
+
+
+    def compile_info_decoders(self):
+        self.info_decoders = {}
+        for name, structure_module in self.INFO_STRUCTURES.items():
+            self.info_decoders[name] = compile_structure(structure_module, self.version)
+
+
     def connection_lost(self, exception):
+        self.logger.debug("connection_lost(%s)", exception)
+        if exception is not None or self.reply_map:
+            self.dump_flight_recorder(logging.ERROR, f"Connection lost with {len(self.reply_map)} requests waiting: {exception}.")
+        reply_map = self.reply_map
+        self.reply_map = {}
+        if self.metrics is not None:
+            self.metrics.in_flight.clear()
+        for method, future in reply_map.values():
+            if not future.done():
+                future.set_exception(CommandError(f"Connection lost: {exception}.", ErrorCode.PA_ERR_CONNECTIONTERMINATED))
+        self.deadlines = []
+        if self.deadline_timer is not None:
+            self.deadline_timer.cancel()
+            self.deadline_timer = None
+        for stream in list(self.playback_streams.values()) + list(self.record_streams.values()):
+            stream.fail(CommandError(f"Connection lost: {exception}.", ErrorCode.PA_ERR_CONNECTIONTERMINATED))
+        self.close_shared_memory()
+        self.resume_writing()
         if self.on_connection_lost is None:
             return
-        self.logger.debug(f"connection_lost({exception})")
         if not self.on_connection_lost.cancelled():
             self.on_connection_lost.set_result(True)
 
 
     def connection_made(self, transport):
         self.transport = transport
-        self.send_auth()
+        if self.fast_connect:
+            self.send_handshake(self.initial_subscription_mask)
+        else:
+            self.send_auth()
 
 
-    def consume(self, length):
-        result = self.buffer[:length]
-        self.buffer = self.buffer[length:]
-        return result
+    def cork(self):
+        self.cork_depth += 1
+
+
+    def create_auth_packet(self):
+        packet = self.create_command_packet(Command.AUTH)
+        version = Protocol.VERSION
+        if self.offer_shm:
+            version |= Protocol.FLAG_SHM
+            if hasattr(os, 'memfd_create'):
+                version |= Protocol.FLAG_MEMFD
+        packet.add_u32(version)
+        packet.add_arbitrary(get_cookie())
+        return packet
 
 
     def create_command_packet(self, command):
@@ -66,136 +249,646 @@ class NativeProtocol(asyncio.Protocol):
         return packet
 
 
+    def create_playback_stream_packet(self, sample_spec, channel_map, volume, sink_index, sink_name, buffer_attr, corked, muted, proplist):
+        version = self.version
+        packet = self.create_command_packet(Command.CREATE_PLAYBACK_STREAM)
+        if version < 13:
+            packet.add_string(proplist.get('media.name'))
+        packet.add_sample_spec(sample_spec)
+        packet.add_channel_map(channel_map)
+        packet.add_u32(sink_index)
+        packet.add_string(sink_name)
+        packet.add_u32(buffer_attr.maxlength)
+        packet.add_boolean(corked)
+        packet.add_u32(buffer_attr.tlength)
+        packet.add_u32(buffer_attr.prebuf)
+        packet.add_u32(buffer_attr.minreq)
+        # Sync ID.
+        packet.add_u32(0)
+        if volume is None:
+            default_volume = Cvolume()
+            default_volume.channels = [VOLUME_NORM] * sample_spec.channels
+            packet.add_cvolume(default_volume)
+        else:
+            packet.add_cvolume(volume)
+        if version >= 12:
+            # no_remap, no_remix, fix_format, fix_rate, fix_channels, no_move
+            # and variable_rate.
+            for i in range(7):
+                packet.add_boolean(False)
+        if version >= 13:
+            # start_muted, adjust_latency.
+            packet.add_boolean(bool(muted))
+            packet.add_boolean(False)
+            packet.add_proplist(proplist)
+        if version >= 14:
+            # volume_set, early_requests.
+            packet.add_boolean(volume is not None)
+            packet.add_boolean(False)
+        if version >= 15:
+            # muted_set, dont_inhibit_auto_suspend, fail_on_suspend.
+            packet.add_boolean(muted is not None)
+            packet.add_boolean(False)
+            packet.add_boolean(False)
+        if version >= 17:
+            # relative_volume.
+            packet.add_boolean(False)
+        if version >= 18:
+            # passthrough.
+            packet.add_boolean(False)
+        if version >= 21:
+            # No formats, the sample spec says what's sent.
+            packet.add_u8(0)
+        return packet
+
+
+    def create_properties_packet(self):
+        packet = self.create_command_packet(Command.SET_CLIENT_NAME)
+        packet.add_proplist(get_client_proplist())
+        return packet
+
+
+    def create_record_stream_packet(self, sample_spec, channel_map, source_index, source_name, buffer_attr, corked, peak_detect, proplist):
+        version = self.version
+        packet = self.create_command_packet(Command.CREATE_RECORD_STREAM)
+        if version < 13:
+            packet.add_string(proplist.get('media.name'))
+        packet.add_sample_spec(sample_spec)
+        packet.add_channel_map(channel_map)
+        packet.add_u32(source_index)
+        packet.add_string(source_name)
+        packet.add_u32(buffer_attr.maxlength)
+        packet.add_boolean(corked)
+        packet.add_u32(buffer_attr.fragsize)
+        if version >= 12:
+            # no_remap, no_remix, fix_format, fix_rate, fix_channels, no_move
+            # and variable_rate.
+            for i in range(7):
+                packet.add_boolean(False)
+        if version >= 13:
+            # peak_detect, adjust_latency.
+            packet.add_boolean(peak_detect)
+            packet.add_boolean(False)
+            packet.add_proplist(proplist)
+            # direct_on_input.
+            packet.add_u32(self.INVALID_INDEX)
+        if version >= 14:
+            # early_requests.
+            packet.add_boolean(False)
+        if version >= 15:
+            # dont_inhibit_auto_suspend, fail_on_suspend.
+            packet.add_boolean(False)
+            packet.add_boolean(False)
+        if version >= 22:
+            # No formats, then the volume and start_muted, volume_set,
+            # muted_set, relative_volume and passthrough, all left to the
+            # server.
+            packet.add_u8(0)
+            volume = Cvolume()
+            volume.channels = [VOLUME_NORM] * sample_spec.channels
+            packet.add_cvolume(volume)
+            for i in range(5):
+                packet.add_boolean(False)
+        return packet
+
+
+    def create_play_sample_packet(self, name, sink_name, volume):
+        packet = self.create_command_packet(Command.PLAY_SAMPLE)
+        packet.add_u32(self.INVALID_INDEX)
+        packet.add_string(sink_name)
+        packet.add_u32(VOLUME_INVALID if volume is None else volume)
+        packet.add_string(name)
+        if self.version >= 13:
+            packet.add_proplist({})
+        return packet
+
+
+    def create_upload_stream_packet(self, name, sample_spec, channel_map, length, proplist):
+        packet = self.create_command_packet(Command.CREATE_UPLOAD_STREAM)
+        if self.version < 13:
+            packet.add_string(name)
+        packet.add_sample_spec(sample_spec)
+        packet.add_channel_map(channel_map)
+        packet.add_u32(length)
+        if self.version >= 13:
+            packet.add_proplist(proplist)
+        return packet
+
+
+    def create_subscribe_packet(self, mask):
+        self.subscription_mask = mask
+        packet = self.create_command_packet(Command.SUBSCRIBE)
+        packet.add_u32(mask)
+        return packet
+
+
+    def decode_info_iter(self, decode, packet):
+        while packet.remaining() > 0:
+            yield decode(packet)
+
+
+    def decode_info_list(self, packet, name, fields=None, lazy_proplist=False):
+        decode = self.get_info_decoder(name, fields, lazy_proplist)
+        infos = []
+        while packet.remaining() > 0:
+            infos.append(decode(packet))
+        return infos
+
+
+    def dump_flight_recorder(self, level, reason):
+        # The recorder is only formatted if the record is emitted.
+        self.logger.log(level, "%s\n%s", reason, self.flight_recorder)
+
+
+    def enable_metrics(self):
+        if self.metrics is None:
+            from pypactl.metrics import Metrics
+            self.metrics = Metrics()
+        return self.metrics
+
+
+    def expire_deadlines(self):
+        # One timer covers every pending deadline: it fails whatever has
+        # expired and re-arms itself for the earliest one left. Entries for
+        # requests that were already answered are just dropped.
+        self.deadline_timer = None
+        now = self.loop.time()
+        deadlines = self.deadlines
+        while deadlines and deadlines[0][0] <= now:
+            deadline, id = heapq.heappop(deadlines)
+            entry = self.reply_map.pop(id, None)
+            if entry is None:
+                continue
+            if self.metrics is not None:
+                self.metrics.abandon(id)
+            method, future = entry
+            if not future.done():
+                self.dump_flight_recorder(logging.WARNING, f"Timed out waiting for a reply to packet {id}.")
+                future.set_exception(CommandError(f"Timed out waiting for a reply to packet {id}.", ErrorCode.PA_ERR_TIMEOUT))
+        if deadlines:
+            self.deadline_timer = self.loop.call_at(deadlines[0][0], self.expire_deadlines)
+
+
+    def get_shm_segment(self, shm_id, memfd):
+        # A memfd segment is registered by the server before it is used; a
+        # POSIX one is opened by name the first time it is referred to.
+        segment = self.shm_segments.get(shm_id)
+        if segment is None and not memfd:
+            import mmap
+            try:
+                with open(f'/dev/shm/pulse-shm-{shm_id}', 'rb') as shm_file:
+                    segment = mmap.mmap(shm_file.fileno(), 0, prot=mmap.PROT_READ)
+            except OSError as exception:
+                self.logger.error("Couldn't attach shared memory segment %s: %s", shm_id, exception)
+                return None
+            self.shm_segments[shm_id] = segment
+        return segment
+
+
+    def get_buffer(self, sizehint=-1):
+        return self.buffer.get_write_buffer(max(ReceiveBuffer.MIN_READ_SIZE, self.expected_length - len(self.buffer)))
+
+
+    def get_info_decoder(self, name, fields=None, lazy_proplist=False):
+        if fields is None and not lazy_proplist:
+            return self.info_decoders[name]
+        return compile_structure(self.INFO_STRUCTURES[name], self.version, fields, lazy_proplist)
+
+
+    def get_playback_stream(self, packet):
+        channel = packet.get_u32()
+        stream = self.playback_streams.get(channel)
+        if stream is None:
+            self.logger.debug("%s for unknown playback stream %s", packet.command.name, channel)
+        return stream
+
+
+    def get_record_stream(self, packet):
+        channel = packet.get_u32()
+        stream = self.record_streams.get(channel)
+        if stream is None:
+            self.logger.debug("%s for unknown record stream %s", packet.command.name, channel)
+        return stream
+
+
     def handle_auth_reply(self, packet):
         self.logger.debug("handle_auth_reply")
-        self.version = packet.get_u32()
-        self.logger.debug(f"PulseAudio Server Protocol Version: {self.version}")
-        self.send_properties()
+        reply = packet.get_u32()
+        server_version = reply & Protocol.VERSION_MASK
+        self.logger.debug("PulseAudio Server Protocol Version: %s", server_version)
+        self.version = min(server_version, Protocol.VERSION)
+        self.compile_info_decoders()
+        # The server only agrees to shared memory with a client running as
+        # the same user.
+        self.shm = self.offer_shm and self.version >= 13 and bool(reply & Protocol.FLAG_SHM)
+        self.memfd = self.shm and self.version >= 31 and bool(reply & Protocol.FLAG_MEMFD) and hasattr(os, 'memfd_create')
+        if self.memfd:
+            self.register_mempool()
+        if not self.fast_connect:
+            self.send_properties()
 
 
     def handle_command_error(self, packet):
         self.logger.debug("handle_command_error")
         error_code = ErrorCode(packet.get_u32())
-        if not packet.id in self.reply_map:
-            self.logger.error(f"Recevied error {packet}, but there's no matching id in the reply_map.")
+        if self.metrics is not None:
+            self.metrics.reply_received(packet.id, error=True)
+        entry = self.reply_map.pop(packet.id, None)
+        if entry is None:
+            self.log_unmatched_reply("error", packet)
             return
-        method, callback = self.reply_map.pop(packet.id, (None, None))
-        raise CommandError(f"There was an error executing command for packet {packet.id}: {error_code.name}.", error_code)
+        method, future = entry
+        if not future.done():
+            self.dump_flight_recorder(logging.INFO, f"Packet {packet.id} failed: {error_code.name}.")
+            future.set_exception(CommandError(f"There was an error executing command for packet {packet.id}: {error_code.name}.", error_code))
 
 
     def handle_command_reply(self, packet):
-        if not packet.id in self.reply_map:
-            self.logger.error(f"Recevied reply {packet}, but there's no matching id in the reply_map.")
+        metrics = self.metrics
+        if metrics is not None:
+            command = metrics.reply_received(packet.id)
+        entry = self.reply_map.pop(packet.id, None)
+        if entry is None:
+            self.log_unmatched_reply("reply", packet)
             return
-        method, callback = self.reply_map.pop(packet.id, (None, None))
-        result = None
-        if callable(method):
-            result = method(packet)
-        if callback is not None:
-            callback(result)
+        method, future = entry
+        if future.done():
+            return
+        try:
+            if not callable(method):
+                result = None
+            elif metrics is None:
+                result = method(packet)
+            else:
+                start = time.perf_counter()
+                result = method(packet)
+                if command is not None:
+                    metrics.observe_parse(command, time.perf_counter() - start)
+        except Exception as exception:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
 
 
     def handle_data(self):
-        self.logger.debug(f"handle_data {self.expected_length} {len(self.buffer)} {self.buffer}")
-        while len(self.buffer) >= self.expected_length:
-            data = self.consume(self.expected_length)
+        buffer = self.buffer
+        self.logger.debug("handle_data %s %s %s", self.expected_length, len(buffer), buffer)
+        while buffer.end - buffer.start >= self.expected_length:
             if self.expecting_frame:
-                self.handle_frame(data)
+                self.handle_frame(buffer.consume(self.expected_length))
             else:
-                self.handle_packet(data)
-            self.logger.debug(f"handle_data {self.expected_length} {len(self.buffer)} {self.buffer}")
+                start = buffer.start
+                end = start + self.expected_length
+                buffer.consume(self.expected_length)
+                if self.frame_channel == self.INVALID_INDEX:
+                    self.handle_packet(buffer.data, start, end)
+                elif self.frame_flags & FrameFlag.SHM_DATA:
+                    self.handle_shm_data(self.frame_channel, buffer.view[start:end])
+                else:
+                    self.handle_stream_data(self.frame_channel, buffer.view[start:end])
 
 
     def handle_frame(self, data):
-        length, channel, offset_hi, offset_lo, flags = struct.unpack(self.FRAME_STRUCT, data)
+        length, channel, offset_hi, offset_lo, flags = FRAME_HEADER_STRUCT.unpack(data)
+        self.frame_record = self.flight_recorder.inbound(length, channel)
+        if self.metrics is not None:
+            self.metrics.frames_in += 1
+        if flags & FrameFlag.SHM_RELEASE:
+            # A release, or with SHM_DATA as well a revoke, of the block
+            # numbered channel, with no payload. Blocks from the server are
+            # never held on to, so revokes need nothing doing.
+            if not flags & FrameFlag.SHM_DATA and self.mempool is not None:
+                self.mempool.release(channel)
+            return
         self.expecting_frame = False
         self.expected_length = length
+        self.frame_channel = channel
+        self.frame_flags = flags
+
+
+    def handle_get_card_info_reply(self, packet):
+        self.logger.debug("handle_get_card_info_reply")
+        return self.info_decoders['card_info'](packet)
+
+
+    def handle_get_card_info_list_reply(self, packet, fields=None, lazy_proplist=False):
+        self.logger.debug("handle_get_card_info_list_reply")
+        return self.decode_info_list(packet, 'card_info', fields, lazy_proplist)
+
+
+    def handle_get_client_info_reply(self, packet):
+        self.logger.debug("handle_get_client_info_reply")
+        return self.info_decoders['client_info'](packet)
 
 
-    def handle_get_sink_info_list_reply(self, packet):
-        self.logger.debug(f"handle_get_sink_info_list_reply")
+    def handle_get_client_info_list_reply(self, packet, fields=None, lazy_proplist=False):
+        self.logger.debug("handle_get_client_info_list_reply")
+        return self.decode_info_list(packet, 'client_info', fields, lazy_proplist)
+
+
+    def handle_get_module_info_reply(self, packet):
+        self.logger.debug("handle_get_module_info_reply")
+        return self.info_decoders['module_info'](packet)
+
+
+    def handle_get_module_info_list_reply(self, packet, fields=None, lazy_proplist=False):
+        self.logger.debug("handle_get_module_info_list_reply")
+        return self.decode_info_list(packet, 'module_info', fields, lazy_proplist)
+
+
+    def handle_get_sink_info_reply(self, packet):
+        self.logger.debug("handle_get_sink_info_reply")
+        return self.info_decoders['sink_info'](packet)
+
+
+    def handle_get_sink_info_list_reply(self, packet, fields=None, lazy_proplist=False):
+        self.logger.debug("handle_get_sink_info_list_reply")
         self.current_packet_handler = None
-        sink_infos = []
-        while len(packet.data) > 0:
-            sink_info = SinkInfo()
-            sink_info.index = packet.get_u32()
-            sink_info.name = packet.get_string()
-            sink_info.description = packet.get_string()
-            sink_info.sample_spec = packet.get_sample_spec()
-            sink_info.channel_map = packet.get_channel_map()
-            sink_info.owner_module = packet.get_u32()
-            sink_info.volume = packet.get_cvolume()
-            sink_info.mute = packet.get_boolean()
-            sink_info.monitor_source = packet.get_u32()
-            sink_info.monitor_source_name = packet.get_string()
-            sink_info.latency = packet.get_usec()
-            sink_info.driver = packet.get_string()
-            sink_info.flags = packet.get_u32()
-            if self.version >= 13:
-                sink_info.proplist = packet.get_proplist()
-                sink_info.configured_latency = packet.get_usec()
-            if self.version >= 15:
-                sink_info.base_volume = packet.get_volume()
-                sink_info.state = packet.get_u32()
-                sink_info.n_volume_steps = packet.get_u32()
-                sink_info.card = packet.get_u32()
-                sink_info.n_ports = packet.get_u32()
-            if self.version >= 16:
-                sink_info.ports = []
-                if sink_info.n_ports > 0:
-                    for i in range(0, sink_info.n_ports):
-                        sink_port_info = SinkPortInfo()
-                        sink_port_info.name = packet.get_string()
-                        sink_port_info.description = packet.get_string()
-                        sink_port_info.priority = packet.get_u32()
-                        sink_port_info.available = packet.get_u32()
-                        sink_info.ports.append(sink_port_info)
-                    sink_info.ap = packet.get_string()
-                    for sink_port_info in sink_info.ports:
-                        if sink_port_info.name == sink_info.ap:
-                            sink_info.active_port = sink_port_info
-            if self.version >= 21:
-                n_formats = packet.get_u8()
-                sink_info.formats = []
-                for i in range(0, n_formats):
-                    format_info = packet.get_format_info()
-                    sink_info.formats.append(format_info)
-            sink_infos.append(sink_info)
-        self.logger.debug(f"SinkInfos: {sink_infos}")
+        sink_infos = self.decode_info_list(packet, 'sink_info', fields, lazy_proplist)
+        self.logger.debug("SinkInfos: %s", sink_infos)
         return sink_infos
 
 
-    def handle_packet(self, data):
+    def handle_get_sink_input_info_reply(self, packet):
+        self.logger.debug("handle_get_sink_input_info_reply")
+        return self.info_decoders['sink_input_info'](packet)
+
+
+    def handle_get_sink_input_info_list_reply(self, packet, fields=None, lazy_proplist=False):
+        self.logger.debug("handle_get_sink_input_info_list_reply")
+        return self.decode_info_list(packet, 'sink_input_info', fields, lazy_proplist)
+
+
+    def handle_get_source_info_reply(self, packet):
+        self.logger.debug("handle_get_source_info_reply")
+        return self.info_decoders['source_info'](packet)
+
+
+    def handle_get_source_info_list_reply(self, packet, fields=None, lazy_proplist=False):
+        self.logger.debug("handle_get_source_info_list_reply")
+        return self.decode_info_list(packet, 'source_info', fields, lazy_proplist)
+
+
+    def handle_get_source_output_info_reply(self, packet):
+        self.logger.debug("handle_get_source_output_info_reply")
+        return self.info_decoders['source_output_info'](packet)
+
+
+    def handle_get_source_output_info_list_reply(self, packet, fields=None, lazy_proplist=False):
+        self.logger.debug("handle_get_source_output_info_list_reply")
+        return self.decode_info_list(packet, 'source_output_info', fields, lazy_proplist)
+
+
+    def handle_info_list_iter_reply(self, name, packet, fields=None, lazy_proplist=False):
+        # The packet points into the receive buffer, which is reused once this
+        # returns, so the records are copied out as bytes and left undecoded.
+        # Each is decoded when the returned iterator reaches it.
+        decode = self.get_info_decoder(name, fields, lazy_proplist)
+        return self.decode_info_iter(decode, Packet(bytes(packet.data[packet.offset:packet.end])))
+
+
+    def handle_packet(self, data, start=0, end=None):
         self.expecting_frame = True
-        self.expected_length = struct.calcsize(self.FRAME_STRUCT)
-        packet = Packet(data)
+        self.expected_length = FRAME_HEADER_STRUCT.size
+        packet = Packet(data, start, end)
         packet.parse_command()
-        self.logger.debug(f"Packet: {packet}")
+        if self.frame_record is not None:
+            self.flight_recorder.annotate(self.frame_record, packet.command, packet.id)
+        self.logger.debug("Packet: %s", packet)
         method_name = f"handle_command_{packet.command.name.lower()}"
-        method = getattr(self, method_name)
+        method = getattr(self, method_name, None)
         if callable(method):
             method(packet)
         else:
-            self.logger.error(f"Unexpected packet: {packet}")
+            self.logger.error("Unexpected packet: %s", packet)
+
+
+    def handle_command_enable_srbchannel(self, packet):
+        # The server offers to move packets and memblock references from
+        # the socket to a ring buffer in shared memory, signalled through two
+        # eventfds. The ring buffer's fill counters are updated with atomic
+        # adds, which can't be done on shared memory from Python, so the
+        # offer is left unanswered and the server keeps using the socket.
+        # The ring buffer's memblock, which comes next, is released unused.
+        for i in range(min(2, len(self.received_fds))):
+            os.close(self.received_fds.popleft())
+        self.srbchannel_pending = True
+
+
+    def handle_command_overflow(self, packet):
+        stream = self.get_playback_stream(packet)
+        if stream is not None:
+            stream.overflow()
+
+
+    def handle_command_playback_buffer_attr_changed(self, packet):
+        stream = self.get_playback_stream(packet)
+        if stream is None:
+            return
+        buffer_attr = stream.buffer_attr
+        buffer_attr.maxlength = packet.get_u32()
+        buffer_attr.tlength = packet.get_u32()
+        buffer_attr.prebuf = packet.get_u32()
+        buffer_attr.minreq = packet.get_u32()
+        stream.configured_latency = packet.get_usec()
+
+
+    def handle_command_playback_stream_killed(self, packet):
+        stream = self.get_playback_stream(packet)
+        if stream is not None:
+            stream.fail(CommandError(f"The server killed playback stream {stream.index}.", ErrorCode.PA_ERR_KILLED))
+
+
+    def handle_command_playback_stream_moved(self, packet):
+        stream = self.get_playback_stream(packet)
+        if stream is None:
+            return
+        stream.sink_index = packet.get_u32()
+        stream.sink_name = packet.get_string()
+        stream.suspended = packet.get_boolean()
+        if self.version >= 13:
+            buffer_attr = stream.buffer_attr
+            buffer_attr.maxlength = packet.get_u32()
+            buffer_attr.tlength = packet.get_u32()
+            buffer_attr.prebuf = packet.get_u32()
+            buffer_attr.minreq = packet.get_u32()
+            stream.configured_latency = packet.get_usec()
+
+
+    def handle_command_playback_stream_suspended(self, packet):
+        stream = self.get_playback_stream(packet)
+        if stream is not None:
+            stream.suspended = packet.get_boolean()
+
+
+    def handle_command_record_buffer_attr_changed(self, packet):
+        stream = self.get_record_stream(packet)
+        if stream is None:
+            return
+        stream.buffer_attr.maxlength = packet.get_u32()
+        stream.buffer_attr.fragsize = packet.get_u32()
+        stream.configured_latency = packet.get_usec()
+
+
+    def handle_command_record_stream_killed(self, packet):
+        stream = self.get_record_stream(packet)
+        if stream is not None:
+            stream.fail(CommandError(f"The server killed record stream {stream.index}.", ErrorCode.PA_ERR_KILLED))
+
+
+    def handle_command_record_stream_moved(self, packet):
+        stream = self.get_record_stream(packet)
+        if stream is None:
+            return
+        stream.source_index = packet.get_u32()
+        stream.source_name = packet.get_string()
+        stream.suspended = packet.get_boolean()
+        if self.version >= 13:
+            stream.buffer_attr.maxlength = packet.get_u32()
+            stream.buffer_attr.fragsize = packet.get_u32()
+            stream.configured_latency = packet.get_usec()
+
+
+    def handle_command_record_stream_suspended(self, packet):
+        stream = self.get_record_stream(packet)
+        if stream is not None:
+            stream.suspended = packet.get_boolean()
+
+
+    def handle_command_register_memfd_shmid(self, packet):
+        shm_id = packet.get_u32()
+        if not self.received_fds:
+            self.logger.error("REGISTER_MEMFD_SHMID %s came without a file descriptor.", shm_id)
+            return
+        fd = self.received_fds.popleft()
+        import mmap
+        try:
+            segment = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+        except OSError as exception:
+            self.logger.error("Couldn't map memfd segment %s: %s", shm_id, exception)
+            return
+        finally:
+            os.close(fd)
+        previous = self.shm_segments.pop(shm_id, None)
+        if previous is not None:
+            previous.close()
+        self.shm_segments[shm_id] = segment
+
+
+    def handle_command_request(self, packet):
+        stream = self.get_playback_stream(packet)
+        if stream is not None:
+            stream.add_credit(packet.get_u32())
+
+
+    def handle_command_started(self, packet):
+        stream = self.get_playback_stream(packet)
+        if stream is not None:
+            stream.start()
 
 
     def handle_command_subscribe_event(self, packet):
+        info = packet.get_u32()
+        index = packet.get_u32()
+        if self.metrics is not None:
+            self.metrics.events[info & 0x0F] += 1
+        callbacks = self.subscribers.get(info & EVENT_KEY_MASK)
+        if callbacks is None:
+            return
         event = Event()
-        event.info = packet.get_u32()
-        event.facility = SubscriptionEventType(event.info & SubscriptionEventType.FACILITY_MASK)
-        event.type = SubscriptionEventType(event.info & SubscriptionEventType.TYPE_MASK)
-        event.index = packet.get_u32()
-        self.logger.debug(f"handle_subscribe_event {event.info} {event.type} {event.facility} {event.index}")
-        for callback in self.subscribers:
+        event.info = info
+        event.facility = EVENT_FACILITIES[info & 0x0F]
+        event.type = EVENT_TYPES[(info & 0x30) >> 4]
+        event.index = index
+        for callback in callbacks:
             callback(event)
 
 
+    def handle_command_underflow(self, packet):
+        stream = self.get_playback_stream(packet)
+        if stream is None:
+            return
+        # Since version 23 the write index where the underflow happened.
+        stream.underflow(packet.get_s64() if self.version >= 23 else None)
+
+
+    def handle_create_playback_stream_reply(self, sample_spec, channel_map, packet):
+        self.logger.debug("handle_create_playback_stream_reply")
+        channel = packet.get_u32()
+        index = packet.get_u32()
+        requested_bytes = packet.get_u32()
+        buffer_attr = BufferAttr()
+        if self.version >= 9:
+            buffer_attr.maxlength = packet.get_u32()
+            buffer_attr.tlength = packet.get_u32()
+            buffer_attr.prebuf = packet.get_u32()
+            buffer_attr.minreq = packet.get_u32()
+        from pypactl.playback_stream import PlaybackStream
+        stream = PlaybackStream(self, channel, index, sample_spec, channel_map, requested_bytes, buffer_attr)
+        if self.version >= 12:
+            stream.sample_spec = packet.get_sample_spec()
+            stream.channel_map = packet.get_channel_map()
+            stream.sink_index = packet.get_u32()
+            stream.sink_name = packet.get_string()
+            stream.suspended = packet.get_boolean()
+        if self.version >= 13:
+            stream.configured_latency = packet.get_usec()
+        if self.version >= 21:
+            stream.format = packet.get_format_info()
+        # Registered before anything else is read, so the REQUESTs that
+        # follow the reply find it.
+        self.playback_streams[channel] = stream
+        return stream
+
+
+    def handle_create_upload_stream_reply(self, packet):
+        # The channel and how many bytes to send on it.
+        self.logger.debug("handle_create_upload_stream_reply")
+        channel = packet.get_u32()
+        length = packet.get_u32()
+        return channel, length
+
+
+    def handle_create_record_stream_reply(self, sample_spec, channel_map, target, record_file, packet):
+        self.logger.debug("handle_create_record_stream_reply")
+        channel = packet.get_u32()
+        index = packet.get_u32()
+        buffer_attr = BufferAttr()
+        if self.version >= 9:
+            buffer_attr.maxlength = packet.get_u32()
+            buffer_attr.fragsize = packet.get_u32()
+        from pypactl.record_stream import RecordStream
+        stream = RecordStream(self, channel, index, sample_spec, channel_map, buffer_attr, target, record_file)
+        if self.version >= 12:
+            stream.sample_spec = packet.get_sample_spec()
+            stream.channel_map = packet.get_channel_map()
+            stream.source_index = packet.get_u32()
+            stream.source_name = packet.get_string()
+            stream.suspended = packet.get_boolean()
+        if self.version >= 13:
+            stream.configured_latency = packet.get_usec()
+        if self.version >= 22:
+            stream.format = packet.get_format_info()
+        # Registered with its target before the data that follows the reply
+        # is read, so none of it is missed.
+        self.record_streams[channel] = stream
+        return stream
+
+
+    def handle_play_sample_reply(self, packet):
+        # The index of the sink input playing the sample.
+        if self.version >= 13:
+            return packet.get_u32()
+        return None
+
 
     def handle_properties_reply(self, packet):
         self.logger.debug("handle_properties_reply")
-        command_id = packet.get_u32()
+        client_index = packet.get_u32()
         for callback in self.ready_listeners:
             callback()
+        if not self.ready.done():
+            self.ready.set_result(client_index)
 
 
     def handle_server_info_reply(self, packet):
@@ -205,124 +898,641 @@ class NativeProtocol(asyncio.Protocol):
         server_info.package_version = packet.get_string()
         server_info.user_name = packet.get_string()
         server_info.host_name = packet.get_string()
-        server_info.defalt_sample_spec = packet.get_sample_spec()
+        server_info.default_sample_spec = packet.get_sample_spec()
         server_info.default_sink = packet.get_string()
         server_info.default_source = packet.get_string()
         server_info.cookie = packet.get_u32()
         if self.version >= 15:
             server_info.default_channel_map = packet.get_channel_map()
-        self.logger.debug(f"server_info: {server_info}")
+        self.logger.debug("server_info: %s", server_info)
         return server_info
 
 
+    def handle_shm_data(self, channel, data):
+        # A reference to a block of the server's shared memory. The block is
+        # handed to the record stream in place and released straight after.
+        self.expecting_frame = True
+        self.expected_length = FRAME_HEADER_STRUCT.size
+        block_id, shm_id, offset, length = SHM_INFO_STRUCT.unpack(data)
+        if self.srbchannel_pending:
+            self.srbchannel_pending = False
+        else:
+            segment = self.get_shm_segment(shm_id, self.frame_flags & FrameFlag.SHM_DATA_MEMFD_BLOCK)
+            stream = self.record_streams.get(channel)
+            if stream is None:
+                self.logger.debug("Block %s for unknown record stream %s", block_id, channel)
+            elif segment is not None:
+                with memoryview(segment)[offset:offset + length] as block:
+                    stream.receive(block)
+        self.write_frames([FRAME_HEADER_STRUCT.pack(0, block_id, 0, 0, FrameFlag.SHM_RELEASE)])
+
+
+    def handle_stream_data(self, channel, data):
+        # data is a memoryview into the receive buffer.
+        self.expecting_frame = True
+        self.expected_length = FRAME_HEADER_STRUCT.size
+        stream = self.record_streams.get(channel)
+        if stream is None:
+            self.logger.debug("%s bytes for unknown record stream %s", len(data), channel)
+            return
+        stream.receive(data)
+
+
     def handle_subscribe_reply(self, packet):
         self.logger.debug("handle_subscribe_reply")
         self.current_packet_handler = None
 
 
+    def log_unmatched_reply(self, kind, packet):
+        # Replies to requests that timed out or were cancelled are expected.
+        if packet.id < self.command_id:
+            self.logger.debug("Received %s %s for a request that is no longer waiting.", kind, packet)
+        else:
+            self.logger.error(f"Recevied {kind} {packet}, but there's no matching id in the reply_map.")
+
+
     def machine_id(self):
-        paths_to_try = [
-            '/etc/machine-id',
-            '/var/lib/dbus/machine-id',
-        ]
-        for path in paths_to_try:
-            if os.path.exists(path):
-                with open(path, 'rb') as machine_id_file:
-                    machine_id = machine_id_file.read()
-                    return machine_id
-        return socket.gethostname()
+        return get_machine_id()
 
 
     def msg_received(self, data, ancillary_data, msg_flags, address):
-        self.buffer = memoryview(self.buffer.tobytes() + data)
+        if self.metrics is not None:
+            self.metrics.bytes_in += len(data)
+        if ancillary_data:
+            self.received_fds.extend(received_fds(ancillary_data))
+        self.buffer.write(data)
+        self.handle_data()
+
+
+    def msg_received_into(self, nbytes, ancillary_data, msg_flags, address):
+        if self.metrics is not None:
+            self.metrics.bytes_in += nbytes
+        if ancillary_data:
+            self.received_fds.extend(received_fds(ancillary_data))
+        self.buffer.advance(nbytes)
         self.handle_data()
 
 
+    def on_handshake_failed(self, error_code):
+        if not self.ready.done():
+            self.ready.set_exception(CommandError(f"Connecting to PulseAudio failed: {error_code.name}.", error_code))
+
+
+    def on_reply_done(self, id, callback, error_callback, future):
+        if self.events_blocked:
+            self.update_reading()
+        if future.cancelled():
+            self.reply_map.pop(id, None)
+            if self.metrics is not None:
+                self.metrics.abandon(id)
+            return
+        exception = future.exception()
+        if exception is None:
+            if callback is not None:
+                callback(future.result())
+            return
+        self.logger.debug("Request %s failed: %s", id, exception)
+        if error_callback is not None:
+            if isinstance(exception, CommandError):
+                error_callback(exception.error_code)
+            else:
+                error_callback(ErrorCode.PA_ERR_PROTOCOL)
+
+
+    def pause_writing(self):
+        self.write_paused = True
+
+
+    def register_mempool(self):
+        # Gives the server a memfd pool to take playback audio from. The fd
+        # has to go out with the packet, so if anything is queued ahead of it
+        # audio just stays on the socket.
+        if self.cork_depth > 0 or self.transport.get_write_buffer_size() > 0:
+            self.logger.debug("Not registering a memfd pool with writes queued.")
+            return
+        from pypactl.mempool import MemPool
+        try:
+            mempool = MemPool()
+        except OSError as exception:
+            self.logger.debug("Couldn't create a memfd pool: %s", exception)
+            return
+        # Like the server's, this has no tag and gets no reply.
+        packet = Packet()
+        packet.add_command(Command.REGISTER_MEMFD_SHMID)
+        packet.add_id(self.INVALID_INDEX)
+        packet.add_u32(mempool.shm_id)
+        self.send_with_ancillary_data([packet], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', [mempool.fd]).tobytes())])
+        self.mempool = mempool
+
+
+    def resume_writing(self):
+        self.write_paused = False
+        waiters = self.write_waiters
+        self.write_waiters = []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
     def send_auth(self):
         self.logger.debug("send_auth")
-        cookie_data = None
-        with open('/home/peterh/.config/pulse/cookie', 'rb') as cookie_file:
-            cookie_data = cookie_file.read()
-        packet = self.create_command_packet(Command.AUTH)
-        packet.add_u32(Protocol.VERSION)
-        packet.add_arbitrary(cookie_data)
-        cmsg_data = struct.pack('III', os.getpid(), os.getuid(), os.getgid())
-        iov_data = struct.pack(self.FRAME_STRUCT, len(packet.data), 0xffffffff, 0, 0, 0)
-        self.transport.sendmsg([iov_data], [(socket.SOL_SOCKET, socket.SCM_CREDENTIALS, cmsg_data)])
-        self.transport.write(packet.data)
-        self.setup_reply(packet.id, self.handle_auth_reply)
+        packet = self.create_auth_packet()
+        self.send_with_credentials([packet])
+        return self.setup_reply(packet.id, self.handle_auth_reply, error_callback=self.on_handshake_failed)
+
+
+    def send_cork_playback_stream(self, channel, cork=True, callback=None, timeout=None):
+        self.logger.debug("send_cork_playback_stream(%s, %s)", channel, cork)
+        packet = self.create_command_packet(Command.CORK_PLAYBACK_STREAM)
+        packet.add_u32(channel)
+        packet.add_boolean(cork)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, None, callback, timeout=timeout)
+
+
+    def send_create_playback_stream(self, sample_spec, channel_map=None, volume=None, sink_index=None, sink_name=None, buffer_attr=None, corked=False, muted=None, proplist=None, callback=None, timeout=None):
+        # The reply is a PlaybackStream. With no channel_map the default for
+        # the number of channels is used, and with no volume or muted the
+        # server picks them.
+        self.logger.debug("send_create_playback_stream(%s, %s)", sample_spec, sink_name)
+        if channel_map is None:
+            channel_map = default_channel_map(sample_spec.channels)
+        if sink_index is None:
+            sink_index = self.INVALID_INDEX
+        if buffer_attr is None:
+            buffer_attr = BufferAttr()
+        if proplist is None:
+            proplist = {'media.name': 'pypactl'}
+        packet = self.create_playback_stream_packet(sample_spec, channel_map, volume, sink_index, sink_name, buffer_attr, corked, muted, proplist)
+        self.send_packet(packet)
+        method = functools.partial(self.handle_create_playback_stream_reply, sample_spec, channel_map)
+        return self.setup_reply(packet.id, method, callback, timeout=timeout)
+
+
+    def send_cork_record_stream(self, channel, cork=True, callback=None, error_callback=None, timeout=None):
+        self.logger.debug("send_cork_record_stream(%s, %s)", channel, cork)
+        packet = self.create_command_packet(Command.CORK_RECORD_STREAM)
+        packet.add_u32(channel)
+        packet.add_boolean(cork)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, None, callback, error_callback, timeout=timeout)
+
+
+    def send_create_record_stream(self, sample_spec, channel_map=None, source_index=None, source_name=None, buffer_attr=None, corked=False, peak_detect=False, proplist=None, target=None, record_file=None, callback=None, timeout=None):
+        # The reply is a RecordStream writing into target, a writable buffer.
+        # record_file is closed along with the stream.
+        self.logger.debug("send_create_record_stream(%s, %s)", sample_spec, source_name)
+        if channel_map is None:
+            channel_map = default_channel_map(sample_spec.channels)
+        if source_index is None:
+            source_index = self.INVALID_INDEX
+        if buffer_attr is None:
+            buffer_attr = BufferAttr()
+        if proplist is None:
+            proplist = {'media.name': 'pypactl'}
+        packet = self.create_record_stream_packet(sample_spec, channel_map, source_index, source_name, buffer_attr, corked, peak_detect, proplist)
+        self.send_packet(packet)
+        method = functools.partial(self.handle_create_record_stream_reply, sample_spec, channel_map, target, record_file)
+        return self.setup_reply(packet.id, method, callback, timeout=timeout)
+
+
+    def send_delete_playback_stream(self, channel, callback=None, timeout=None):
+        self.logger.debug("send_delete_playback_stream(%s)", channel)
+        packet = self.create_command_packet(Command.DELETE_PLAYBACK_STREAM)
+        packet.add_u32(channel)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, None, callback, timeout=timeout)
+
+
+    def send_create_upload_stream(self, name, sample_spec, length, channel_map=None, proplist=None, callback=None, timeout=None):
+        # The reply is the upload stream's channel and the number of bytes
+        # to send on it before FINISH_UPLOAD_STREAM.
+        self.logger.debug("send_create_upload_stream(%s, %s, %s)", name, sample_spec, length)
+        if channel_map is None:
+            channel_map = default_channel_map(sample_spec.channels)
+        proplist = dict(proplist or {})
+        proplist.setdefault('media.name', name)
+        proplist.setdefault('event.id', name)
+        packet = self.create_upload_stream_packet(name, sample_spec, channel_map, length, proplist)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, self.handle_create_upload_stream_reply, callback, timeout=timeout)
+
+
+    def send_delete_record_stream(self, channel, callback=None, timeout=None):
+        self.logger.debug("send_delete_record_stream(%s)", channel)
+        packet = self.create_command_packet(Command.DELETE_RECORD_STREAM)
+        packet.add_u32(channel)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, None, callback, timeout=timeout)
+
 
+    def send_delete_upload_stream(self, channel, callback=None, timeout=None):
+        self.logger.debug("send_delete_upload_stream(%s)", channel)
+        packet = self.create_command_packet(Command.DELETE_UPLOAD_STREAM)
+        packet.add_u32(channel)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, None, callback, timeout=timeout)
+
+
+    def send_drain_playback_stream(self, channel, callback=None, timeout=None):
+        # The server replies once it has played everything it was sent.
+        self.logger.debug("send_drain_playback_stream(%s)", channel)
+        packet = self.create_command_packet(Command.DRAIN_PLAYBACK_STREAM)
+        packet.add_u32(channel)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, None, callback, timeout=timeout)
 
-    def send_get_server_info(self, callback=None):
+
+    def send_finish_upload_stream(self, channel, callback=None, timeout=None):
+        # Turns what was sent on the upload stream into a sample cache
+        # entry.
+        self.logger.debug("send_finish_upload_stream(%s)", channel)
+        packet = self.create_command_packet(Command.FINISH_UPLOAD_STREAM)
+        packet.add_u32(channel)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, None, callback, timeout=timeout)
+
+
+    def send_flush_playback_stream(self, channel, callback=None, timeout=None):
+        self.logger.debug("send_flush_playback_stream(%s)", channel)
+        packet = self.create_command_packet(Command.FLUSH_PLAYBACK_STREAM)
+        packet.add_u32(channel)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, None, callback, timeout=timeout)
+
+
+    def send_flush_record_stream(self, channel, callback=None, timeout=None):
+        self.logger.debug("send_flush_record_stream(%s)", channel)
+        packet = self.create_command_packet(Command.FLUSH_RECORD_STREAM)
+        packet.add_u32(channel)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, None, callback, timeout=timeout)
+
+
+    def send_get_server_info(self, callback=None, error_callback=None, timeout=None):
         self.logger.debug("send_server_info")
         packet = self.create_command_packet(Command.GET_SERVER_INFO)
         self.send_packet(packet)
-        self.setup_reply(packet.id, self.handle_server_info_reply, callback)
+        return self.setup_reply(packet.id, self.handle_server_info_reply, callback, error_callback, timeout=timeout)
+
+
+    def send_get_card_info(self, index=None, name=None, callback=None, error_callback=None, timeout=None):
+        self.logger.debug("send_get_card_info(%s, %s)", index, name)
+        packet = self.create_command_packet(Command.GET_CARD_INFO)
+        packet.add_u32(self.INVALID_INDEX if index is None else index)
+        packet.add_string(name)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, self.handle_get_card_info_reply, callback, error_callback, timeout=timeout)
 
 
-    def send_get_sink_info_list(self, callback = None):
-        self.logger.debug(f"send_get_sink_info_list {callback}")
-        packet = self.create_command_packet(Command.GET_SINK_INFO_LIST)
+    def send_get_card_info_list(self, callback=None, fields=None, lazy_proplist=False, timeout=None):
+        self.logger.debug("send_get_card_info_list")
+        return self.send_get_info_list(Command.GET_CARD_INFO_LIST, 'card_info', self.handle_get_card_info_list_reply, callback, fields, lazy_proplist, timeout)
+
+
+    def send_get_client_info(self, index, callback=None, error_callback=None, timeout=None):
+        self.logger.debug("send_get_client_info(%s)", index)
+        packet = self.create_command_packet(Command.GET_CLIENT_INFO)
+        packet.add_u32(index)
         self.send_packet(packet)
-        self.setup_reply(packet.id, self.handle_get_sink_info_list_reply, callback)
+        return self.setup_reply(packet.id, self.handle_get_client_info_reply, callback, error_callback, timeout=timeout)
+
+
+    def send_get_client_info_list(self, callback=None, fields=None, lazy_proplist=False, timeout=None):
+        self.logger.debug("send_get_client_info_list")
+        return self.send_get_info_list(Command.GET_CLIENT_INFO_LIST, 'client_info', self.handle_get_client_info_list_reply, callback, fields, lazy_proplist, timeout)
+
+
+    def send_get_info_list(self, command, name, method, callback=None, fields=None, lazy_proplist=False, timeout=None):
+        # Compile the decoder now so a bad projection fails here rather than
+        # in the read path.
+        self.get_info_decoder(name, fields, lazy_proplist)
+        packet = self.create_command_packet(command)
+        self.send_packet(packet)
+        if fields is not None or lazy_proplist:
+            method = functools.partial(method, fields=fields, lazy_proplist=lazy_proplist)
+        return self.setup_reply(packet.id, method, callback, timeout=timeout)
+
+
+    def send_get_module_info(self, index, callback=None, error_callback=None, timeout=None):
+        self.logger.debug("send_get_module_info(%s)", index)
+        packet = self.create_command_packet(Command.GET_MODULE_INFO)
+        packet.add_u32(index)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, self.handle_get_module_info_reply, callback, error_callback, timeout=timeout)
+
+
+    def send_get_module_info_list(self, callback=None, fields=None, lazy_proplist=False, timeout=None):
+        self.logger.debug("send_get_module_info_list")
+        return self.send_get_info_list(Command.GET_MODULE_INFO_LIST, 'module_info', self.handle_get_module_info_list_reply, callback, fields, lazy_proplist, timeout)
+
+
+    def send_get_sink_info(self, index=None, name=None, callback=None, error_callback=None, timeout=None):
+        self.logger.debug("send_get_sink_info(%s, %s)", index, name)
+        packet = self.create_command_packet(Command.GET_SINK_INFO)
+        packet.add_u32(self.INVALID_INDEX if index is None else index)
+        packet.add_string(name)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, self.handle_get_sink_info_reply, callback, error_callback, timeout=timeout)
+
+
+    def send_get_sink_info_list(self, callback = None, fields=None, lazy_proplist=False, timeout=None):
+        self.logger.debug("send_get_sink_info_list %s", callback)
+        return self.send_get_info_list(Command.GET_SINK_INFO_LIST, 'sink_info', self.handle_get_sink_info_list_reply, callback, fields, lazy_proplist, timeout)
+
+
+    def send_get_sink_input_info(self, index, callback=None, error_callback=None, timeout=None):
+        self.logger.debug("send_get_sink_input_info(%s)", index)
+        packet = self.create_command_packet(Command.GET_SINK_INPUT_INFO)
+        packet.add_u32(index)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, self.handle_get_sink_input_info_reply, callback, error_callback, timeout=timeout)
+
+
+    def send_get_sink_input_info_list(self, callback=None, fields=None, lazy_proplist=False, timeout=None):
+        self.logger.debug("send_get_sink_input_info_list")
+        return self.send_get_info_list(Command.GET_SINK_INPUT_INFO_LIST, 'sink_input_info', self.handle_get_sink_input_info_list_reply, callback, fields, lazy_proplist, timeout)
+
+
+    def send_get_source_info(self, index=None, name=None, callback=None, error_callback=None, timeout=None):
+        self.logger.debug("send_get_source_info(%s, %s)", index, name)
+        packet = self.create_command_packet(Command.GET_SOURCE_INFO)
+        packet.add_u32(self.INVALID_INDEX if index is None else index)
+        packet.add_string(name)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, self.handle_get_source_info_reply, callback, error_callback, timeout=timeout)
+
+
+    def send_get_source_info_list(self, callback=None, fields=None, lazy_proplist=False, timeout=None):
+        self.logger.debug("send_get_source_info_list")
+        return self.send_get_info_list(Command.GET_SOURCE_INFO_LIST, 'source_info', self.handle_get_source_info_list_reply, callback, fields, lazy_proplist, timeout)
+
+
+    def send_get_source_output_info(self, index, callback=None, error_callback=None, timeout=None):
+        self.logger.debug("send_get_source_output_info(%s)", index)
+        packet = self.create_command_packet(Command.GET_SOURCE_OUTPUT_INFO)
+        packet.add_u32(index)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, self.handle_get_source_output_info_reply, callback, error_callback, timeout=timeout)
+
+
+    def send_get_source_output_info_list(self, callback=None, fields=None, lazy_proplist=False, timeout=None):
+        self.logger.debug("send_get_source_output_info_list")
+        return self.send_get_info_list(Command.GET_SOURCE_OUTPUT_INFO_LIST, 'source_output_info', self.handle_get_source_output_info_list_reply, callback, fields, lazy_proplist, timeout)
+
+
+    def send_handshake(self, subscription_mask=None):
+        # The server handles commands in order, so SET_CLIENT_NAME and
+        # SUBSCRIBE can follow AUTH without waiting for its reply.
+        self.logger.debug("send_handshake")
+        auth_packet = self.create_auth_packet()
+        properties_packet = self.create_properties_packet()
+        packets = [auth_packet, properties_packet]
+        if subscription_mask is not None:
+            subscribe_packet = self.create_subscribe_packet(subscription_mask)
+            packets.append(subscribe_packet)
+        self.send_with_credentials(packets)
+        self.setup_reply(auth_packet.id, self.handle_auth_reply, error_callback=self.on_handshake_failed)
+        self.setup_reply(properties_packet.id, self.handle_properties_reply, error_callback=self.on_handshake_failed)
+        if subscription_mask is not None:
+            self.setup_reply(subscribe_packet.id, self.handle_subscribe_reply)
+
+
+    def send_iter_info_list(self, facility, callback=None, fields=None, lazy_proplist=False, timeout=None):
+        # Like send_get_info_list, but the reply is an iterator that decodes
+        # records as it's advanced rather than a list of all of them.
+        self.logger.debug("send_iter_info_list(%s)", facility)
+        command, name = self.INFO_LISTS[facility]
+        self.get_info_decoder(name, fields, lazy_proplist)
+        packet = self.create_command_packet(command)
+        self.send_packet(packet)
+        method = functools.partial(self.handle_info_list_iter_reply, name, fields=fields, lazy_proplist=lazy_proplist)
+        return self.setup_reply(packet.id, method, callback, timeout=timeout)
 
 
     def send_packet(self, packet):
-        self.logger.debug(f"send_packet: {packet}")
-        frame = struct.pack(self.FRAME_STRUCT, len(packet.data), 0xffffffff, 0, 0, 0)
-        self.transport.write(frame)
-        self.transport.write(packet.data)
+        self.logger.debug("send_packet: %s", packet)
+        self.flight_recorder.outbound(packet.end - FRAME_HEADER_STRUCT.size, self.INVALID_INDEX, packet.command, packet.id)
+        if self.metrics is not None:
+            self.metrics.request_sent(packet.command, packet.id, packet.end)
+        if self.cork_depth > 0:
+            self.corked_frames.append(packet.frame())
+            return
+        self.transport.write(packet.frame())
+
+
+    def send_play_sample(self, name, sink_name=None, volume=None, callback=None, timeout=None):
+        # Encoded frames are kept by name, sink and volume, so playing a
+        # sound again only copies its frame and patches in a new tag. volume
+        # is a raw volume, VOLUME_NORM for 100%, or None for the sample's
+        # own.
+        self.logger.debug("send_play_sample(%s, %s, %s)", name, sink_name, volume)
+        key = (name, sink_name, volume)
+        template = self.play_sample_frames.get(key)
+        if template is None:
+            packet = self.create_play_sample_packet(name, sink_name, volume)
+            self.play_sample_frames[key] = bytes(packet.frame())
+        else:
+            packet = Packet(bytearray(template), FRAME_HEADER_STRUCT.size)
+            packet.command = Command.PLAY_SAMPLE
+            packet.id = self.command_id
+            self.command_id += 1
+            TAGGED_U32_STRUCT.pack_into(packet.data, PACKET_ID_OFFSET, TAG_U32, packet.id)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, self.handle_play_sample_reply, callback, timeout=timeout)
 
 
     def send_properties(self):
         self.logger.debug("send_properties")
-        packet = self.create_command_packet(Command.SET_CLIENT_NAME)
-        packet.add_tag(Tag.PROPLIST)
-        packet.add_property('application.process.id', str(os.getpid()))
-        packet.add_property('application.process.user', getpass.getuser())
-        packet.add_property('application.process.host', socket.gethostname())
-        packet.add_property('application.process.binary', 'pypactl')
-        packet.add_property('application.name', 'pypactl')
-        lang = locale.setlocale(locale.LC_MESSAGES)
-        if lang is not None:
-            packet.add_property('application.language', lang)
-        display = os.environ.get('DISPLAY', None)
-        if display is not None:
-            packet.add_property('window.x11.display', display)
-        packet.add_property('application.process.machine_id', self.machine_id())
-        session_id = os.environ.get('XDG_SESSION_ID', None)
-        if session_id is not None:
-            packet.add_property('application.process.session_id', '232')
-        packet.add_tag(Tag.STRING_NULL)
+        packet = self.create_properties_packet()
         self.send_packet(packet)
-        self.setup_reply(packet.id, self.handle_properties_reply)
+        return self.setup_reply(packet.id, self.handle_properties_reply, error_callback=self.on_handshake_failed)
 
 
-    def send_set_default_sink(self, sink_name, callback=None):
-        self.logger.debug(f"send_set_default_sink({sink_name}")
+    def send_remove_sample(self, name, callback=None, timeout=None):
+        self.logger.debug("send_remove_sample(%s)", name)
+        packet = self.create_command_packet(Command.REMOVE_SAMPLE)
+        packet.add_string(name)
+        self.send_packet(packet)
+        return self.setup_reply(packet.id, None, callback, timeout=timeout)
+
+
+    def send_set_default_sink(self, sink_name, callback=None, timeout=None):
+        self.logger.debug("send_set_default_sink(%s)", sink_name)
         packet = self.create_command_packet(Command.SET_DEFAULT_SINK)
         packet.add_string(sink_name)
         self.send_packet(packet)
-        self.setup_reply(packet.id, None, callback)
+        return self.setup_reply(packet.id, None, callback, timeout=timeout)
 
 
-    def send_subscribe(self, callback=None):
-        self.logger.debug("send_subscribe")
-        packet = self.create_command_packet(Command.SUBSCRIBE)
-        packet.add_u32(SubscriptionMask.ALL)
+    def send_stream_data(self, channel, data, offset=0, seek_mode=SeekMode.RELATIVE, max_frame_size=65536):
+        # Sends data on a stream's channel as frames of at most
+        # max_frame_size bytes. The frames are memoryview slices of data or,
+        # with a memfd pool that has room, references to copies of them in
+        # the pool. offset and seek_mode only apply to the first.
+        frames = []
+        flight_recorder = self.flight_recorder
+        mempool = self.mempool
+        sent = 0
+        for start in range(0, len(data), max_frame_size):
+            chunk = data[start:start + max_frame_size]
+            offset_hi = (offset >> 32) & 0xffffffff
+            offset_lo = offset & 0xffffffff
+            block = None
+            if mempool is not None and len(chunk) <= mempool.slot_size:
+                block = mempool.put(chunk)
+            if block is None:
+                frames.append(FRAME_HEADER_STRUCT.pack(len(chunk), channel, offset_hi, offset_lo, seek_mode))
+                frames.append(chunk)
+                sent += FRAME_HEADER_STRUCT.size + len(chunk)
+            else:
+                block_id, block_offset = block
+                frames.append(FRAME_HEADER_STRUCT.pack(SHM_INFO_STRUCT.size, channel, offset_hi, offset_lo, seek_mode | SHM_DATA_FLAGS) + SHM_INFO_STRUCT.pack(block_id, mempool.shm_id, block_offset, len(chunk)))
+                sent += FRAME_HEADER_STRUCT.size + SHM_INFO_STRUCT.size
+            flight_recorder.outbound(len(chunk), channel)
+            offset = 0
+            seek_mode = SeekMode.RELATIVE
+        if self.metrics is not None:
+            self.metrics.frames_out += (len(data) + max_frame_size - 1) // max_frame_size
+            self.metrics.bytes_out += sent
+        self.write_frames(frames)
+
+
+    def send_subscribe(self, callback=None, timeout=None, mask=SubscriptionMask.ALL):
+        self.logger.debug("send_subscribe(%#x)", mask)
+        packet = self.create_subscribe_packet(mask)
         self.send_packet(packet)
-        self.setup_reply(packet.id, self.handle_subscribe_reply, callback)
+        return self.setup_reply(packet.id, self.handle_subscribe_reply, callback, timeout=timeout)
+
+
+    def send_with_ancillary_data(self, packets, ancillary_data):
+        frames = [packet.frame() for packet in packets]
+        for packet in packets:
+            self.flight_recorder.outbound(packet.end - FRAME_HEADER_STRUCT.size, self.INVALID_INDEX, packet.command, packet.id)
+        if self.metrics is not None:
+            for packet in packets:
+                # Tagless packets like REGISTER_MEMFD_SHMID get no reply, so
+                # they aren't requests.
+                if packet.id != self.INVALID_INDEX:
+                    self.metrics.request_sent(packet.command, packet.id, packet.end)
+        sent = self.transport.sendmsg(frames, ancillary_data)
+        data = b''.join(frames)
+        if sent < len(data):
+            self.transport.write(data[sent:])
+
+
+    def send_with_credentials(self, packets):
+        cmsg_data = struct.pack('III', os.getpid(), os.getuid(), os.getgid())
+        self.send_with_ancillary_data(packets, [(socket.SOL_SOCKET, socket.SCM_CREDENTIALS, cmsg_data)])
+
 
+    def setup_reply(self, id, method, callback=None, error_callback=None, timeout=None):
+        future = self.loop.create_future()
+        self.reply_map[id] = (method, future)
+        if self.reading_paused:
+            self.update_reading()
+        future.add_done_callback(functools.partial(self.on_reply_done, id, callback, error_callback))
+        if timeout is None:
+            timeout = self.default_timeout
+        if timeout is not None:
+            self.add_deadline(id, timeout)
+        return future
 
-    def setup_reply(self, id, method, callback=None):
-        self.reply_map[id] = (method, callback)
 
+    def subscribe(self, callback, facilities=None, types=None):
+        # The server is asked for the union of what the subscribers want, and
+        # each event only goes to the callbacks subscribed to its facility
+        # and type.
+        if facilities is None:
+            facilities = DEFAULT_SUBSCRIPTION_FACILITIES
+        if types is None:
+            types = SUBSCRIPTION_TYPES
+        keys = self.subscriptions.get(callback, frozenset()) | {facility | type for facility in facilities for type in types}
+        self.unsubscribe(callback, update_mask=False)
+        self.subscriptions[callback] = keys
+        for key in keys:
+            self.subscribers[key] = self.subscribers.get(key, ()) + (callback,)
+        self.update_subscription_mask()
 
-    def subscribe(self, callback=None):
-        if len(self.subscribers) == 0:
-            self.send_subscribe()
-        self.subscribers.append(callback)
 
+    def uncork(self):
+        self.cork_depth -= 1
+        if self.cork_depth > 0 or not self.corked_frames:
+            return
+        frames = self.corked_frames
+        self.corked_frames = []
+        self.transport.write(b''.join(frames))
+
+
+    def unsubscribe(self, callback, update_mask=True):
+        keys = self.subscriptions.pop(callback, ())
+        for key in keys:
+            callbacks = tuple(subscriber for subscriber in self.subscribers[key] if subscriber != callback)
+            if callbacks:
+                self.subscribers[key] = callbacks
+            else:
+                del self.subscribers[key]
+        if update_mask:
+            self.update_subscription_mask()
+
+
+    def update_reading(self):
+        # Reading only stops for full event streams while nothing is waiting
+        # for a reply, so a consumer that makes a request per event still
+        # gets its replies, along with a few more events.
+        if self.transport is None or self.transport.is_closing():
+            return
+        paused = self.events_blocked and not self.reply_map
+        if paused == self.reading_paused:
+            return
+        self.reading_paused = paused
+        if paused:
+            self.transport.pause_reading()
+        else:
+            self.transport.resume_reading()
 
-    def unsubscribe(self, callback):
-        self.subscribers.remove(callback)
+
+    def update_subscription_mask(self):
+        mask = self.initial_subscription_mask or SubscriptionMask.NULL
+        for key in self.subscribers:
+            mask |= 1 << (key & 0x0F)
+        if mask != (self.subscription_mask or SubscriptionMask.NULL):
+            self.send_subscribe(mask=mask)
+
+
+    async def wait_writable(self):
+        # Returns once the transport's write buffer has drained below its low
+        # water mark, for writers of bulk data that shouldn't pile it all up
+        # in memory.
+        while self.write_paused:
+            waiter = self.loop.create_future()
+            self.write_waiters.append(waiter)
+            await waiter
+
+
+    def write_frames(self, frames):
+        # Writes a list of buffers. When nothing is queued in the transport
+        # they go out in one gathering sendmsg, so audio isn't copied into a
+        # joined buffer first; only what the socket doesn't take is copied
+        # and left to the transport. Corked, they're joined now, since the
+        # caller is free to reuse its buffers once this returns.
+        if self.cork_depth > 0:
+            self.corked_frames.append(b''.join(frames))
+            return
+        transport = self.transport
+        if transport.get_write_buffer_size() > 0:
+            transport.write(b''.join(frames))
+            return
+        try:
+            sent = transport.sendmsg(frames)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            # Let the transport report it.
+            transport.write(b''.join(frames))
+            return
+        for i, frame in enumerate(frames):
+            if sent < len(frame):
+                transport.write(b''.join([memoryview(frame)[sent:]] + frames[i + 1:]))
+                return
+            sent -= len(frame)
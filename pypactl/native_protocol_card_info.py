@@ -0,0 +1,26 @@
+from pypactl import native_protocol_card_port_info
+from pypactl import native_protocol_card_profile_info
+from pypactl.card_info import CardInfo
+
+info_class = CardInfo
+
+structure = [
+    ('index', 'u32'),
+    ('name', 'string'),
+    ('owner_module', 'u32'),
+    ('driver', 'string'),
+    ('n_profiles', 'u32'),
+    ('profiles', ('list', 'n_profiles', native_protocol_card_profile_info)),
+    ('active_profile_name', 'string'),
+    ('proplist', 'proplist'),
+    ('n_ports', 'u32', 26),
+    ('ports', ('list', 'n_ports', native_protocol_card_port_info), 26),
+]
+
+
+def finish(info):
+    if info.profiles is None:
+        return
+    for profile in info.profiles:
+        if profile.name == info.active_profile_name:
+            info.active_profile = profile
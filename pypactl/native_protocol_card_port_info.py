@@ -0,0 +1,15 @@
+from pypactl.card_port_info import CardPortInfo
+
+info_class = CardPortInfo
+
+structure = [
+    ('name', 'string'),
+    ('description', 'string'),
+    ('priority', 'u32'),
+    ('available', 'u32'),
+    ('direction', 'u8'),
+    ('proplist', 'proplist'),
+    ('n_profiles', 'u32'),
+    ('profiles', ('list', 'n_profiles', 'string')),
+    ('latency_offset', 's64', 27),
+]
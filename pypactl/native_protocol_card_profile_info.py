@@ -0,0 +1,12 @@
+from pypactl.card_profile_info import CardProfileInfo
+
+info_class = CardProfileInfo
+
+structure = [
+    ('name', 'string'),
+    ('description', 'string'),
+    ('n_sinks', 'u32'),
+    ('n_sources', 'u32'),
+    ('priority', 'u32'),
+    ('available', 'u32', 29),
+]
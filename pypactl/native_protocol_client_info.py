@@ -0,0 +1,11 @@
+from pypactl.client_info import ClientInfo
+
+info_class = ClientInfo
+
+structure = [
+    ('index', 'u32'),
+    ('name', 'string'),
+    ('owner_module', 'u32'),
+    ('driver', 'string'),
+    ('proplist', 'proplist', 13),
+]
@@ -0,0 +1,12 @@
+from pypactl.module_info import ModuleInfo
+
+info_class = ModuleInfo
+
+structure = [
+    ('index', 'u32'),
+    ('name', 'string'),
+    ('argument', 'string'),
+    ('n_used', 'u32'),
+    ('auto_unload', 'boolean', 0, 14),
+    ('proplist', 'proplist', 15),
+]
@@ -1,3 +1,8 @@
+from pypactl import native_protocol_sink_port_info
+from pypactl.sink_info import SinkInfo
+
+info_class = SinkInfo
+
 structure = [
     ('index', 'u32'),
     ('name', 'string'),
@@ -12,14 +17,26 @@ structure = [
     ('latency', 'usec'),
     ('driver', 'string'),
     ('flags', 'u32'),
-    ('proplist', 'proplist'),
-    ('configured_latency', 'usec'),
-    ('base_volume', 'volume'),
-    ('state', 'u32'),
-    ('n_volume_steps', 'u32'),
-    ('card', 'u32'),
-    ('n_ports', 'u32'),
-    ('ports', 'ports'),
-    ('ap', 'ap'),
-    ('formats', 'formats'),
+    ('proplist', 'proplist', 13),
+    ('configured_latency', 'usec', 13),
+    ('base_volume', 'volume', 15),
+    ('state', 'u32', 15),
+    ('n_volume_steps', 'u32', 15),
+    ('card', 'u32', 15),
+    ('n_ports', 'u32', 16),
+    ('ports', ('list', 'n_ports', native_protocol_sink_port_info), 16),
+    ('ap', 'string', 16),
+    ('n_formats', 'u8', 21),
+    ('formats', ('list', 'n_formats', 'format_info'), 21),
 ]
+
+# The active port's name is resolved by finish() into the port itself, which
+# is what's shown instead.
+resolved_fields = {'ap': 'active_port'}
+
+
+def finish(info):
+    if info.ports:
+        for port in info.ports:
+            if port.name == info.ap:
+                info.active_port = port
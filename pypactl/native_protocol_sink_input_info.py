@@ -0,0 +1,24 @@
+from pypactl.sink_input_info import SinkInputInfo
+
+info_class = SinkInputInfo
+
+structure = [
+    ('index', 'u32'),
+    ('name', 'string'),
+    ('owner_module', 'u32'),
+    ('client', 'u32'),
+    ('sink', 'u32'),
+    ('sample_spec', 'sample_spec'),
+    ('channel_map', 'channel_map'),
+    ('volume', 'cvolume'),
+    ('buffer_usec', 'usec'),
+    ('sink_usec', 'usec'),
+    ('resample_method', 'string'),
+    ('driver', 'string'),
+    ('mute', 'boolean', 11),
+    ('proplist', 'proplist', 13),
+    ('corked', 'boolean', 19),
+    ('has_volume', 'boolean', 20),
+    ('volume_writable', 'boolean', 20),
+    ('format', 'format_info', 21),
+]
@@ -0,0 +1,10 @@
+from pypactl.sink_port_info import SinkPortInfo
+
+info_class = SinkPortInfo
+
+structure = [
+    ('name', 'string'),
+    ('description', 'string'),
+    ('priority', 'u32'),
+    ('available', 'u32', 24),
+]
@@ -0,0 +1,42 @@
+from pypactl import native_protocol_source_port_info
+from pypactl.source_info import SourceInfo
+
+info_class = SourceInfo
+
+structure = [
+    ('index', 'u32'),
+    ('name', 'string'),
+    ('description', 'string'),
+    ('sample_spec', 'sample_spec'),
+    ('channel_map', 'channel_map'),
+    ('owner_module', 'u32'),
+    ('volume', 'cvolume'),
+    ('mute', 'boolean'),
+    ('monitor_of_sink', 'u32'),
+    ('monitor_of_sink_name', 'string'),
+    ('latency', 'usec'),
+    ('driver', 'string'),
+    ('flags', 'u32'),
+    ('proplist', 'proplist', 13),
+    ('configured_latency', 'usec', 13),
+    ('base_volume', 'volume', 15),
+    ('state', 'u32', 15),
+    ('n_volume_steps', 'u32', 15),
+    ('card', 'u32', 15),
+    ('n_ports', 'u32', 16),
+    ('ports', ('list', 'n_ports', native_protocol_source_port_info), 16),
+    ('ap', 'string', 16),
+    ('n_formats', 'u8', 22),
+    ('formats', ('list', 'n_formats', 'format_info'), 22),
+]
+
+# The active port's name is resolved by finish() into the port itself, which
+# is what's shown instead.
+resolved_fields = {'ap': 'active_port'}
+
+
+def finish(info):
+    if info.ports:
+        for port in info.ports:
+            if port.name == info.ap:
+                info.active_port = port
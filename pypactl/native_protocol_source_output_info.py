@@ -0,0 +1,24 @@
+from pypactl.source_output_info import SourceOutputInfo
+
+info_class = SourceOutputInfo
+
+structure = [
+    ('index', 'u32'),
+    ('name', 'string'),
+    ('owner_module', 'u32'),
+    ('client', 'u32'),
+    ('source', 'u32'),
+    ('sample_spec', 'sample_spec'),
+    ('channel_map', 'channel_map'),
+    ('buffer_usec', 'usec'),
+    ('source_usec', 'usec'),
+    ('resample_method', 'string'),
+    ('driver', 'string'),
+    ('proplist', 'proplist', 13),
+    ('corked', 'boolean', 19),
+    ('volume', 'cvolume', 22),
+    ('mute', 'boolean', 22),
+    ('has_volume', 'boolean', 22),
+    ('volume_writable', 'boolean', 22),
+    ('format', 'format_info', 22),
+]
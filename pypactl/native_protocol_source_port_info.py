@@ -0,0 +1,10 @@
+from pypactl.source_port_info import SourcePortInfo
+
+info_class = SourcePortInfo
+
+structure = [
+    ('name', 'string'),
+    ('description', 'string'),
+    ('priority', 'u32'),
+    ('available', 'u32', 24),
+]
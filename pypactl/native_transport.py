@@ -1,11 +1,31 @@
+import array
 import asyncio.selector_events
 import logging
 import socket
 
+# Room for the most file descriptors PulseAudio passes with one packet and
+# the peer's credentials.
+MAX_FDS = 2
+ANCILLARY_BUFFER_SIZE = socket.CMSG_SPACE(MAX_FDS * array.array('i').itemsize) + socket.CMSG_SPACE(12)
+
+
+def received_fds(ancillary_data):
+    # The file descriptors passed with SCM_RIGHTS in ancillary data from
+    # recvmsg.
+    fds = []
+    for level, type, data in ancillary_data:
+        if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+            items = array.array('i')
+            items.frombytes(data[:len(data) - len(data) % items.itemsize])
+            fds.extend(items)
+    return fds
+
+
 class NativeTransport(asyncio.selector_events._SelectorSocketTransport):
-    def __init__(self, loop, sock, protocol, waiter=None, extra=None, server=None, path=None, logger=logging.getLogger('pypactl')):
+    def __init__(self, loop, sock, protocol, waiter=None, extra=None, server=None, path=None, logger=logging.getLogger('pypactl'), capture=None):
         self.path = path
         self.logger = logger
+        self.capture = capture
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_PASSCRED, 1)
         super().__init__(loop, sock, protocol, waiter, extra, server)
 
@@ -14,7 +34,8 @@ class NativeTransport(asyncio.selector_events._SelectorSocketTransport):
         if self._conn_lost:
             return
         try:
-            data, ancillary_data, msg_flags, address = self._sock.recvmsg(self.max_size)
+            buffer = self._protocol.get_buffer(self.max_size)
+            nbytes, ancillary_data, msg_flags, address = self._sock.recvmsg_into([buffer], ANCILLARY_BUFFER_SIZE)
         except (BlockingIOError, InterruptedError):
             return
         except (SystemExit, KeyboardInterrupt):
@@ -23,17 +44,40 @@ class NativeTransport(asyncio.selector_events._SelectorSocketTransport):
             self._fatal_error(exc, 'Fatal read error on socket transport')
             return
 
-        if not data:
+        if not nbytes:
             self._read_ready__on_eof()
             return
 
+        if self.capture is not None:
+            self.capture.inbound(buffer[:nbytes], ancillary_data)
+
         try:
-            self._protocol.msg_received(data, ancillary_data, msg_flags, address)
+            self._protocol.msg_received_into(nbytes, ancillary_data, msg_flags, address)
         except (SystemExit, KeyboardInterrupt):
             raise
         except BaseException as exc:
             self._fatal_error(exc, 'Fatal error: protocol.data_received() call failed.')
 
 
-    def sendmsg(self, data, ancdata=None, flags=0, address=None):
-        return self._sock.sendmsg(data, ancdata, flags, address)
+    def _call_connection_lost(self, exc):
+        try:
+            super()._call_connection_lost(exc)
+        finally:
+            if self.capture is not None:
+                self.capture.close()
+
+
+    def sendmsg(self, data, ancdata=(), flags=0, address=None):
+        if address is None:
+            sent = self._sock.sendmsg(data, ancdata, flags)
+        else:
+            sent = self._sock.sendmsg(data, ancdata, flags, address)
+        if self.capture is not None:
+            self.capture.outbound(b''.join(data)[:sent], ancdata)
+        return sent
+
+
+    def write(self, data):
+        if self.capture is not None and data:
+            self.capture.outbound(data)
+        super().write(data)
@@ -0,0 +1,121 @@
+class ObjectStore:
+    # Info objects keyed by index, with hash indexes on attributes and on
+    # proplist keys. An index is built the first time a query uses it and is
+    # kept up to date by put() and remove() from then on.
+    def __init__(self):
+        self.objects = {}
+        self.attribute_indexes = {}
+        self.proplist_indexes = {}
+
+
+    def __contains__(self, index):
+        return index in self.objects
+
+
+    def __iter__(self):
+        return iter(self.objects)
+
+
+    def __len__(self):
+        return len(self.objects)
+
+
+    def __repr__(self):
+        return f"<ObjectStore objects={len(self.objects)} attribute_indexes={list(self.attribute_indexes)} proplist_indexes={list(self.proplist_indexes)}>"
+
+
+    def add_to_indexes(self, info):
+        for attribute, index in self.attribute_indexes.items():
+            index.setdefault(getattr(info, attribute, None), set()).add(info.index)
+        for key, index in self.proplist_indexes.items():
+            value = info.proplist.get(key)
+            if value is not None:
+                index.setdefault(value, set()).add(info.index)
+
+
+    def discard(self, index, value, object_index):
+        matches = index.get(value)
+        if matches is None:
+            return
+        matches.discard(object_index)
+        if not matches:
+            del index[value]
+
+
+    def find(self, proplist=None, **attributes):
+        candidates = None
+        for attribute, value in attributes.items():
+            candidates = self.narrow(candidates, self.get_attribute_index(attribute).get(value))
+            if not candidates:
+                return []
+        if proplist is not None:
+            for key, value in proplist.items():
+                candidates = self.narrow(candidates, self.get_proplist_index(key).get(value))
+                if not candidates:
+                    return []
+        if candidates is None:
+            return self.values()
+        return [self.objects[index] for index in sorted(candidates)]
+
+
+    def get(self, index):
+        return self.objects.get(index)
+
+
+    def get_attribute_index(self, attribute):
+        index = self.attribute_indexes.get(attribute)
+        if index is None:
+            index = {}
+            for info in self.objects.values():
+                index.setdefault(getattr(info, attribute, None), set()).add(info.index)
+            self.attribute_indexes[attribute] = index
+        return index
+
+
+    def get_proplist_index(self, key):
+        index = self.proplist_indexes.get(key)
+        if index is None:
+            index = {}
+            for info in self.objects.values():
+                value = info.proplist.get(key)
+                if value is not None:
+                    index.setdefault(value, set()).add(info.index)
+            self.proplist_indexes[key] = index
+        return index
+
+
+    def narrow(self, candidates, matches):
+        if not matches:
+            return set()
+        if candidates is None:
+            return set(matches)
+        return candidates & matches
+
+
+    def put(self, info):
+        old_info = self.objects.get(info.index)
+        if old_info is not None:
+            self.remove_from_indexes(old_info)
+        self.objects[info.index] = info
+        self.add_to_indexes(info)
+
+
+    def remove(self, index):
+        info = self.objects.pop(index, None)
+        if info is not None:
+            self.remove_from_indexes(info)
+        return info
+
+
+    def remove_from_indexes(self, info):
+        for attribute, index in self.attribute_indexes.items():
+            self.discard(index, getattr(info, attribute, None), info.index)
+        for key, index in self.proplist_indexes.items():
+            value = info.proplist.get(key)
+            if value is not None:
+                self.discard(index, value, info.index)
+
+
+    def values(self):
+        objects = self.objects
+        return [objects[index] for index in sorted(objects)]
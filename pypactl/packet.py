@@ -6,30 +6,98 @@ from pypactl.command import Command
 from pypactl.cvolume import Cvolume
 from pypactl.format_info import FormatInfo
 from pypactl.invalid_packet import InvalidPacket
+from pypactl.lazy_proplist import LazyProplist
 from pypactl.sample_spec import SampleSpec
 from pypactl.tag import Tag
 
 logger = logging.getLogger('pypactl')
 
+FRAME_HEADER_STRUCT = struct.Struct('!IIIII')
+# The payload of a frame referring to shared memory: block id, shm id,
+# offset and length.
+SHM_INFO_STRUCT = struct.Struct('!IIII')
+TAGGED_U32_STRUCT = struct.Struct('!BI')
+U32_STRUCT = struct.Struct('!I')
+U64_STRUCT = struct.Struct('!Q')
+S64_STRUCT = struct.Struct('!q')
+SAMPLE_SPEC_STRUCT = struct.Struct('!BBI')
+
+TAG_ARBITRARY = int(Tag.ARBITRARY)
+TAG_STRING = int(Tag.STRING)
+TAG_STRING_NULL = int(Tag.STRING_NULL)
+TAG_U32 = int(Tag.U32)
+
+# Payload sizes of the fixed size tagged types, used when skipping values.
+FIXED_SIZES = {
+    int(Tag.U32): 4,
+    int(Tag.U8): 1,
+    int(Tag.U64): 8,
+    int(Tag.S64): 8,
+    int(Tag.SAMPLE_SPEC): SAMPLE_SPEC_STRUCT.size,
+    int(Tag.BOOLEAN_TRUE): 0,
+    int(Tag.BOOLEAN_FALSE): 0,
+    int(Tag.TIMEVAL): 8,
+    int(Tag.USEC): 8,
+    int(Tag.VOLUME): 4,
+    int(Tag.STRING_NULL): 0,
+}
+
+structs = {}
+
+def get_struct(format):
+    try:
+        return structs[format]
+    except KeyError:
+        structs[format] = struct.Struct(format)
+        return structs[format]
+
+
 class Packet:
-    def __init__(self, data = b''):
+    # A packet reads from data[offset:end] with an integer cursor, so data can
+    # be a whole receive buffer and nothing is copied or re-sliced per field.
+    # data must support find() (bytes or bytearray); memoryviews are copied.
+    #
+    # Without data the packet is built for sending: fields are packed into a
+    # bytearray after room for the frame header, which frame() fills in.
+    INITIAL_SIZE = 256
+
+    def __init__(self, data = None, offset = 0, end = None):
+        if data is None:
+            data = bytearray(self.INITIAL_SIZE)
+            offset = end = FRAME_HEADER_STRUCT.size
+        elif isinstance(data, memoryview):
+            data = data.tobytes()
         self.data = data
+        self.start = offset
+        self.offset = offset
+        self.end = len(data) if end is None else end
         self.command = None
         self.id = None
 
 
     def __repr__(self):
 #        data = r'\x' + r'\x'.join(f'{b:02x}' for b in self.data)
-        data = self.data
-        if isinstance(data, memoryview):
-            data = self.data.tobytes()
+        data = bytes(self.data[self.start:self.end])
         return f"<PulseAudioPacket data={data} command={self.command} id={self.id}>"
 
 
     def add_arbitrary(self, data):
-        self.add_tag(Tag.ARBITRARY)
-        self.data += struct.pack('!I', len(data))
-        self.data += data
+        length = len(data)
+        offset = self.reserve(5 + length)
+        TAGGED_U32_STRUCT.pack_into(self.data, offset, TAG_ARBITRARY, length)
+        self.data[offset + 5:offset + 5 + length] = data
+
+
+    def add_boolean(self, value):
+        self.add_tag(Tag.BOOLEAN_TRUE if value else Tag.BOOLEAN_FALSE)
+
+
+    def add_channel_map(self, channel_map):
+        channels = channel_map.channels
+        offset = self.reserve(2 + len(channels))
+        self.data[offset] = Tag.CHANNEL_MAP
+        self.data[offset + 1] = len(channels)
+        self.data[offset + 2:offset + 2 + len(channels)] = bytes(channels)
 
 
     def add_command(self, command):
@@ -37,6 +105,20 @@ class Packet:
         self.add_u32(command)
 
 
+    def add_cvolume(self, cvolume):
+        channels = cvolume.channels
+        offset = self.reserve(2 + 4 * len(channels))
+        self.data[offset] = Tag.CVOLUME
+        self.data[offset + 1] = len(channels)
+        get_struct(f'!{len(channels)}I').pack_into(self.data, offset + 2, *channels)
+
+
+    def add_format_info(self, format_info):
+        self.add_tag(Tag.FORMAT_INFO)
+        self.add_u8(format_info.encoding)
+        self.add_proplist(format_info.proplist)
+
+
     def add_id(self, id):
         self.id = id
         self.add_u32(id)
@@ -48,55 +130,128 @@ class Packet:
             data = value.encode('UTF-8')
         except AttributeError:
             data = value
-        self.add_u32(len(data) + 1)
-        self.add_arbitrary(data + b'\00')
+        length = len(data) + 1
+        offset = self.reserve(10 + length)
+        TAGGED_U32_STRUCT.pack_into(self.data, offset, TAG_U32, length)
+        TAGGED_U32_STRUCT.pack_into(self.data, offset + 5, TAG_ARBITRARY, length)
+        self.data[offset + 10:offset + 9 + length] = data
+        self.data[offset + 9 + length] = 0
+
+
+    def add_proplist(self, proplist):
+        self.add_tag(Tag.PROPLIST)
+        for key, value in proplist.items():
+            self.add_property(key, value)
+        self.add_tag(Tag.STRING_NULL)
+
+
+    def add_s64(self, value):
+        offset = self.reserve(9)
+        self.data[offset] = Tag.S64
+        S64_STRUCT.pack_into(self.data, offset + 1, value)
+
+
+    def add_sample_spec(self, sample_spec):
+        offset = self.reserve(1 + SAMPLE_SPEC_STRUCT.size)
+        self.data[offset] = Tag.SAMPLE_SPEC
+        SAMPLE_SPEC_STRUCT.pack_into(self.data, offset + 1, sample_spec.format, sample_spec.channels, sample_spec.rate)
 
 
     def add_u32(self, value):
-        self.add_tag(Tag.U32)
-        self.data += struct.pack('!I', value)
+        offset = self.reserve(5)
+        TAGGED_U32_STRUCT.pack_into(self.data, offset, TAG_U32, value)
+
+
+    def add_u8(self, value):
+        offset = self.reserve(2)
+        self.data[offset] = Tag.U8
+        self.data[offset + 1] = value
+
+
+    def add_usec(self, value):
+        offset = self.reserve(9)
+        self.data[offset] = Tag.USEC
+        U64_STRUCT.pack_into(self.data, offset + 1, value)
+
+
+    def add_volume(self, value):
+        offset = self.reserve(5)
+        self.data[offset] = Tag.VOLUME
+        U32_STRUCT.pack_into(self.data, offset + 1, value)
 
 
     def add_string(self, string):
-        self.add_tag(Tag.STRING)
-        self.data += string.encode('UTF-8')
-        self.data += b'\x00'
+        if string is None:
+            self.add_tag(Tag.STRING_NULL)
+            return
+        data = string.encode('UTF-8')
+        length = len(data)
+        offset = self.reserve(length + 2)
+        self.data[offset] = TAG_STRING
+        self.data[offset + 1:offset + 1 + length] = data
+        self.data[offset + 1 + length] = 0
 
 
     def add_tag(self, tag):
-        self.data += struct.pack('!B', tag)
+        offset = self.reserve(1)
+        self.data[offset] = tag
 
 
     def consume(self, length):
-        result = self.data[:length]
-        self.data = self.data[length:]
-        return result
+        offset = self.offset
+        end = offset + length
+        if end > self.end:
+            raise InvalidPacket(f"Expected {length} bytes but only {self.end - offset} left.")
+        self.offset = end
+        return memoryview(self.data)[offset:end]
 
 
     def consume_u8(self):
-        return self.consume(1).tobytes()[0]
+        offset = self.offset
+        if offset >= self.end:
+            raise InvalidPacket("Expected 1 byte but the packet ended.")
+        self.offset = offset + 1
+        return self.data[offset]
 
 
     def consume_u32(self):
-        data = self.consume(4)
-        return struct.unpack('!I', data)[0]
+        offset = self.offset
+        if offset + 4 > self.end:
+            raise InvalidPacket(f"Expected 4 bytes but only {self.end - offset} left.")
+        self.offset = offset + 4
+        return U32_STRUCT.unpack_from(self.data, offset)[0]
 
 
     def consume_u64(self):
-        data = self.consume(8)
-        return struct.unpack('!Q', data)[0]
+        offset = self.offset
+        if offset + 8 > self.end:
+            raise InvalidPacket(f"Expected 8 bytes but only {self.end - offset} left.")
+        self.offset = offset + 8
+        return U64_STRUCT.unpack_from(self.data, offset)[0]
 
 
     def check_tag(self, expected_tag):
-        tag = self.get('!B')[0]
+        offset = self.offset
+        if offset >= self.end:
+            raise InvalidPacket(f"Expected {expected_tag} but the packet ended.")
+        tag = self.data[offset]
         if tag != expected_tag:
             raise InvalidPacket(f"Expected {expected_tag} but got {tag}.")
+        self.offset = offset + 1
+
+
+    def frame(self, channel=0xffffffff, offset_hi=0, offset_lo=0, flags=0):
+        FRAME_HEADER_STRUCT.pack_into(self.data, 0, self.end - self.start, channel, offset_hi, offset_lo, flags)
+        return memoryview(self.data)[:self.end]
 
 
     def get(self, format):
-        data = self.consume(struct.calcsize(format))
-        values = struct.unpack(format, data)
-        return values
+        packet_struct = get_struct(format)
+        offset = self.offset
+        if offset + packet_struct.size > self.end:
+            raise InvalidPacket(f"Expected {packet_struct.size} bytes but only {self.end - offset} left.")
+        self.offset = offset + packet_struct.size
+        return packet_struct.unpack_from(self.data, offset)
 
 
     def get_boolean(self):
@@ -119,8 +274,11 @@ class Packet:
         self.check_tag(Tag.CHANNEL_MAP)
         channel_map = ChannelMap()
         num_channels = self.consume_u8()
-        for i in range(0, num_channels):
-            channel_map.channels.append(self.consume_u8())
+        offset = self.offset
+        if offset + num_channels > self.end:
+            raise InvalidPacket(f"Expected {num_channels} channels but only {self.end - offset} bytes left.")
+        self.offset = offset + num_channels
+        channel_map.channels = list(self.data[offset:offset + num_channels])
         return channel_map
 
 
@@ -128,8 +286,7 @@ class Packet:
         self.check_tag(Tag.CVOLUME)
         cvolume = Cvolume()
         num_channels = self.consume_u8()
-        for i in range(0, num_channels):
-            cvolume.channels.append(self.consume_u32())
+        cvolume.channels = list(self.get(f'!{num_channels}I'))
         return cvolume
 
 
@@ -141,37 +298,78 @@ class Packet:
         return format_info
 
 
+    def get_lazy_proplist(self):
+        self.check_tag(Tag.PROPLIST)
+        start = self.offset
+        self.skip_proplist()
+        return LazyProplist(bytes(self.data[start:self.offset]))
+
+
     def get_proplist(self):
         self.check_tag(Tag.PROPLIST)
+        data = self.data
+        end = self.end
         proplist = {}
-        while self.data[0] != Tag.STRING_NULL:
-            key = self.get_string()
-            length = self.get_u32()
-            data = self.get_arbitrary().tobytes().decode('UTF-8')
-            proplist[key] = data
-        self.consume(1)
-        return proplist
+        while True:
+            offset = self.offset
+            if offset >= end:
+                raise InvalidPacket("Expected the end of the proplist but the packet ended.")
+            tag = data[offset]
+            if tag == TAG_STRING_NULL:
+                self.offset = offset + 1
+                return proplist
+            if tag != TAG_STRING:
+                raise InvalidPacket(f"Expected {Tag.STRING} but got {tag}.")
+            eos_index = data.find(0, offset + 1, end)
+            if eos_index < 0:
+                raise InvalidPacket("Unterminated string.")
+            key = data[offset + 1:eos_index].decode('UTF-8')
+            offset = eos_index + 1
+            # The u32 length is repeated in the arbitrary header, so skip it.
+            if offset + 10 > end or data[offset] != TAG_U32 or data[offset + 5] != TAG_ARBITRARY:
+                raise InvalidPacket(f"Invalid value for property {key}.")
+            length = U32_STRUCT.unpack_from(data, offset + 6)[0]
+            offset += 10
+            if offset + length > end:
+                raise InvalidPacket(f"Expected {length} bytes but only {end - offset} left.")
+            self.offset = offset + length
+            if length > 0 and data[offset + length - 1] == 0:
+                length -= 1
+            proplist[key] = data[offset:offset + length].decode('UTF-8')
 
 
     def get_sample_spec(self):
         self.check_tag(Tag.SAMPLE_SPEC)
+        offset = self.offset
+        if offset + SAMPLE_SPEC_STRUCT.size > self.end:
+            raise InvalidPacket(f"Expected a sample spec but only {self.end - offset} bytes left.")
+        self.offset = offset + SAMPLE_SPEC_STRUCT.size
         sample_spec = SampleSpec()
-        sample_spec.format = self.consume_u8()
-        sample_spec.channels = self.consume_u8()
-        sample_spec.rate = self.consume_u32()
+        sample_spec.format, sample_spec.channels, sample_spec.rate = SAMPLE_SPEC_STRUCT.unpack_from(self.data, offset)
         return sample_spec
 
 
+    def get_s64(self):
+        self.check_tag(Tag.S64)
+        offset = self.offset
+        if offset + 8 > self.end:
+            raise InvalidPacket(f"Expected 8 bytes but only {self.end - offset} left.")
+        self.offset = offset + 8
+        return S64_STRUCT.unpack_from(self.data, offset)[0]
+
+
     def get_string(self):
+        offset = self.offset
+        if offset < self.end and self.data[offset] == TAG_STRING_NULL:
+            self.offset = offset + 1
+            return None
         self.check_tag(Tag.STRING)
-        eos_index = None
-        for i in range(0, len(self.data)):
-            if self.data[i] == 0:
-                eos_index = i
-                break
-        value = self.consume(eos_index + 1)
-        value = value[:-1]
-        return value.tobytes().decode('UTF-8')
+        offset = self.offset
+        eos_index = self.data.find(0, offset, self.end)
+        if eos_index < 0:
+            raise InvalidPacket("Unterminated string.")
+        self.offset = eos_index + 1
+        return self.data[offset:eos_index].decode('UTF-8')
 
 
     def get_u32(self):
@@ -197,3 +395,87 @@ class Packet:
     def parse_command(self):
         self.command = Command(self.get_u32())
         self.id = self.get_u32()
+
+
+    def peek_u8(self, offset):
+        if offset >= self.end:
+            raise InvalidPacket("Expected 1 byte but the packet ended.")
+        return self.data[offset]
+
+
+    def peek_u32(self, offset):
+        if offset + 4 > self.end:
+            raise InvalidPacket(f"Expected 4 bytes but only {self.end - offset} left.")
+        return U32_STRUCT.unpack_from(self.data, offset)[0]
+
+
+    def remaining(self):
+        return self.end - self.offset
+
+
+    def reserve(self, length):
+        offset = self.end
+        end = offset + length
+        if end > len(self.data):
+            self.data += bytes(max(len(self.data), end - len(self.data)))
+        self.end = end
+        return offset
+
+
+    def skip_proplist(self):
+        data = self.data
+        end = self.end
+        offset = self.offset
+        while True:
+            if offset >= end:
+                raise InvalidPacket("Expected the end of the proplist but the packet ended.")
+            tag = data[offset]
+            if tag == TAG_STRING_NULL:
+                self.offset = offset + 1
+                return
+            if tag != TAG_STRING:
+                raise InvalidPacket(f"Expected {Tag.STRING} but got {tag}.")
+            eos_index = data.find(0, offset + 1, end)
+            if eos_index < 0:
+                raise InvalidPacket("Unterminated string.")
+            offset = eos_index + 1
+            if offset + 10 > end or data[offset] != TAG_U32 or data[offset + 5] != TAG_ARBITRARY:
+                raise InvalidPacket("Invalid property value.")
+            offset += 10 + U32_STRUCT.unpack_from(data, offset + 6)[0]
+
+
+    def skip_value(self):
+        data = self.data
+        offset = self.offset
+        if offset >= self.end:
+            raise InvalidPacket("Expected a value but the packet ended.")
+        tag = data[offset]
+        offset += 1
+        size = FIXED_SIZES.get(tag)
+        if size is not None:
+            offset += size
+        elif tag == TAG_STRING:
+            offset = data.find(0, offset, self.end) + 1
+            if offset == 0:
+                raise InvalidPacket("Unterminated string.")
+        elif tag == TAG_ARBITRARY:
+            offset += 4 + self.peek_u32(offset)
+        elif tag == Tag.CHANNEL_MAP:
+            offset += 1 + self.peek_u8(offset)
+        elif tag == Tag.CVOLUME:
+            offset += 1 + 4 * self.peek_u8(offset)
+        elif tag == Tag.PROPLIST:
+            self.offset = offset
+            self.skip_proplist()
+            return
+        elif tag == Tag.FORMAT_INFO:
+            self.offset = offset
+            self.skip_value()
+            self.check_tag(Tag.PROPLIST)
+            self.skip_proplist()
+            return
+        else:
+            raise InvalidPacket(f"Can't skip a value with tag {tag}.")
+        if offset > self.end:
+            raise InvalidPacket(f"Value with tag {tag} runs past the end of the packet.")
+        self.offset = offset
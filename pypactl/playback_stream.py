@@ -0,0 +1,148 @@
+from pypactl.command_error import CommandError
+from pypactl.error_code import ErrorCode
+from pypactl.sample_format import SAMPLE_SIZES
+from pypactl.seek_mode import SeekMode
+
+# The most audio sent in one frame, the same as libpulse.
+MAX_FRAME_SIZE = 64 * 1024
+
+
+class PlaybackStream:
+    # An audio stream to a sink. The server hands out credit, in bytes, with
+    # the create reply and REQUEST packets as it makes room in its buffer.
+    # write() sends as much as the credit allows straight away, as memoryview
+    # slices of the caller's data in as few socket writes as possible, and
+    # only waits when the credit has run out. When the server agreed to memfd
+    # shared memory the data is copied into the protocol's MemPool instead
+    # and only references to it go through the socket.
+    #
+    #     stream = await controller.create_playback_stream(sample_spec)
+    #     await stream.write(pcm)
+    #     await stream.drain()
+    #     await stream.close()
+    def __init__(self, protocol, channel, index, sample_spec, channel_map, requested_bytes, buffer_attr):
+        self.protocol = protocol
+        self.channel = channel
+        self.index = index
+        self.sample_spec = sample_spec
+        self.channel_map = channel_map
+        self.requested_bytes = requested_bytes
+        self.buffer_attr = buffer_attr
+        self.sink_index = None
+        self.sink_name = None
+        self.suspended = False
+        self.configured_latency = None
+        self.format = None
+        self.started = False
+        self.closed = False
+        self.error = None
+        self.waiter = None
+        self.bytes_written = 0
+        self.underflows = 0
+        self.overflows = 0
+        self.underflow_offset = None
+        self.on_underflow = None
+        self.on_overflow = None
+        self.on_started = None
+
+
+    def __repr__(self):
+        return f"<PlaybackStream channel={self.channel} index={self.index} sink_index={self.sink_index} sink_name={self.sink_name} sample_spec={self.sample_spec} requested_bytes={self.requested_bytes} bytes_written={self.bytes_written} underflows={self.underflows} overflows={self.overflows} started={self.started} closed={self.closed}>"
+
+
+    def add_credit(self, length):
+        self.requested_bytes += length
+        self.wake()
+
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        registered = self.protocol.playback_streams.pop(self.channel, None) is not None
+        self.fail(CommandError("The playback stream is closed.", ErrorCode.PA_ERR_BADSTATE))
+        if registered:
+            await self.protocol.send_delete_playback_stream(self.channel)
+
+
+    async def cork(self, paused=True):
+        await self.protocol.send_cork_playback_stream(self.channel, paused)
+
+
+    async def drain(self):
+        # Returns once the server has played everything written so far.
+        await self.protocol.send_drain_playback_stream(self.channel)
+
+
+    def fail(self, error):
+        # The stream was killed, closed or lost with the connection; writers
+        # get the error rather than waiting for credit that won't come.
+        if self.error is None:
+            self.error = error
+        self.protocol.playback_streams.pop(self.channel, None)
+        self.wake()
+
+
+    async def flush(self):
+        # Drops whatever the server hasn't played yet.
+        await self.protocol.send_flush_playback_stream(self.channel)
+
+
+    def get_frame_size(self):
+        return SAMPLE_SIZES[self.sample_spec.format] * self.sample_spec.channels
+
+
+    def overflow(self):
+        self.overflows += 1
+        if self.on_overflow is not None:
+            self.on_overflow(self)
+
+
+    def start(self):
+        self.started = True
+        if self.on_started is not None:
+            self.on_started(self)
+
+
+    def underflow(self, offset=None):
+        self.underflows += 1
+        self.underflow_offset = offset
+        if self.on_underflow is not None:
+            self.on_underflow(self)
+
+
+    def wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+
+    async def write(self, data, offset=0, seek_mode=SeekMode.RELATIVE):
+        # data is anything with the buffer protocol holding whole frames of
+        # the stream's sample spec. offset and seek_mode position the start
+        # of data in the server's buffer; the rest follows on from it.
+        view = memoryview(data).cast('B')
+        frame_size = self.get_frame_size()
+        if len(view) % frame_size:
+            raise ValueError(f"Expected whole frames of {frame_size} bytes but got {len(view)} bytes.")
+        max_frame_size = MAX_FRAME_SIZE - MAX_FRAME_SIZE % frame_size
+        position = 0
+        while position < len(view):
+            if self.error is not None:
+                raise self.error
+            if self.requested_bytes <= 0:
+                self.waiter = self.protocol.loop.create_future()
+                try:
+                    await self.waiter
+                finally:
+                    self.waiter = None
+                continue
+            # Credit is rounded up to whole frames; the server's buffer has
+            # room beyond tlength for the difference.
+            credit = self.requested_bytes + (-self.requested_bytes % frame_size)
+            end = min(len(view), position + credit)
+            self.protocol.send_stream_data(self.channel, view[position:end], offset, seek_mode, max_frame_size)
+            self.requested_bytes -= end - position
+            self.bytes_written += end - position
+            position = end
+            offset = 0
+            seek_mode = SeekMode.RELATIVE
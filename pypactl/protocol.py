@@ -2,7 +2,7 @@ import enum
 
 class Protocol(enum.IntEnum):
     FLAG_MASK = 0xFFFF0000
-    VERSION_MASK = 0xFFFF00000
+    VERSION_MASK = 0x0000FFFF
     FLAG_SHM = 0x80000000
     FLAG_MEMFD = 0x40000000
     VERSION = 33
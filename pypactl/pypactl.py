@@ -1,11 +1,9 @@
-import argparse
 import asyncio
 import logging
-import aioconsole.stream
+import sys
 
-from aioconsole import AsynchronousCli
 from argparse import ArgumentParser
-from pypactl.console import Console
+from pypactl import json_format
 from pypactl.controller import Controller
 from pypactl.protocol import Protocol
 
@@ -16,74 +14,139 @@ class Pypactl:
         self.logger.setLevel(logging.ERROR)
 
 
+    def add_format_argument(self, parser):
+        parser.add_argument('--format', choices=json_format.FORMATS, default='text', help="Output format. ndjson writes one JSON object per line.")
+
+
     def create_console(self):
-        parser = ArgumentParser()
+        # aioconsole is only needed for the interactive console, so it isn't
+        # imported until one is started.
+        from pypactl.console import Console
         list_parser = ArgumentParser(description="List information about current PulseAudio state.")
-        list_parser.add_argument('type_name', help="sinks")
+        list_parser.add_argument('type_name', choices=['sinks'], help="What to list, only sinks for now.")
+        self.add_format_argument(list_parser)
+        info_parser = ArgumentParser(description="Server info.")
+        self.add_format_argument(info_parser)
         set_default_sink_parser = ArgumentParser(description="Set default sink.")
         set_default_sink_parser.add_argument('sink_name', help="Name of the sink to set as default.")
+        subscribe_parser = ArgumentParser(description="Subcribe to events.")
+        self.add_format_argument(subscribe_parser)
         commands = {
            "list": (self.list, list_parser),
-           "info": (self.info, ArgumentParser(description="Server info.")),
+           "info": (self.info, info_parser),
            "set-default-sink": (self.set_default_sink, set_default_sink_parser),
-           "subscribe": (self.subscribe, ArgumentParser(description="Subcribe to events.")),
+           "subscribe": (self.subscribe, subscribe_parser),
         }
         return Console(commands)
 
 
-    async def info(self, reader, writer):
+    def create_parser(self):
+        parser = ArgumentParser(prog='pypactl', description="Send commands to and get information from PulseAudio. Without a command, starts an interactive console.")
+        subparsers = parser.add_subparsers(dest='command', metavar='command')
+        list_parser = subparsers.add_parser('list', help="List information about current PulseAudio state.")
+        list_parser.add_argument('type_name', choices=['sinks'], help="What to list, only sinks for now.")
+        self.add_format_argument(list_parser)
+        self.add_format_argument(subparsers.add_parser('info', help="Server info."))
+        set_default_sink_parser = subparsers.add_parser('set-default-sink', help="Set default sink.")
+        set_default_sink_parser.add_argument('sink_name', help="Name of the sink to set as default.")
+        self.add_format_argument(subparsers.add_parser('subscribe', help="Print events until interrupted."))
+        return parser
+
+
+    async def info(self, reader, writer, format='text'):
         self.logger.debug("info")
         server_info = await self.controller.server_info()
-        writer.write(f"Server String: {self.controller.transport.path}\n")
-        writer.write(f"Library Protocol Version: {Protocol.VERSION}\n")
-        writer.write(f"Server Protocol Version: {self.controller.protocol.version}\n")
-        writer.write(f"Is Local: yes\n")
-        writer.write(f"Client Index:\n")
-        writer.write(f"Tile Size:\n")
-        writer.write(f"User Name: {server_info.user_name}\n")
-        writer.write(f"Host Name: {server_info.host_name}\n")
-        writer.write(f"Server Name: {server_info.package_name}\n")
-        writer.write(f"Server Version: {server_info.package_version}\n")
-        writer.write(f"Default Sample Specification: {server_info.default_sample_spec}\n")
-        writer.write(f"Default Channel Map: {server_info.default_channel_map}\n")
-        writer.write(f"Default Sink: {server_info.default_sink}\n")
-        writer.write(f"Default Source: {server_info.default_source}\n")
-        writer.write(f"Cookie: {server_info.cookie}\n")
-
-
-    async def list(self, reader, writer, type_name=None):
+        if format != 'text':
+            record = {
+                'server_string': self.controller.transport.path,
+                'library_protocol_version': Protocol.VERSION,
+                'server_protocol_version': self.controller.protocol.version,
+                'is_local': True,
+            }
+            record.update(vars(server_info))
+            writer.write(json_format.dumps(record) + '\n')
+            return
+        writer.write(
+            f"Server String: {self.controller.transport.path}\n"
+            f"Library Protocol Version: {Protocol.VERSION}\n"
+            f"Server Protocol Version: {self.controller.protocol.version}\n"
+            f"Is Local: yes\n"
+            f"Client Index:\n"
+            f"Tile Size:\n"
+            f"User Name: {server_info.user_name}\n"
+            f"Host Name: {server_info.host_name}\n"
+            f"Server Name: {server_info.package_name}\n"
+            f"Server Version: {server_info.package_version}\n"
+            f"Default Sample Specification: {server_info.default_sample_spec}\n"
+            f"Default Channel Map: {server_info.default_channel_map}\n"
+            f"Default Sink: {server_info.default_sink}\n"
+            f"Default Source: {server_info.default_source}\n"
+            f"Cookie: {server_info.cookie}\n"
+        )
+
+
+    async def list(self, reader, writer, type_name=None, format='text'):
         self.logger.debug("list")
+        if format == 'ndjson':
+            # Each sink is written as soon as it's decoded from the reply,
+            # and the output flushed once at the end.
+            async for sink in self.controller.iter_sinks():
+                writer.write(json_format.dumps(sink) + '\n')
+            flush = getattr(writer, 'flush', None)
+            if flush is not None:
+                flush()
+            return
         sinks = await self.controller.sinks()
+        # Output is collected and written in one go rather than a write per
+        # line.
+        if format == 'json':
+            writer.write(json_format.dumps(sinks) + '\n')
+            return
+        lines = []
         for sink in sinks:
-            writer.write(f"Sink #{sink.index}\n")
-            writer.write(f"\tState: {sink.state}\n")
-            writer.write(f"\tName: {sink.name}\n")
-            writer.write(f"\tDescription: {sink.description}\n")
-            writer.write(f"\tDriver: {sink.driver}\n")
-            writer.write(f"\tSample Spec: {sink.sample_spec}\n")
-            writer.write(f"\tChannel Map: {sink.channel_map}\n")
-            writer.write(f"\tOwner Module: {sink.owner_module}\n")
-            writer.write(f"\tMute: {sink.mute}\n")
-            writer.write(f"\tVolume: {sink.volume}\n")
-            writer.write(f"\tMonitor Source: {sink.monitor_source}\n")
-            writer.write(f"\tBase Volume: {sink.base_volume}\n")
-            writer.write(f"\tLatency: {sink.latency}\n")
-            writer.write(f"\tFlags: {sink.flags}\n")
-            writer.write(f"\tProperties:\n")
+            lines.append(
+                f"Sink #{sink.index}\n"
+                f"\tState: {sink.state}\n"
+                f"\tName: {sink.name}\n"
+                f"\tDescription: {sink.description}\n"
+                f"\tDriver: {sink.driver}\n"
+                f"\tSample Spec: {sink.sample_spec}\n"
+                f"\tChannel Map: {sink.channel_map}\n"
+                f"\tOwner Module: {sink.owner_module}\n"
+                f"\tMute: {sink.mute}\n"
+                f"\tVolume: {sink.volume}\n"
+                f"\tMonitor Source: {sink.monitor_source}\n"
+                f"\tBase Volume: {sink.base_volume}\n"
+                f"\tLatency: {sink.latency}\n"
+                f"\tFlags: {sink.flags}\n"
+                f"\tProperties:\n"
+            )
             for key, value in sink.proplist.items():
-                writer.write(f"\t\t{key} = {value}\n")
-            writer.write(f"\tPorts:\n")
+                lines.append(f"\t\t{key} = {value}\n")
+            lines.append(f"\tPorts:\n")
             for port in sink.ports:
-                writer.write(f"\t\t{port}\n")
-            writer.write(f"\tActive Port: {sink.active_port.name}\n")
-            writer.write(f"\tFormats:\n")
-            for format in sink.formats:
-                writer.write(f"\t\t{format}\n")
-
-
-    def on_pulse_audio_event(self, event):
-        self.logger.debug(f"on_pulse_audio_event({event})")
-        self.writer.write(f"{event.facility.name} {event.type.name}\n")
+                lines.append(f"\t\t{port}\n")
+            lines.append(f"\tActive Port: {sink.active_port.name}\n")
+            lines.append(f"\tFormats:\n")
+            for format_info in sink.formats:
+                lines.append(f"\t\t{format_info}\n")
+        writer.write(''.join(lines))
+
+
+    async def print_events(self, writer, format='text'):
+        # Events are written as they arrive but only flushed once the stream
+        # has caught up, so a burst goes out in one write. The stream never
+        # ends, so json is written one object per line, the same as ndjson.
+        flush = getattr(writer, 'flush', None)
+        stream = self.controller.events(policy='coalesce')
+        async for event in stream:
+            self.logger.debug("print_events(%s)", event)
+            if format == 'text':
+                writer.write(f"{event.facility.name} {event.type.name}\n")
+            else:
+                writer.write(json_format.dumps(json_format.event_record(event)) + '\n')
+            if flush is not None and not stream.queue:
+                flush()
 
 
     async def run(self):
@@ -100,19 +163,47 @@ class Pypactl:
             self.controller.close()
 
 
+    async def run_command(self, args):
+        # Connects, runs one command and returns, for scripts and shell hooks.
+        # None of the commands stream audio, so shared memory isn't offered.
+        self.loop = asyncio.get_running_loop()
+        self.controller = Controller(self.loop)
+        await self.controller.start(fast_connect=True, subscribe=args.command == 'subscribe', shm=False)
+        commands = {
+            'list': self.list,
+            'info': self.info,
+            'set-default-sink': self.set_default_sink,
+            'subscribe': lambda reader, writer, format: self.print_events(writer, format),
+        }
+        arguments = vars(args)
+        command = commands[arguments.pop('command')]
+        try:
+            await command(None, sys.stdout, **arguments)
+        finally:
+            self.controller.close()
+
+
     async def set_default_sink(self, reader, writer, sink_name):
         await self.controller.set_default_sink(sink_name)
 
 
-    async def subscribe(self, reader, writer):
-        self.writer = writer
+    async def subscribe(self, reader, writer, format='text'):
         self.logger.debug("subscribe")
-        self.controller.subscribe(self.on_pulse_audio_event)
+        # The console writer is slow, so events are printed from their own
+        # stream rather than from the protocol's read path.
+        self.event_printer = self.loop.create_task(self.print_events(writer, format))
 
 
-def main():
+def main(argv=None):
     pypactl = Pypactl()
-    asyncio.run(pypactl.run())
+    args = pypactl.create_parser().parse_args(argv)
+    if args.command is None:
+        asyncio.run(pypactl.run())
+        return
+    try:
+        asyncio.run(pypactl.run_command(args))
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == "__main__":
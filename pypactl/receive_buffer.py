@@ -0,0 +1,70 @@
+class ReceiveBuffer:
+    # Received bytes live in one preallocated bytearray between start and
+    # end. Consumers get memoryview slices into it, so a slice is only valid
+    # until the next write into the buffer. Unconsumed bytes are moved back
+    # to the front (or into a larger buffer) only when the free space at the
+    # end runs out.
+    DEFAULT_SIZE = 64 * 1024
+    MIN_READ_SIZE = 4096
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.data = bytearray(size)
+        self.view = memoryview(self.data)
+        self.start = 0
+        self.end = 0
+        self.bytes_copied = 0
+        self.compactions = 0
+        self.grows = 0
+
+
+    def __len__(self):
+        return self.end - self.start
+
+
+    def __repr__(self):
+        return f"<ReceiveBuffer size={len(self.data)} start={self.start} end={self.end}>"
+
+
+    def advance(self, length):
+        self.end += length
+
+
+    def consume(self, length):
+        start = self.start
+        end = start + length
+        if end == self.end:
+            self.start = self.end = 0
+        else:
+            self.start = end
+        return self.view[start:end]
+
+
+    def get_write_buffer(self, min_size=MIN_READ_SIZE):
+        if len(self.data) - self.end < min_size:
+            self.make_room(min_size)
+        return self.view[self.end:]
+
+
+    def make_room(self, min_size):
+        used = self.end - self.start
+        if used + min_size > len(self.data):
+            size = len(self.data)
+            while size < used + min_size:
+                size *= 2
+            data = bytearray(size)
+            data[:used] = self.view[self.start:self.end]
+            self.data = data
+            self.view = memoryview(data)
+            self.grows += 1
+        else:
+            self.view[:used] = self.view[self.start:self.end]
+            self.compactions += 1
+        self.bytes_copied += used
+        self.start = 0
+        self.end = used
+
+
+    def write(self, data):
+        length = len(data)
+        self.get_write_buffer(length)[:length] = data
+        self.end += length
@@ -0,0 +1,80 @@
+import mmap
+import struct
+
+from pypactl.sample_format import SAMPLE_SIZES, SampleFormat
+
+# RIFF header, fmt chunk and data chunk header of a canonical WAV file.
+WAV_HEADER_STRUCT = struct.Struct('<4sI4s4sIHHIIHH4sI')
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_ALAW = 6
+WAVE_FORMAT_MULAW = 7
+
+# sample format: (WAV format tag, bits per sample). S24_32 samples are in the
+# low 24 bits of each 32, where WAV expects them in the high bits, so they
+# can only be recorded raw.
+WAV_FORMATS = {
+    SampleFormat.U8: (WAVE_FORMAT_PCM, 8),
+    SampleFormat.ALAW: (WAVE_FORMAT_ALAW, 8),
+    SampleFormat.ULAW: (WAVE_FORMAT_MULAW, 8),
+    SampleFormat.S16LE: (WAVE_FORMAT_PCM, 16),
+    SampleFormat.S24LE: (WAVE_FORMAT_PCM, 24),
+    SampleFormat.S32LE: (WAVE_FORMAT_PCM, 32),
+    SampleFormat.FLOAT32LE: (WAVE_FORMAT_IEEE_FLOAT, 32),
+}
+
+FORMATS = ('wav', 'raw')
+
+
+class RecordFile:
+    # A file preallocated for size bytes of audio and mapped into memory, so
+    # a RecordStream copies received frames straight into the page cache.
+    # close() cuts the file down to what was recorded and, for WAV, fixes
+    # the sizes in the header.
+    def __init__(self, path, sample_spec, size, format='wav'):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown record file format {format}, expected one of {', '.join(FORMATS)}.")
+        if format == 'wav' and sample_spec.format not in WAV_FORMATS:
+            raise ValueError(f"WAV can't hold {SampleFormat(sample_spec.format).name} samples, use raw.")
+        frame_size = SAMPLE_SIZES[sample_spec.format] * sample_spec.channels
+        size -= size % frame_size
+        if size <= 0:
+            raise ValueError(f"A record file needs room for at least one frame of {frame_size} bytes.")
+        self.path = path
+        self.sample_spec = sample_spec
+        self.format = format
+        self.header_size = WAV_HEADER_STRUCT.size if format == 'wav' else 0
+        self.size = size
+        self.file = open(path, 'w+b')
+        self.file.truncate(self.header_size + size)
+        self.mmap = mmap.mmap(self.file.fileno(), self.header_size + size)
+        if format == 'wav':
+            self.write_header(size)
+        self.buffer = memoryview(self.mmap)[self.header_size:]
+
+
+    def __repr__(self):
+        return f"<RecordFile path={self.path} format={self.format} size={self.size}>"
+
+
+    def close(self, length=None):
+        # length is how many bytes of audio were recorded, all of them if
+        # not given.
+        if self.file.closed:
+            return
+        if length is None:
+            length = self.size
+        if self.format == 'wav':
+            self.write_header(length)
+        self.buffer.release()
+        self.mmap.flush()
+        self.mmap.close()
+        self.file.truncate(self.header_size + length)
+        self.file.close()
+
+
+    def write_header(self, length):
+        sample_spec = self.sample_spec
+        format_tag, bits = WAV_FORMATS[sample_spec.format]
+        block_align = bits // 8 * sample_spec.channels
+        WAV_HEADER_STRUCT.pack_into(self.mmap, 0, b'RIFF', WAV_HEADER_STRUCT.size - 8 + length, b'WAVE', b'fmt ', 16, format_tag, sample_spec.channels, sample_spec.rate, sample_spec.rate * block_align, block_align, bits, b'data', length)
@@ -0,0 +1,152 @@
+from pypactl.command_error import CommandError
+from pypactl.error_code import ErrorCode
+from pypactl.sample_format import SAMPLE_SIZES
+
+
+class RecordStream:
+    # An audio stream from a source. Each data frame the server sends on the
+    # stream's channel is copied straight from the receive buffer into the
+    # target, a caller-supplied writable buffer or a RecordFile's mapping,
+    # so nothing is built per frame. Once the target is full the stream is
+    # corked, so the server stops sending, and further data is counted in
+    # dropped_bytes.
+    #
+    # on_data, if set, is called with each frame as a memoryview into the
+    # receive buffer, which is only valid until it returns.
+    #
+    #     stream = await controller.create_record_stream(sample_spec, source_name='alsa_output.pci.monitor', path='qa.wav', seconds=60)
+    #     await stream.wait()
+    #     await stream.close()
+    def __init__(self, protocol, channel, index, sample_spec, channel_map, buffer_attr, target=None, record_file=None):
+        self.protocol = protocol
+        self.channel = channel
+        self.index = index
+        self.sample_spec = sample_spec
+        self.channel_map = channel_map
+        self.buffer_attr = buffer_attr
+        self.source_index = None
+        self.source_name = None
+        self.suspended = False
+        self.configured_latency = None
+        self.format = None
+        self.record_file = record_file
+        self.target = None
+        self.position = 0
+        self.closed = False
+        self.corked = False
+        self.error = None
+        self.waiter = None
+        self.bytes_received = 0
+        self.dropped_bytes = 0
+        self.on_data = None
+        self.on_full = None
+        if target is not None:
+            self.set_target(target)
+
+
+    def __repr__(self):
+        return f"<RecordStream channel={self.channel} index={self.index} source_index={self.source_index} source_name={self.source_name} sample_spec={self.sample_spec} position={self.position} bytes_received={self.bytes_received} dropped_bytes={self.dropped_bytes} closed={self.closed}>"
+
+
+    async def close(self):
+        # Deletes the stream on the server and finishes the RecordFile, if
+        # there is one, at the length recorded.
+        if self.closed:
+            return
+        self.closed = True
+        registered = self.protocol.record_streams.pop(self.channel, None) is not None
+        self.fail(CommandError("The record stream is closed.", ErrorCode.PA_ERR_BADSTATE))
+        self.release_target()
+        try:
+            if registered:
+                await self.protocol.send_delete_record_stream(self.channel)
+        finally:
+            if self.record_file is not None:
+                self.record_file.close(self.position)
+
+
+    async def cork(self, paused=True):
+        self.corked = paused
+        await self.protocol.send_cork_record_stream(self.channel, paused)
+
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.protocol.record_streams.pop(self.channel, None)
+        self.wake()
+
+
+    async def flush(self):
+        # Drops whatever the server has recorded but not yet sent.
+        await self.protocol.send_flush_record_stream(self.channel)
+
+
+    def get_frame_size(self):
+        return SAMPLE_SIZES[self.sample_spec.format] * self.sample_spec.channels
+
+
+    def receive(self, data):
+        length = len(data)
+        self.bytes_received += length
+        if self.on_data is not None:
+            self.on_data(self, data)
+        target = self.target
+        if target is None:
+            return
+        position = self.position
+        count = min(length, len(target) - position)
+        target[position:position + count] = data[:count]
+        self.position = position + count
+        if count < length:
+            self.dropped_bytes += length - count
+        if self.position == len(target) and not self.corked:
+            self.corked = True
+            self.protocol.send_cork_record_stream(self.channel, True, error_callback=self.on_cork_failed)
+            if self.on_full is not None:
+                self.on_full(self)
+            self.wake()
+
+
+    def on_cork_failed(self, error_code):
+        # Nothing waits for the cork sent when the target fills up, so a
+        # failure is only logged; the extra data is counted as dropped.
+        self.protocol.logger.warning(f"Corking record stream {self.channel} failed: {error_code.name}.")
+
+
+    def release_target(self):
+        if self.target is not None:
+            self.target.release()
+            self.target = None
+
+
+    def set_target(self, buffer):
+        # Starts filling buffer from its beginning and lets go of the
+        # previous target, so read position first to know how much of that
+        # was filled. A stream that was corked because its target filled up
+        # has to be uncorked.
+        self.release_target()
+        self.target = memoryview(buffer).cast('B')
+        self.position = 0
+
+
+    async def uncork(self):
+        await self.cork(False)
+
+
+    async def wait(self):
+        # Returns once the target is full, or raises if the stream ends
+        # first.
+        while self.target is None or self.position < len(self.target):
+            if self.error is not None:
+                raise self.error
+            self.waiter = self.protocol.loop.create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+
+
+    def wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
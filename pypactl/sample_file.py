@@ -0,0 +1,110 @@
+import mmap
+import os
+import struct
+
+from pypactl.record_file import WAVE_FORMAT_ALAW, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_MULAW, WAVE_FORMAT_PCM
+from pypactl.sample_format import SAMPLE_SIZES, SampleFormat
+from pypactl.sample_spec import SampleSpec
+
+RIFF_HEADER_STRUCT = struct.Struct('<4sI4s')
+CHUNK_HEADER_STRUCT = struct.Struct('<4sI')
+# Format tag, channels, rate, byte rate, block align and bits per sample.
+FMT_STRUCT = struct.Struct('<HHIIHH')
+WAVE_FORMAT_EXTENSIBLE = 0xfffe
+# The largest sample the server's sample cache takes.
+MAX_SAMPLE_SIZE = 16 * 1024 * 1024
+# Where in an extensible fmt chunk the sub format GUID, which starts with the
+# real format tag, is.
+SUB_FORMAT_OFFSET = 24
+
+# (WAV format tag, bits per sample): sample format
+SAMPLE_FORMATS = {
+    (WAVE_FORMAT_PCM, 8): SampleFormat.U8,
+    (WAVE_FORMAT_PCM, 16): SampleFormat.S16LE,
+    (WAVE_FORMAT_PCM, 24): SampleFormat.S24LE,
+    (WAVE_FORMAT_PCM, 32): SampleFormat.S32LE,
+    (WAVE_FORMAT_IEEE_FLOAT, 32): SampleFormat.FLOAT32LE,
+    (WAVE_FORMAT_ALAW, 8): SampleFormat.ALAW,
+    (WAVE_FORMAT_MULAW, 8): SampleFormat.ULAW,
+}
+
+
+def sample_name(path):
+    # A sample is named after its file, without the extension.
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class SampleFile:
+    # A WAV file mapped into memory. data is a memoryview of its audio in
+    # the mapping, whole frames only, so it is sent from the page cache
+    # without being read into Python first.
+    def __init__(self, path):
+        self.path = path
+        self.name = sample_name(path)
+        with open(path, 'rb') as wav_file:
+            if os.fstat(wav_file.fileno()).st_size < RIFF_HEADER_STRUCT.size:
+                raise ValueError(f"{path} is too short to be a WAV file.")
+            self.mmap = mmap.mmap(wav_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.sample_spec, offset, length = self.parse()
+        except BaseException:
+            self.mmap.close()
+            raise
+        self.view = memoryview(self.mmap)
+        self.data = self.view[offset:offset + length]
+
+
+    def __repr__(self):
+        return f"<SampleFile path={self.path} name={self.name} sample_spec={self.sample_spec} length={len(self.data)}>"
+
+
+    def close(self):
+        if self.mmap.closed:
+            return
+        self.data.release()
+        self.view.release()
+        self.mmap.close()
+
+
+    def parse(self):
+        # Returns the sample spec and the offset and length of the audio.
+        buffer = self.mmap
+        riff, riff_size, wave = RIFF_HEADER_STRUCT.unpack_from(buffer, 0)
+        if riff != b'RIFF' or wave != b'WAVE':
+            raise ValueError(f"{self.path} isn't a WAV file.")
+        sample_spec = None
+        offset = RIFF_HEADER_STRUCT.size
+        while offset + CHUNK_HEADER_STRUCT.size <= len(buffer):
+            chunk_id, chunk_size = CHUNK_HEADER_STRUCT.unpack_from(buffer, offset)
+            offset += CHUNK_HEADER_STRUCT.size
+            if chunk_id == b'fmt ':
+                sample_spec = self.parse_format(buffer, offset, chunk_size)
+            elif chunk_id == b'data':
+                if sample_spec is None:
+                    raise ValueError(f"{self.path} has no fmt chunk before its data.")
+                frame_size = SAMPLE_SIZES[sample_spec.format] * sample_spec.channels
+                # A header written before the recording stopped can claim
+                # more than there is.
+                length = min(chunk_size, len(buffer) - offset)
+                return sample_spec, offset, length - length % frame_size
+            # Chunks are padded to an even length.
+            offset += chunk_size + chunk_size % 2
+        raise ValueError(f"{self.path} has no data chunk.")
+
+
+    def parse_format(self, buffer, offset, size):
+        if size < FMT_STRUCT.size or offset + size > len(buffer):
+            raise ValueError(f"{self.path} has a truncated fmt chunk.")
+        format_tag, channels, rate, byte_rate, block_align, bits = FMT_STRUCT.unpack_from(buffer, offset)
+        if format_tag == WAVE_FORMAT_EXTENSIBLE and size >= SUB_FORMAT_OFFSET + 2:
+            format_tag = struct.unpack_from('<H', buffer, offset + SUB_FORMAT_OFFSET)[0]
+        sample_format = SAMPLE_FORMATS.get((format_tag, bits))
+        if sample_format is None:
+            raise ValueError(f"{self.path} has {bits} bit samples in WAV format {format_tag:#x}, which PulseAudio doesn't take.")
+        if channels == 0:
+            raise ValueError(f"{self.path} has no channels.")
+        sample_spec = SampleSpec()
+        sample_spec.format = sample_format
+        sample_spec.channels = channels
+        sample_spec.rate = rate
+        return sample_spec
@@ -0,0 +1,34 @@
+import enum
+
+class SampleFormat(enum.IntEnum):
+    U8 = 0
+    ALAW = 1
+    ULAW = 2
+    S16LE = 3
+    S16BE = 4
+    FLOAT32LE = 5
+    FLOAT32BE = 6
+    S32LE = 7
+    S32BE = 8
+    S24LE = 9
+    S24BE = 10
+    S24_32LE = 11
+    S24_32BE = 12
+
+
+# Bytes per sample.
+SAMPLE_SIZES = {
+    SampleFormat.U8: 1,
+    SampleFormat.ALAW: 1,
+    SampleFormat.ULAW: 1,
+    SampleFormat.S16LE: 2,
+    SampleFormat.S16BE: 2,
+    SampleFormat.FLOAT32LE: 4,
+    SampleFormat.FLOAT32BE: 4,
+    SampleFormat.S32LE: 4,
+    SampleFormat.S32BE: 4,
+    SampleFormat.S24LE: 3,
+    SampleFormat.S24BE: 3,
+    SampleFormat.S24_32LE: 4,
+    SampleFormat.S24_32BE: 4,
+}
@@ -0,0 +1,7 @@
+import enum
+
+class SeekMode(enum.IntEnum):
+    RELATIVE = 0
+    ABSOLUTE = 1
+    RELATIVE_ON_READ = 2
+    RELATIVE_END = 3
@@ -0,0 +1,24 @@
+class SinkInputInfo:
+    def __init__(self):
+        self.index = None
+        self.name = None
+        self.owner_module = None
+        self.client = None
+        self.sink = None
+        self.sample_spec = None
+        self.channel_map = None
+        self.volume = None
+        self.buffer_usec = None
+        self.sink_usec = None
+        self.resample_method = None
+        self.driver = None
+        self.mute = None
+        self.proplist = {}
+        self.corked = None
+        self.has_volume = None
+        self.volume_writable = None
+        self.format = None
+
+
+    def __repr__(self):
+        return f"<SinkInputInfo index={self.index} name={self.name} owner_module={self.owner_module} client={self.client} sink={self.sink} sample_spec={self.sample_spec} channel_map={self.channel_map} volume={self.volume} buffer_usec={self.buffer_usec} sink_usec={self.sink_usec} resample_method={self.resample_method} driver={self.driver} mute={self.mute} proplist={self.proplist} corked={self.corked} has_volume={self.has_volume} volume_writable={self.volume_writable} format={self.format}>"
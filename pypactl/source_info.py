@@ -0,0 +1,31 @@
+class SourceInfo:
+    def __init__(self):
+        self.index = None
+        self.name = None
+        self.description = None
+        self.sample_spec = None
+        self.channel_map = None
+        self.owner_module = None
+        self.volume = None
+        self.mute = None
+        self.monitor_of_sink = None
+        self.monitor_of_sink_name = None
+        self.latency = None
+        self.driver = None
+        self.flags = None
+        self.proplist = {}
+        self.configured_latency = None
+        self.base_volume = None
+        self.state = None
+        self.n_volume_steps = None
+        self.card = None
+        self.n_ports = None
+        self.ports = None
+        self.ap = None
+        self.active_port = None
+        self.n_formats = None
+        self.formats = None
+
+
+    def __repr__(self):
+        return f"<SourceInfo index={self.index} name={self.name} description={self.description} sample_spec={self.sample_spec} channel_map={self.channel_map} owner_module={self.owner_module} volume={self.volume} mute={self.mute} monitor_of_sink={self.monitor_of_sink} monitor_of_sink_name={self.monitor_of_sink_name} latency={self.latency} driver={self.driver} flags={self.flags} proplist={self.proplist} configured_latency={self.configured_latency} base_volume={self.base_volume} state={self.state} n_volume_steps={self.n_volume_steps} card={self.card} n_ports={self.n_ports} ports={self.ports} ap={self.ap} n_formats={self.n_formats} formats={self.formats}>"
@@ -0,0 +1,24 @@
+class SourceOutputInfo:
+    def __init__(self):
+        self.index = None
+        self.name = None
+        self.owner_module = None
+        self.client = None
+        self.source = None
+        self.sample_spec = None
+        self.channel_map = None
+        self.buffer_usec = None
+        self.source_usec = None
+        self.resample_method = None
+        self.driver = None
+        self.proplist = {}
+        self.corked = None
+        self.volume = None
+        self.mute = None
+        self.has_volume = None
+        self.volume_writable = None
+        self.format = None
+
+
+    def __repr__(self):
+        return f"<SourceOutputInfo index={self.index} name={self.name} owner_module={self.owner_module} client={self.client} source={self.source} sample_spec={self.sample_spec} channel_map={self.channel_map} buffer_usec={self.buffer_usec} source_usec={self.source_usec} resample_method={self.resample_method} driver={self.driver} proplist={self.proplist} corked={self.corked} volume={self.volume} mute={self.mute} has_volume={self.has_volume} volume_writable={self.volume_writable} format={self.format}>"
@@ -0,0 +1,151 @@
+import asyncio
+import functools
+import logging
+
+from pypactl.error_code import ErrorCode
+from pypactl.object_store import ObjectStore
+from pypactl.subscription_event_type import SubscriptionEventType
+
+class StateCache:
+    # facility: (list request, single object request)
+    FACILITIES = {
+        SubscriptionEventType.SINK: ('send_get_sink_info_list', 'send_get_sink_info'),
+        SubscriptionEventType.SOURCE: ('send_get_source_info_list', 'send_get_source_info'),
+        SubscriptionEventType.SINK_INPUT: ('send_get_sink_input_info_list', 'send_get_sink_input_info'),
+        SubscriptionEventType.SOURCE_OUTPUT: ('send_get_source_output_info_list', 'send_get_source_output_info'),
+        SubscriptionEventType.MODULE: ('send_get_module_info_list', 'send_get_module_info'),
+        SubscriptionEventType.CLIENT: ('send_get_client_info_list', 'send_get_client_info'),
+        SubscriptionEventType.CARD: ('send_get_card_info_list', 'send_get_card_info'),
+    }
+
+    def __init__(self, loop, protocol, facilities=None, logger=logging.getLogger('pypactl')):
+        self.loop = loop
+        self.protocol = protocol
+        self.logger = logger
+        if facilities is None:
+            facilities = self.FACILITIES.keys()
+        self.objects = {SubscriptionEventType(facility): ObjectStore() for facility in facilities}
+        self.server_info = None
+        self.loaded = False
+        self.queued_events = []
+        self.in_flight = set()
+        self.stale = set()
+        self.removed = set()
+
+
+    def apply_event(self, event):
+        facility = event.facility
+        if facility == SubscriptionEventType.SERVER:
+            self.refresh_server_info()
+            return
+        if facility not in self.objects:
+            return
+        key = (facility, event.index)
+        if event.type == SubscriptionEventType.REMOVE:
+            self.objects[facility].remove(event.index)
+            self.stale.discard(key)
+            if key in self.in_flight:
+                self.removed.add(key)
+        else:
+            self.refresh(facility, event.index)
+
+
+    def close(self):
+        self.protocol.unsubscribe(self.on_event)
+
+
+    def find(self, facility, proplist=None, **attributes):
+        return self.objects[facility].find(proplist, **attributes)
+
+
+    def get(self, facility, index):
+        return self.objects[facility].get(index)
+
+
+    def get_all(self, facility):
+        return self.objects[facility].values()
+
+
+    async def load(self):
+        facilities = list(self.objects)
+        self.protocol.subscribe(self.on_event, facilities + [SubscriptionEventType.SERVER])
+        requests = [getattr(self.protocol, self.FACILITIES[facility][0])() for facility in facilities]
+        requests.append(self.protocol.send_get_server_info())
+        results = await asyncio.gather(*requests)
+        self.server_info = results.pop()
+        for facility, infos in zip(facilities, results):
+            for info in infos:
+                self.objects[facility].put(info)
+        self.loaded = True
+        queued_events = self.queued_events
+        self.queued_events = []
+        for event in queued_events:
+            self.apply_event(event)
+
+
+    def on_event(self, event):
+        if not self.loaded:
+            self.queued_events.append(event)
+            return
+        self.apply_event(event)
+
+
+    def on_refresh_failed(self, facility, index, error_code):
+        key = (facility, index)
+        self.in_flight.discard(key)
+        self.stale.discard(key)
+        self.removed.discard(key)
+        if error_code == ErrorCode.PA_ERR_NOENTITY:
+            self.objects[facility].remove(index)
+        else:
+            self.logger.error(f"Refreshing {facility.name} {index} failed: {error_code.name}.")
+
+
+    def on_refreshed(self, facility, index, info):
+        key = (facility, index)
+        self.in_flight.discard(key)
+        if key in self.removed:
+            self.removed.discard(key)
+            self.stale.discard(key)
+            return
+        self.objects[facility].put(info)
+        if key in self.stale:
+            self.stale.discard(key)
+            self.refresh(facility, index)
+
+
+    def on_server_info(self, server_info):
+        key = (SubscriptionEventType.SERVER, None)
+        self.in_flight.discard(key)
+        self.server_info = server_info
+        if key in self.stale:
+            self.stale.discard(key)
+            self.refresh_server_info()
+
+
+    def on_server_info_failed(self, error_code):
+        key = (SubscriptionEventType.SERVER, None)
+        self.in_flight.discard(key)
+        self.stale.discard(key)
+        self.logger.error(f"Refreshing server info failed: {error_code.name}.")
+
+
+    def refresh(self, facility, index):
+        key = (facility, index)
+        # Changes that arrive while a request is already out collapse into
+        # one follow-up request once it comes back.
+        if key in self.in_flight:
+            self.stale.add(key)
+            return
+        self.in_flight.add(key)
+        send = getattr(self.protocol, self.FACILITIES[facility][1])
+        send(index, callback=functools.partial(self.on_refreshed, facility, index), error_callback=functools.partial(self.on_refresh_failed, facility, index))
+
+
+    def refresh_server_info(self):
+        key = (SubscriptionEventType.SERVER, None)
+        if key in self.in_flight:
+            self.stale.add(key)
+            return
+        self.in_flight.add(key)
+        self.protocol.send_get_server_info(callback=self.on_server_info, error_callback=self.on_server_info_failed)
@@ -0,0 +1,67 @@
+compiled = {}
+
+# Turns a native_protocol_*_info module into a decode function for one
+# protocol version. Each field is (name, type[, min_version[, max_version]])
+# where type is a Packet.get_<type> suffix or ('list', count_field, element),
+# element being a type suffix or another structure module. Fields outside the
+# version range are dropped at compile time, so the generated function is
+# straight-line code with no version checks.
+#
+# With fields set, only those fields (plus the counts needed to walk lists)
+# are decoded; everything else is skipped by tag without being built. With
+# lazy_proplist set, proplists are decoded as LazyProplist views.
+def compile_structure(structure_module, version, fields=None, lazy_proplist=False):
+    if fields is not None:
+        fields = frozenset(fields)
+        unknown = fields - {field[0] for field in structure_module.structure}
+        if unknown:
+            raise ValueError(f"Unknown fields for {structure_module.__name__}: {', '.join(sorted(unknown))}.")
+    key = (structure_module.__name__, version, fields, lazy_proplist)
+    decode = compiled.get(key)
+    if decode is not None:
+        return decode
+    namespace = {'info_class': structure_module.info_class}
+    lines = [
+        'def decode(packet):',
+        '    info = info_class()',
+    ]
+    count_fields = {field[1][1] for field in structure_module.structure if isinstance(field[1], tuple)}
+    for field in structure_module.structure:
+        name, type = field[0], field[1]
+        min_version = field[2] if len(field) > 2 else 0
+        max_version = field[3] if len(field) > 3 else None
+        if version < min_version or (max_version is not None and version > max_version):
+            continue
+        wanted = fields is None or name in fields or name in count_fields
+        if isinstance(type, tuple):
+            kind, count_field, element = type
+            if kind != 'list':
+                raise ValueError(f"Unknown compound type {kind} for {name} in {structure_module.__name__}.")
+            if isinstance(element, str):
+                expression = f'packet.get_{element}()' if wanted else 'packet.skip_value()'
+            else:
+                element_decoder = f'decode_{name}'
+                element_fields = None if wanted else ()
+                namespace[element_decoder] = compile_structure(element, version, element_fields, lazy_proplist)
+                expression = f'{element_decoder}(packet)'
+            if wanted:
+                lines.append(f'    info.{name} = [{expression} for i in range(info.{count_field})]')
+            else:
+                lines.append(f'    for i in range(info.{count_field}):')
+                lines.append(f'        {expression}')
+        elif not wanted:
+            lines.append('    packet.skip_value()')
+        elif type == 'proplist' and lazy_proplist:
+            lines.append(f'    info.{name} = packet.get_lazy_proplist()')
+        else:
+            lines.append(f'    info.{name} = packet.get_{type}()')
+    finish = getattr(structure_module, 'finish', None)
+    if finish is not None:
+        namespace['finish'] = finish
+        lines.append('    finish(info)')
+    lines.append('    return info')
+    exec('\n'.join(lines), namespace)
+    decode = namespace['decode']
+    decode.source = '\n'.join(lines)
+    compiled[key] = decode
+    return decode
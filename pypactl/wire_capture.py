@@ -0,0 +1,201 @@
+import argparse
+import asyncio
+import socket
+import struct
+import time
+
+from pypactl.command import Command
+from pypactl.native_protocol import NativeProtocol
+from pypactl.packet import FRAME_HEADER_STRUCT, Packet
+
+# A capture file is MAGIC followed by records, each being RECORD_STRUCT
+# (direction, time.time() timestamp, data length, ancillary item count), the
+# ancillary items as ANCILLARY_STRUCT (level, type, length) plus their data,
+# then the data. Records are the bytes of a single socket read or write, so
+# replaying them reproduces the original chunking as well as the stream.
+MAGIC = b'PYPACAP1'
+RECORD_STRUCT = struct.Struct('!BdII')
+ANCILLARY_STRUCT = struct.Struct('!iiI')
+INBOUND = 0
+OUTBOUND = 1
+
+# Replies whose handler isn't named handle_<command>_reply.
+REPLY_METHODS = {
+    Command.GET_SERVER_INFO: 'handle_server_info_reply',
+    Command.SET_CLIENT_NAME: 'handle_properties_reply',
+}
+
+
+class CaptureRecord:
+    def __init__(self, direction, time, data, ancillary_data):
+        self.direction = direction
+        self.time = time
+        self.data = data
+        self.ancillary_data = ancillary_data
+
+
+    def __repr__(self):
+        direction = 'in' if self.direction == INBOUND else 'out'
+        return f"<CaptureRecord direction={direction} time={self.time} length={len(self.data)} ancillary_data={self.ancillary_data}>"
+
+
+class CaptureWriter:
+    # Appends records to a capture file. Writes go through the file's buffer,
+    # so the socket path only pays for a couple of memory copies.
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+
+    def inbound(self, data, ancillary_data=()):
+        self.record(INBOUND, data, ancillary_data)
+
+
+    def outbound(self, data, ancillary_data=()):
+        self.record(OUTBOUND, data, ancillary_data)
+
+
+    def record(self, direction, data, ancillary_data=()):
+        write = self.file.write
+        write(RECORD_STRUCT.pack(direction, time.time(), len(data), len(ancillary_data)))
+        for level, type, item in ancillary_data:
+            write(ANCILLARY_STRUCT.pack(level, type, len(item)))
+            write(item)
+        write(data)
+
+
+class NullTransport:
+    # Lets a replayed protocol send without a socket.
+    def get_write_buffer_size(self):
+        return 0
+
+
+    def is_closing(self):
+        return False
+
+
+    def sendmsg(self, data, ancdata=None, flags=0, address=None):
+        return sum(len(buffer) for buffer in data)
+
+
+    def write(self, data):
+        pass
+
+
+class Replayer:
+    # Feeds a capture's inbound records to protocol.msg_received. Requests in
+    # the outbound records are registered in the protocol's reply_map as they
+    # go by, so replies are decoded by the same handlers as in the original
+    # session. With real_time the original gaps between records are kept,
+    # otherwise records are fed as fast as possible.
+    def __init__(self, protocol=None, real_time=False, loop=None):
+        if loop is None:
+            loop = asyncio.get_running_loop()
+        self.loop = loop
+        if protocol is None:
+            # fast_connect keeps handle_auth_reply from sending its own
+            # SET_CLIENT_NAME; the captured one is registered instead.
+            # Without shm the replay doesn't create a memfd pool of its own.
+            protocol = NativeProtocol(loop=loop, fast_connect=True, shm=False)
+            protocol.transport = NullTransport()
+        self.protocol = protocol
+        self.real_time = real_time
+        self.outbound = bytearray()
+        self.records = 0
+        self.inbound_bytes = 0
+        self.requests = 0
+
+
+    def register_requests(self, data):
+        outbound = self.outbound
+        outbound += data
+        offset = 0
+        header_size = FRAME_HEADER_STRUCT.size
+        while len(outbound) - offset >= header_size:
+            length, channel, offset_hi, offset_lo, flags = FRAME_HEADER_STRUCT.unpack_from(outbound, offset)
+            if len(outbound) - offset < header_size + length:
+                break
+            if channel == NativeProtocol.INVALID_INDEX:
+                packet = Packet(bytes(outbound[offset + header_size:offset + header_size + length]))
+                packet.parse_command()
+                method_name = REPLY_METHODS.get(packet.command, f"handle_{packet.command.name.lower()}_reply")
+                self.protocol.setup_reply(packet.id, getattr(self.protocol, method_name, None))
+                self.requests += 1
+            offset += header_size + length
+        del outbound[:offset]
+
+
+    async def replay(self, records):
+        protocol = self.protocol
+        start = None
+        for record in records:
+            if self.real_time:
+                if start is None:
+                    start = (self.loop.time(), record.time)
+                delay = start[0] + record.time - start[1] - self.loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if record.direction == OUTBOUND:
+                self.register_requests(record.data)
+            else:
+                # File descriptors passed with SCM_RIGHTS were the original
+                # process's, so they aren't passed on.
+                ancillary_data = [item for item in record.ancillary_data if item[:2] != (socket.SOL_SOCKET, socket.SCM_RIGHTS)]
+                protocol.msg_received(record.data, ancillary_data, 0, None)
+                self.inbound_bytes += len(record.data)
+            self.records += 1
+        # Let the reply futures' callbacks run.
+        await asyncio.sleep(0)
+
+
+def read_capture(path):
+    with open(path, 'rb') as capture_file:
+        magic = capture_file.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError(f"{path} isn't a pypactl capture.")
+        while True:
+            header = capture_file.read(RECORD_STRUCT.size)
+            if len(header) < RECORD_STRUCT.size:
+                return
+            direction, timestamp, length, ancillary_count = RECORD_STRUCT.unpack(header)
+            ancillary_data = []
+            for i in range(ancillary_count):
+                level, type, item_length = ANCILLARY_STRUCT.unpack(capture_file.read(ANCILLARY_STRUCT.size))
+                ancillary_data.append((level, type, capture_file.read(item_length)))
+            data = capture_file.read(length)
+            if len(data) < length:
+                # The capturing process died part way through a record.
+                return
+            yield CaptureRecord(direction, timestamp, data, ancillary_data)
+
+
+async def replay_capture(path, real_time=False):
+    replayer = Replayer(real_time=real_time, loop=asyncio.get_running_loop())
+    records = list(read_capture(path))
+    start = time.perf_counter()
+    await replayer.replay(records)
+    elapsed = time.perf_counter() - start
+    print(f"Replayed {replayer.records} records, {replayer.requests} requests and {replayer.inbound_bytes} inbound bytes in {elapsed:.4f}s ({replayer.inbound_bytes / elapsed / (1024 * 1024):.1f} MB/s).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or replay a pypactl wire capture.")
+    parser.add_argument('command', choices=['dump', 'replay'])
+    parser.add_argument('path', help="Capture file.")
+    parser.add_argument('--real-time', action='store_true', help="Keep the original timing when replaying.")
+    args = parser.parse_args()
+    if args.command == 'dump':
+        for record in read_capture(args.path):
+            print(record)
+    else:
+        asyncio.run(replay_capture(args.path, args.real_time))
+
+
+if __name__ == "__main__":
+    main()